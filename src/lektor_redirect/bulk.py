@@ -0,0 +1,134 @@
+"""Read redirects in bulk from a data file.
+
+Besides those declared in records' ``redirect_from`` fields, redirects may be
+listed in a site-level data file, configured by the ``redirects_file``
+setting.  Each entry in the file gives a URL to redirect from, and the Lektor
+path of the record to redirect to.
+
+The file may be in one of the `FORMATS`:
+
+``csv`` or ``tsv``
+    Two columns: the URL, then the record path.
+
+``jsonl``
+    JSON lines.  Each is either an array, ``[url, path]``, or an object with
+    ``url`` and ``path`` keys.
+
+Blank lines, and lines starting with ``#``, are ignored.  The file is read as
+a stream, one line at a time.
+
+"""
+
+from __future__ import annotations
+
+import csv
+import functools
+import json
+import os
+import posixpath
+from types import MappingProxyType
+from typing import Callable, Final, Iterator, Mapping, NamedTuple, TYPE_CHECKING
+
+from lektor.reporter import reporter
+
+if TYPE_CHECKING:
+    from _typeshed import StrPath
+
+FORMATS: Final = ("csv", "tsv", "jsonl")
+
+NO_REDIRECTS: Final[Mapping[str, tuple[str, ...]]] = MappingProxyType({})
+"""The imported redirects when no redirects file is configured."""
+
+
+def guess_format(filename: StrPath) -> str:
+    """Guess the format of a redirects file from its extension."""
+    ext = os.path.splitext(filename)[1].lstrip(".").lower()
+    if ext in FORMATS:
+        return ext
+    msg = f"Can not determine the format of redirects file {os.fspath(filename)!r}"
+    raise RuntimeError(msg)
+
+
+def _parse_csv(line: str, delimiter: str) -> object:
+    return next(csv.reader([line], delimiter=delimiter))
+
+
+def _parse_jsonl(line: str) -> object:
+    item = json.loads(line)
+    if isinstance(item, dict):
+        return [item.get("url"), item.get("path")]
+    return item
+
+
+def iter_redirects_file(
+    filename: StrPath, file_format: str | None = None
+) -> Iterator[tuple[str, str]]:
+    """Iterate over the ``(url, path)`` entries in a redirects file.
+
+    Malformed entries are skipped, with a warning.
+    """
+    if file_format is None:
+        file_format = guess_format(filename)
+    parse: Callable[[str], object]
+    if file_format == "jsonl":
+        parse = _parse_jsonl
+    else:
+        parse = functools.partial(
+            _parse_csv, delimiter="\t" if file_format == "tsv" else ","
+        )
+
+    with open(filename, encoding="utf-8") as fp:
+        for lineno, line in enumerate(fp, 1):
+            if not line.strip() or line.startswith("#"):
+                continue
+            try:
+                row = parse(line)
+            except (ValueError, csv.Error):
+                row = None
+            if (
+                not isinstance(row, list)
+                or len(row) != 2
+                or not all(isinstance(field, str) and field.strip() for field in row)
+            ):
+                reporter.report_generic(f"Ignoring bad entry at {filename}:{lineno}")
+                continue
+            url, path = row
+            yield url.strip(), path.strip()
+
+
+class RedirectsFileInfo(NamedTuple):
+    """The redirects read from a redirects file."""
+
+    key: tuple[str, int, int]
+    """The file's name, modification time (in ns) and size."""
+
+    redirects: Mapping[str, tuple[str, ...]]
+    """A mapping from record path to the (normalized) URLs which redirect to it."""
+
+
+def stat_key(filename: StrPath) -> tuple[str, int, int]:
+    """Identify the version of a redirects file by its mtime and size."""
+    st = os.stat(filename)
+    return os.fspath(filename), st.st_mtime_ns, st.st_size
+
+
+def read_redirects_file(
+    filename: StrPath,
+    normalize: Callable[[str], str | None],
+    file_format: str | None = None,
+) -> RedirectsFileInfo:
+    """Read the redirects from a redirects file, grouped by target record.
+
+    URLs for which ``normalize`` returns ``None`` are skipped.
+    """
+    key = stat_key(filename)
+    redirects: dict[str, list[str]] = {}
+    for url, path in iter_redirects_file(filename, file_format):
+        normalized = normalize(url)
+        if normalized is None:
+            continue
+        path = posixpath.normpath("/" + path.strip("/"))
+        redirects.setdefault(path, []).append(normalized)
+    return RedirectsFileInfo(
+        key, {path: tuple(sorted(set(urls))) for path, urls in redirects.items()}
+    )
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Final
+from typing import Any, Final, Sequence
 
 from lektor.db import Record
 
@@ -51,3 +51,28 @@ class AmbiguousRedirectException(ConflictingRedirectException):
     @property
     def reason(self) -> str:
         return f"conflicts with redirect {self.url_path!r} => {self.conflict!r}"
+
+
+class RedirectCycleException(InvalidRedirectException):
+    """Following a chain of redirects leads to a cycle."""
+
+    def __init__(self, url_path: str, target: Record, cycle: Sequence[str]) -> None:
+        super().__init__(url_path, target, tuple(cycle))
+        self.cycle = tuple(cycle)
+
+    @property
+    def reason(self) -> str:
+        urls = " => ".join(repr(url) for url in (*self.cycle, self.cycle[0]))
+        return f"redirect leads to a cycle: {urls}"
+
+
+class InvalidRedirectRegexException(InvalidRedirectException):
+    """The regular expression of a regex redirect does not compile."""
+
+    def __init__(self, url_path: str, target: Record, error: str) -> None:
+        super().__init__(url_path, target, error)
+        self.error = error
+
+    @property
+    def reason(self) -> str:
+        return f"invalid regular expression: {self.error}"
@@ -0,0 +1,791 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import posixpath
+import re
+import threading
+from typing import (
+    Final,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    TYPE_CHECKING,
+)
+
+from lektor.db import Pad, Record
+from lektor.pluginsystem import get_plugin
+from lektor.reporter import reporter
+from lektor.sourceobj import SourceObject
+from lektorlib.context import disable_dependency_recording
+
+from .exceptions import (
+    AmbiguousRedirectException,
+    InvalidRedirectException,
+    InvalidRedirectRegexException,
+    RedirectCycleException,
+    RedirectShadowsExistingRecordException,
+    RedirectToSelfException,
+)
+from .prefixes import is_wildcard_url, PrefixTrie, WILDCARD, wildcard_prefix
+from .regexes import check_regex_url, is_regex_url, regex_pattern, RegexMatcher
+from .scanner import ScannedRecord
+from .sources import Redirect
+from .store import Signature, stat_signature
+from .util import collapse_chains, RecordInfo, source_key
+
+if TYPE_CHECKING:
+    from _typeshed import StrPath
+
+    from .plugin import RedirectPlugin
+
+
+OK: Final = "ok"
+SELF: Final = "self"
+SHADOWS_RECORD: Final = "shadows-record"
+AMBIGUOUS: Final = "ambiguous"
+CYCLE: Final = "cycle"
+INVALID_REGEX: Final = "invalid-regex"
+
+
+class Verdict(NamedTuple):
+    """The classification of a redirect from a URL path to a record."""
+
+    status: str
+    """One of `OK`, `SELF`, `SHADOWS_RECORD`, `AMBIGUOUS`, `CYCLE` or
+    `INVALID_REGEX`."""
+    conflict: str | None = None
+    """The path of the conflicting record (or other source), if any.
+
+    For `INVALID_REGEX`, this is the error message.
+    """
+
+
+_OK_VERDICT: Final = Verdict(OK)
+
+_INFO_HASH_SIZE: Final = 16
+
+
+def _strings_hash(*strings: str) -> int:
+    data = "\0".join(strings).encode()
+    digest = hashlib.blake2b(data, digest_size=_INFO_HASH_SIZE).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _info_hash(info: RecordInfo) -> int:
+    """Hash a record's info for the index's (order-independent) fingerprint."""
+    return _strings_hash(info.path, info.url_path, *info.redirect_urls)
+
+
+def _affected_url_paths(info: RecordInfo) -> tuple[str, ...]:
+    """The URL paths whose verdicts may change when ``info`` is (un)indexed."""
+    subtree = info.url_path.rstrip("/") + "/" + WILDCARD
+    return (*info.redirect_urls, info.url_path, subtree)
+
+
+class RedirectIndex(Mapping[str, Record]):
+    """An index of all the redirects declared in a site.
+
+    Each declared redirect is classified (as a `Verdict`) when the index is
+    built, so that checking for conflicts is cheap.
+
+    If ``collapse_chains`` is set, chains of redirects are resolved to their
+    final targets.  A chain is formed when the target of one redirect is the
+    URL of a record which is itself (re)declared as a redirect by another
+    record.  Redirects whose chains lead to a cycle are classified as `CYCLE`.
+
+    Prefix redirects (see `lektor_redirect.prefixes`) are indexed under their
+    wildcard URLs.  Their prefixes are also kept in a `PrefixTrie`.  Likewise,
+    regex redirects (see `lektor_redirect.regexes`) are indexed under their
+    declared values.  They are combined into a single `RegexMatcher` when
+    first needed.
+
+    The redirect URLs declared for each record are also kept, so that the
+    redirects to a record can be found without searching the whole index.
+    """
+
+    _redirects: dict[str, list[str]]
+    _records_by_url: dict[str, str]
+    _url_paths: dict[str, str]
+    _declared: dict[str, tuple[str, ...]]
+    _shadows: dict[str, str | None]
+    _verdicts: dict[str, dict[str, Verdict]]
+    _prefixes: PrefixTrie
+    _reported: set[tuple[str, str]]
+    _chains: tuple[dict[str, str], dict[str, tuple[str, ...]]] | None
+    _regex_matcher: RegexMatcher | None
+
+    def __init__(
+        self,
+        pad: Pad,
+        record_infos: Iterable[RecordInfo] | None = None,
+        artifact_url_paths: Mapping[str, str] | None = None,
+        collapse_chains: bool = False,
+        imported_redirects: Mapping[str, Sequence[str]] | None = None,
+    ) -> None:
+        """Build the index.
+
+        If ``artifact_url_paths`` (a mapping from URL path to source path) is
+        given, it is taken to be complete: redirect URLs are checked for
+        conflicts against it rather than by resolving them, one by one, through
+        Lektor.
+
+        If ``imported_redirects`` (a mapping from record path to redirect
+        URLs, e.g. read from a redirects file) is given, the URLs are treated
+        as if they were declared by the records, in addition to their own.
+        """
+        if record_infos is None:
+            plugin = get_plugin("redirect", env=pad.env)  # FIXME: abstract
+            record_infos = plugin.iter_record_infos(pad)
+
+        self.pad = pad
+        self.collapse_chains = collapse_chains
+        self._redirects = {}
+        self._records_by_url = {}
+        self._url_paths = {}
+        self._declared = {}
+        self._shadows = {}
+        self._artifact_url_paths = artifact_url_paths
+        self._artifacts_digest = b""
+        if artifact_url_paths is not None:
+            h = hashlib.md5()
+            for item in sorted(artifact_url_paths.items()):
+                h.update("\0".join(item).encode() + b"\0")
+            self._artifacts_digest = h.digest()
+        self._fingerprint = 0
+        self._verdicts = {}
+        self._prefixes = PrefixTrie()
+        self._reported = set()
+        self._chains = None
+        self._regex_matcher = None
+        self._imported = imported_redirects if imported_redirects is not None else {}
+        self._update((), record_infos)
+        for path in self._imported:
+            if path not in self._url_paths:
+                reporter.report_generic(
+                    f"Ignoring imported redirects to missing record {path!r}"
+                )
+
+    def _with_imports(self, info: RecordInfo) -> RecordInfo:
+        imported = self._imported.get(info.path)
+        if not imported:
+            return info
+        redirect_urls = tuple(sorted({*info.redirect_urls, *imported}))
+        return info._replace(redirect_urls=redirect_urls)
+
+    def _update(
+        self, removed: Iterable[RecordInfo], added: Iterable[RecordInfo]
+    ) -> None:
+        affected: set[str] = set()
+        for info in map(self._with_imports, removed):
+            self._remove_info(info)
+            affected.update(_affected_url_paths(info))
+        for info in map(self._with_imports, added):
+            self._add_info(info)
+            affected.update(_affected_url_paths(info))
+
+        for url_path in affected:
+            if is_wildcard_url(url_path):
+                if url_path in self._redirects:
+                    self._prefixes.add(wildcard_prefix(url_path))
+                else:
+                    self._prefixes.discard(wildcard_prefix(url_path))
+
+        self._reclassify(affected)
+
+    def _remove_info(self, info: RecordInfo) -> None:
+        redirects = self._redirects
+        self._fingerprint ^= _info_hash(info)
+        for url_path in info.redirect_urls:
+            targets = [
+                path for path in redirects.get(url_path, ()) if path != info.path
+            ]
+            if targets:
+                redirects[url_path] = targets
+            else:
+                redirects.pop(url_path, None)
+        self._url_paths.pop(info.path, None)
+        self._declared.pop(info.path, None)
+        if self._records_by_url.get(info.url_path) == info.path:
+            del self._records_by_url[info.url_path]
+
+    def _add_info(self, info: RecordInfo) -> None:
+        redirects = self._redirects
+        self._fingerprint ^= _info_hash(info)
+        for url_path in info.redirect_urls:
+            if url_path == info.url_path:
+                continue  # ignore redirects to self
+            targets = redirects.get(url_path, [])
+            if info.path not in targets:
+                redirects[url_path] = sorted([*targets, info.path])
+        self._records_by_url[info.url_path] = info.path
+        self._url_paths[info.path] = info.url_path
+        if info.redirect_urls:
+            self._declared[info.path] = info.redirect_urls
+
+    def _reclassify(self, url_paths: Iterable[str]) -> None:
+        redirects = self._redirects
+        for url_path in url_paths:
+            self._shadows.pop(url_path, None)
+            if url_path in redirects:
+                self._verdicts[url_path] = {
+                    path: self._classify(url_path, path) for path in redirects[url_path]
+                }
+            else:
+                self._verdicts.pop(url_path, None)
+
+    @property
+    def fingerprint(self) -> str:
+        """A hash of the information from which the index was built.
+
+        This is computed from the paths, URL paths and declared redirects of
+        all indexed records (and, if given, the artifact URL paths).  It is
+        maintained incrementally as the index is updated.
+
+        Redirects may also be shadowed by sources other than records (e.g.
+        assets, or sources generated by other plugins), so the verdicts of
+        all shadowed redirects are included, too.
+        """
+        shadows = 0
+        for url_path, verdicts in self._verdicts.items():
+            for target_path, verdict in verdicts.items():
+                if verdict.status in (SELF, SHADOWS_RECORD):
+                    assert verdict.conflict is not None
+                    shadows ^= _strings_hash(url_path, target_path, verdict.conflict)
+        h = hashlib.md5(self._fingerprint.to_bytes(_INFO_HASH_SIZE, "big"))
+        h.update(shadows.to_bytes(_INFO_HASH_SIZE, "big"))
+        h.update(self._artifacts_digest)
+        return h.hexdigest()
+
+    def _find_shadow(self, url_path: str) -> str | None:
+        """Find the path of the existing source, if any, at ``url_path``."""
+        path = self._records_by_url.get(url_path)
+        if path is not None:
+            return path
+        if self._artifact_url_paths is not None:
+            return self._artifact_url_paths.get(url_path)
+        try:
+            return self._shadows[url_path]
+        except KeyError:
+            pass
+        with disable_dependency_recording(), Redirect.disable_url_resolution():
+            existing = self.pad.resolve_url_path(url_path)
+        path = self._shadows[url_path] = source_key(existing) if existing else None
+        return path
+
+    def _classify(self, url_path: str, target_path: str) -> Verdict:
+        if is_regex_url(url_path):
+            error = check_regex_url(url_path)
+            if error is not None:
+                return Verdict(INVALID_REGEX, error)
+            target_url = self._url_paths.get(target_path)
+            regex = regex_pattern(url_path)
+            if target_url is not None and re.search(regex, target_url):
+                # The regex matches the target itself
+                return Verdict(SHADOWS_RECORD, target_path)
+            existing_path = None
+        elif is_wildcard_url(url_path):
+            prefix = wildcard_prefix(url_path)
+            target_url = self._url_paths.get(target_path, "")
+            if target_url.startswith(prefix) and target_url != prefix:
+                # The prefix covers the target itself
+                return Verdict(SHADOWS_RECORD, target_path)
+            existing_path = self._find_shadow(prefix)
+        else:
+            existing_path = self._find_shadow(url_path)
+        if existing_path == target_path:
+            return Verdict(SELF, existing_path)
+        if existing_path is not None:
+            return Verdict(SHADOWS_RECORD, existing_path)
+        for conflict_path in self._redirects.get(url_path, ()):
+            if conflict_path != target_path:
+                return Verdict(AMBIGUOUS, conflict_path)
+        return _OK_VERDICT
+
+    def _get_chains(self) -> tuple[dict[str, str], dict[str, tuple[str, ...]]]:
+        """Resolve the chains of redirects.
+
+        This is computed once per set of tables, in time linear in the number
+        of redirects.  See `collapse_chains`.
+        """
+        if self._chains is None:
+            links = {}
+            for url_path, targets in self._redirects.items():
+                target_path = targets[0]
+                status = self._verdicts[url_path][target_path].status
+                # A redirect from the URL of another record continues any
+                # chain which passes through that record
+                if status == OK or (
+                    status == SHADOWS_RECORD and url_path in self._records_by_url
+                ):
+                    links[url_path] = self._url_paths[target_path]
+            self._chains = collapse_chains(links)
+        return self._chains
+
+    def _check_chain(self, url_path: str, verdict: Verdict) -> Verdict:
+        if self.collapse_chains and verdict.status == OK:
+            if url_path in self._get_chains()[1]:
+                return Verdict(CYCLE)
+        return verdict
+
+    def get_verdict(self, url_path: str, target: Record) -> Verdict:
+        """Classify a redirect from ``url_path`` to ``target``."""
+        try:
+            verdict = self._verdicts[url_path][target.path]
+        except KeyError:
+            if target.url_path == url_path:
+                return Verdict(SELF, target.path)
+            return self._classify(url_path, target.path)
+        return self._check_chain(url_path, verdict)
+
+    def _is_ok(self, url_path: str) -> bool:
+        """Check that the (declared) redirect from ``url_path`` is OK."""
+        target_path = self._redirects[url_path][0]
+        return self._verdicts[url_path][target_path].status == OK
+
+    def get_prefix_target(self, url_path: str) -> Record | None:
+        """Find the target of ``url_path`` by way of a prefix redirect.
+
+        The longest declared (and valid) prefix of ``url_path`` is found.
+        The target is the record at the corresponding URL path below the
+        target of the prefix redirect.  Returns `None` if there is no such
+        prefix, or no such record.
+        """
+        prefix = self._prefixes.longest_prefix(url_path)
+        if prefix is None:
+            return None
+        wildcard_url = prefix + WILDCARD
+        if not self._is_ok(wildcard_url):
+            return None
+        target_path = self._redirects[wildcard_url][0]
+        target_url = self._url_paths[target_path] + url_path[len(prefix) :]
+        path = self._records_by_url.get(target_url)
+        if path is not None:
+            return self._get_record(path)
+        with disable_dependency_recording(), Redirect.disable_url_resolution():
+            target = self.pad.resolve_url_path(target_url)
+        return target if isinstance(target, Record) else None
+
+    def get_regex_target(self, url_path: str) -> Record | None:
+        """Find the target of ``url_path`` by way of a regex redirect.
+
+        All the (valid) regex redirects are tried at once.  Returns `None`
+        if none match.
+        """
+        if self._regex_matcher is None:
+            self._regex_matcher = RegexMatcher(
+                regex_url
+                for regex_url in sorted(filter(is_regex_url, self._redirects))
+                if self._is_ok(regex_url)
+            )
+        regex_url = self._regex_matcher.match(url_path)
+        if regex_url is None:
+            return None
+        return self[regex_url]
+
+    def get_declared_urls(self, path: str) -> tuple[str, ...]:
+        """Get the URLs declared as redirecting to the record at ``path``.
+
+        These include any imported redirects.  They are sorted, and not
+        checked for conflicts.
+        """
+        return self._declared.get(path, ())
+
+    def get_redirect_urls(self, path: str) -> tuple[str, ...]:
+        """Get the (exact) URLs which validly redirect to the record at ``path``.
+
+        The URLs are sorted.  Prefix and regex redirects are not included.
+        """
+        redirect_urls = []
+        for url_path in self._declared.get(path, ()):
+            if is_wildcard_url(url_path) or is_regex_url(url_path):
+                continue
+            verdict = self._verdicts.get(url_path, {}).get(path)
+            if verdict is None:
+                continue  # a redirect to self
+            if self._check_chain(url_path, verdict).status == OK:
+                redirect_urls.append(url_path)
+        return tuple(redirect_urls)
+
+    def get_final_target(self, url_path: str) -> Record:
+        """Get the final target of the redirect from ``url_path``.
+
+        Unless ``collapse_chains`` is set, this is simply the target of the
+        redirect.  Otherwise, any chain of redirects is followed to its end.
+
+        Raises `KeyError` if no redirect from ``url_path`` is declared, or
+        `RedirectCycleException` if the chain leads to a cycle.
+        """
+        target = self[url_path]
+        if not self.collapse_chains:
+            return target
+        final, cycles = self._get_chains()
+        if url_path in cycles:
+            raise RedirectCycleException(url_path, target, cycles[url_path])
+        final_path = self._records_by_url.get(final.get(url_path, ""))
+        if final_path is None or final_path == target.path:
+            return target
+        return self._get_record(final_path)
+
+    def bind(self, pad: Pad) -> RedirectIndex:
+        """Return a copy of the index which loads records from ``pad``.
+
+        The copy shares its (treated as immutable) tables with this index.
+        """
+        index = object.__new__(type(self))
+        index.__dict__.update(self.__dict__)
+        index.pad = pad
+        index._reported = set()
+        return index
+
+    def updated(
+        self,
+        removed: Iterable[RecordInfo],
+        added: Iterable[RecordInfo],
+        imported_redirects: Mapping[str, Sequence[str]] | None = None,
+    ) -> RedirectIndex:
+        """Return an updated copy of the index.
+
+        The redirects declared by the records in ``removed`` are removed
+        from the copy, then those from ``added`` are added.
+
+        If ``imported_redirects`` is given, it replaces the imported
+        redirects after the removal and before the addition.  (The records
+        whose imported redirects have changed should be both removed and
+        added.)
+        """
+        index = self.bind(self.pad)
+        index._redirects = dict(self._redirects)
+        index._records_by_url = dict(self._records_by_url)
+        index._url_paths = dict(self._url_paths)
+        index._declared = dict(self._declared)
+        index._shadows = dict(self._shadows)
+        index._verdicts = dict(self._verdicts)
+        index._prefixes = self._prefixes.copy()
+        index._chains = None
+        index._regex_matcher = None
+        if imported_redirects is None:
+            index._update(removed, added)
+        else:
+            index._update(removed, ())
+            index._imported = imported_redirects
+            index._update((), added)
+        return index
+
+    def _get_record(self, path: str) -> Record:
+        with disable_dependency_recording():
+            return self.pad.get(path, persist=False)
+
+    def _get_source(self, key: str) -> SourceObject:
+        """Get a source given its `source_key`."""
+        source = self._get_record(key)
+        if source is None:
+            with disable_dependency_recording(), Redirect.disable_url_resolution():
+                source = self.pad.resolve_url_path(key)
+        return source
+
+    def __getitem__(self, key: str, /) -> Record:
+        targets = self._redirects[key]
+        assert len(targets) > 0
+        return self._get_record(targets[0])
+
+    def __len__(self) -> int:
+        return len(self._redirects)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._redirects)
+
+    def iter_valid_redirects(
+        self, warn_on_conflict: bool = True
+    ) -> Iterator[tuple[str, str]]:
+        """Iterate over the redirects which do not conflict, in no particular order.
+
+        Yields ``(url_path, target_url_path)`` pairs.  Target records are only
+        loaded in order to report conflicts.  If ``collapse_chains`` is set,
+        the final target of each chain of redirects is yielded.
+        """
+        final = self._get_chains()[0] if self.collapse_chains else {}
+        for url_path, targets in self._redirects.items():
+            target_path = targets[0]
+            verdict = self._check_chain(url_path, self._verdicts[url_path][target_path])
+            if verdict.status == OK:
+                yield url_path, final.get(url_path, self._url_paths[target_path])
+            elif warn_on_conflict:
+                self.is_conflict(url_path, self._get_record(target_path))
+
+    def raise_on_conflict(self, url_path: str, target: Record) -> None:
+        status, conflict_path = self.get_verdict(url_path, target)
+        if status == SELF:
+            raise RedirectToSelfException(url_path, target)
+        if status == CYCLE:
+            cycle = self._get_chains()[1][url_path]
+            raise RedirectCycleException(url_path, target, cycle)
+        if status == INVALID_REGEX:
+            assert conflict_path is not None
+            raise InvalidRedirectRegexException(url_path, target, conflict_path)
+        if status != OK:
+            assert conflict_path is not None
+            if status == SHADOWS_RECORD:
+                conflict = self._get_source(conflict_path)
+                raise RedirectShadowsExistingRecordException(url_path, target, conflict)
+            conflict = self._get_record(conflict_path)
+            raise AmbiguousRedirectException(url_path, target, conflict)
+
+    def is_conflict(
+        self, url_path: str, target: Record, warn_on_conflict: bool = True
+    ) -> bool:
+        """Check if redirect conflicts with another declared redirect.
+
+        If there is no conflict, returns `False`.
+
+        If the redirect is ambiguous, or conflicts with another record, a warning
+        is issued via Lektor's reporter, and `True` is returned.  Each warning
+        is issued at most once per index.
+
+        """
+        verdict = self.get_verdict(url_path, target)
+        if verdict.status == OK:
+            return False
+        if warn_on_conflict and (url_path, target.path) not in self._reported:
+            self._reported.add((url_path, target.path))
+            self._warn(url_path, target)
+        return True
+
+    def _warn(self, url_path: str, target: Record) -> None:
+        try:
+            self.raise_on_conflict(url_path, target)
+        except RedirectToSelfException as ex:
+            if reporter.verbosity >= 1:
+                reporter.report_generic(f"Ignoring redirect: {ex}")
+        except InvalidRedirectException as ex:
+            reporter.report_generic(f"Invalid redirect: {ex}")
+
+
+def _is_within(filename: StrPath, path: StrPath) -> bool:
+    relpath = os.path.relpath(os.path.abspath(filename), path)
+    return relpath != os.pardir and not relpath.startswith(os.pardir + os.sep)
+
+
+class LiveIndex:
+    """A long-lived redirect index, which is patched as source files change.
+
+    This is used by the Lektor dev server.  The index is built by a full walk
+    of the site the first time it is needed.  Thereafter, as changes to source
+    files are reported via `invalidate` (or found by `poll`), only the
+    affected records are rescanned.
+
+    Changes to assets may change which redirects shadow existing artifacts.
+    They, and any change at all when ``bulk_shadow_check`` is enabled, cause
+    the index to be rebuilt from the scanned records, without rescanning.
+    """
+
+    def __init__(self, plugin: RedirectPlugin):
+        self.plugin = plugin
+        env = plugin.env
+        self.content_path = os.path.join(env.root_path, "content")
+        self.asset_paths = [
+            os.path.join(root, "assets") for root in (env.root_path, *env.theme_paths)
+        ]
+        self.config_paths = [
+            os.path.join(root, subdir)
+            for root in (env.root_path, *env.theme_paths)
+            for subdir in ("models", "configs")
+        ]
+        if env.project.project_file:
+            self.config_paths.append(env.project.project_file)
+        self._lock = threading.Lock()
+        self._index: RedirectIndex | None = None
+        self._scanned: dict[str, ScannedRecord] = {}
+        self._dirty: set[str] = set()
+        self._assets_changed = False
+        self._signatures: dict[str, Signature] = {}
+
+    def invalidate(self, filenames: Iterable[StrPath]) -> None:
+        """Note that the given source files have changed."""
+        with self._lock:
+            for filename in filenames:
+                path = self._content_path_from_filename(filename)
+                if path is not None:
+                    self._dirty.add(path)
+                elif any(_is_within(filename, p) for p in self.config_paths):
+                    # Changes to models, the project file or configuration
+                    # may affect anything.
+                    self._index = None
+                elif any(_is_within(filename, p) for p in self.asset_paths):
+                    self._assets_changed = True
+
+    def poll(self) -> None:
+        """Invalidate the source files which have changed since the last poll.
+
+        Changes are found by comparing the mtimes and sizes of the files in the
+        content, asset and configuration directories with those seen last time
+        (or when the index was last built by a full walk).
+        """
+        signatures = self._stat_sources()
+        with self._lock:
+            old, self._signatures = self._signatures, signatures
+        self.invalidate(
+            filename
+            for filename in old.keys() | signatures.keys()
+            if old.get(filename) != signatures.get(filename)
+        )
+
+    def _stat_sources(self) -> dict[str, Signature]:
+        signatures = {}
+        for top in (self.content_path, *self.asset_paths, *self.config_paths):
+            if os.path.isfile(top):
+                signatures[top] = stat_signature(top)
+            for dirpath, dirnames, filenames in os.walk(top):
+                # Directories are included, so that deletions are noticed
+                for name in (*dirnames, *filenames):
+                    filename = os.path.join(dirpath, name)
+                    signatures[filename] = stat_signature(filename)
+        return signatures
+
+    def _content_path_from_filename(self, filename: StrPath) -> str | None:
+        if not _is_within(filename, self.content_path):
+            return None
+        relpath = os.path.relpath(os.path.abspath(filename), self.content_path)
+        path = "/" + relpath.replace(os.sep, "/")
+        if posixpath.basename(path) == "contents.lr":
+            path = posixpath.dirname(path)
+        elif path.endswith(".lr"):
+            path = path[:-3]
+        return posixpath.normpath(path)
+
+    def get_index(self, pad: Pad) -> RedirectIndex:
+        """Get an up-to-date redirect index, bound to ``pad``."""
+        with self._lock:
+            if self._index is None:
+                self.plugin.full_walks += 1
+                self._signatures = self._stat_sources()
+                scanner = self.plugin.make_scanner(pad)
+                self._scanned = {
+                    scanned.path: scanned
+                    for scanned in scanner.walk(workers=self.plugin.scan_workers)
+                }
+                self._dirty.clear()
+                self._index = self._rebuild(pad)
+            else:
+                rebuild = self._assets_changed or (
+                    self._dirty and self.plugin.bulk_shadow_check
+                )
+                if self._dirty:
+                    self._index = self._patch(pad)
+                imported = self.plugin.get_imported_redirects(pad)
+                if rebuild:
+                    self._index = self._rebuild(pad)
+                elif imported is not self._index._imported:
+                    self._index = self._reimport(pad, imported)
+            return self._index.bind(pad)
+
+    def _rebuild(self, pad: Pad) -> RedirectIndex:
+        """Build a fresh index from the scanned records."""
+        self._assets_changed = False
+        artifact_url_paths = None
+        if self.plugin.bulk_shadow_check:
+            artifact_url_paths = self.plugin.collect_artifact_url_paths(pad)
+        return RedirectIndex(
+            pad,
+            [scanned.record_info for scanned in self._scanned.values()],
+            artifact_url_paths=artifact_url_paths,
+            collapse_chains=self.plugin.collapse_chains,
+            imported_redirects=self.plugin.get_imported_redirects(pad),
+        )
+
+    def _reimport(
+        self, pad: Pad, imported: Mapping[str, Sequence[str]]
+    ) -> RedirectIndex:
+        """Patch the index after the imported redirects have changed."""
+        assert self._index is not None
+        old = self._index._imported
+        changed = [
+            self._scanned[path].record_info
+            for path in {*old, *imported}
+            if old.get(path) != imported.get(path) and path in self._scanned
+        ]
+        return self._index.bind(pad).updated(changed, changed, imported)
+
+    def _patch(self, pad: Pad) -> RedirectIndex:
+        assert self._index is not None
+        scanner = self.plugin.make_scanner(pad)
+        patch = _Patch(self._scanned)
+
+        # Process parents before children
+        dirty = sorted(self._dirty, key=lambda p: (p.count("/"), p))
+        self._dirty.clear()
+        for path in dirty:
+            parent = self._scanned.get(posixpath.dirname(path)) if path != "/" else None
+            is_attachment = _source_kind(pad, path)
+            if is_attachment is None or (parent is None and path != "/"):
+                # Record deleted, or its parent is hidden or missing
+                patch.remove_subtree(path)
+                continue
+
+            old = self._scanned.get(path)
+            new = scanner.scan(path, is_attachment, parent)
+            if new is None or new.hidden:
+                patch.remove_subtree(path)
+                continue
+            patch.replace(path, old, new)
+
+            if not is_attachment and (
+                old is None
+                or (old.url_path, old.model, old.hidden)
+                != (new.url_path, new.model, new.hidden)
+            ):
+                # The change may affect the record's descendants
+                for child_path, child_is_attachment in scanner.iter_children(path):
+                    patch.remove_subtree(child_path)
+                    for child in scanner.walk_subtree(
+                        scanner.scan, child_path, child_is_attachment, new
+                    ):
+                        patch.replace(child.path, None, child)
+
+        return self._index.bind(pad).updated(
+            (scanned.record_info for scanned in patch.removed.values()),
+            (scanned.record_info for scanned in patch.added.values()),
+        )
+
+
+def _source_kind(pad: Pad, path: str) -> bool | None:
+    """Determine whether ``path`` is a page or an attachment.
+
+    Returns ``False`` for a page, ``True`` for an attachment, or ``None``
+    if the record no longer exists.
+    """
+    fs_path = pad.db.to_fs_path(path)
+    if os.path.isfile(os.path.join(fs_path, "contents.lr")):
+        return False
+    filename = os.path.basename(fs_path)
+    if (
+        os.path.isfile(fs_path)
+        and not filename.endswith(".lr")
+        and not pad.env.is_uninteresting_source_name(filename)
+    ):
+        return True
+    return None
+
+
+class _Patch:
+    """Track the changes made to `LiveIndex._scanned` while patching."""
+
+    def __init__(self, scanned: dict[str, ScannedRecord]):
+        self.scanned = scanned
+        self.removed: dict[str, ScannedRecord] = {}
+        self.added: dict[str, ScannedRecord] = {}
+
+    def replace(self, path: str, old: ScannedRecord | None, new: ScannedRecord) -> None:
+        # Only records which were in the index before patching are "removed"
+        if old is not None and path not in self.added:
+            self.removed.setdefault(path, old)
+        self.scanned[path] = self.added[path] = new
+
+    def remove_subtree(self, path: str) -> None:
+        prefix = path.rstrip("/") + "/"
+        for p in [p for p in self.scanned if p == path or p.startswith(prefix)]:
+            old = self.scanned.pop(p)
+            if self.added.pop(p, None) is None:
+                self.removed.setdefault(p, old)
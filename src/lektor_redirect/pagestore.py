@@ -0,0 +1,95 @@
+"""Deduplicated storage for redirect pages.
+
+When the ``hardlink_pages`` setting is enabled, each distinct redirect page
+is written only once, to a file in the `STORE_DIR` directory of the output
+tree, named by the hash of its content.  Each redirect page artifact is then
+a hard link to that file.  Lektor still builds, tracks and prunes each page
+as a separate artifact: only the bytes on disk are shared.
+
+Files in the store to which no redirect page links any longer are removed by
+`PageStore.sweep`.
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from contextlib import suppress
+from typing import Final, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from _typeshed import StrPath
+
+STORE_DIR: Final = ".redirect-pages"
+
+_SUFFIX: Final = ".html"
+
+
+class PageStore:
+    """A content-addressed store of redirect pages, within an output tree."""
+
+    def __init__(self, output_path: StrPath):
+        self.path = os.path.join(output_path, STORE_DIR)
+
+    def store(self, content: bytes) -> str:
+        """Store ``content``, unless it is already stored.
+
+        Returns the filename of the stored copy.
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        filename = os.path.join(self.path, digest + _SUFFIX)
+        if not os.path.exists(filename):
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_filename = tempfile.mkstemp(dir=self.path, prefix=".tmp")
+            try:
+                # Every page linking to the file shares its mode: use the
+                # one Lektor gives its artifacts, rather than mkstemp's 0600.
+                os.chmod(tmp_filename, 0o644)
+                with os.fdopen(fd, "wb") as fp:
+                    fp.write(content)
+                os.replace(tmp_filename, filename)
+            except BaseException:
+                with suppress(OSError):
+                    os.unlink(tmp_filename)
+                raise
+        return filename
+
+    def link(self, content: bytes, dst_filename: str) -> str:
+        """Make a new hard link to the stored copy of ``content``.
+
+        The link is made in the directory of ``dst_filename``, under a
+        temporary name, which is returned.  The caller should rename it into
+        place.  Raises `OSError` if hard links are not supported.
+        """
+        stored = self.store(content)
+        dst_dir = os.path.dirname(dst_filename)
+        os.makedirs(dst_dir, exist_ok=True)
+        fd, link_filename = tempfile.mkstemp(
+            dir=dst_dir, prefix=f".{os.path.basename(dst_filename)}."
+        )
+        os.close(fd)
+        os.unlink(link_filename)
+        os.link(stored, link_filename)
+        return link_filename
+
+    def sweep(self) -> int:
+        """Remove the stored pages which are no longer linked to.
+
+        Returns the number of files removed.
+        """
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            filename = os.path.join(self.path, name)
+            with suppress(FileNotFoundError):
+                if os.stat(filename).st_nlink <= 1:
+                    os.unlink(filename)
+                    removed += 1
+        return removed
@@ -1,27 +1,57 @@
 from __future__ import annotations
 
+import hashlib
+import os
+import threading
 import weakref
-from collections import defaultdict
-from contextlib import suppress
+from concurrent.futures import Future
+from contextlib import nullcontext, suppress
 from pathlib import Path
-from typing import Any, Iterator, Mapping, MutableMapping
+from typing import Any, Iterable, Iterator, Mapping, MutableMapping, NamedTuple
 from urllib.parse import urljoin
 
 from inifile import IniFile
 from lektor.builder import Builder
+from lektor.context import get_ctx
 from lektor.db import Pad, Record
 from lektor.environment import Environment
-from lektor.pluginsystem import get_plugin, Plugin
+from lektor.pluginsystem import Plugin
 from lektor.reporter import reporter
-
-from .exceptions import (
-    AmbiguousRedirectException,
-    InvalidRedirectException,
-    RedirectShadowsExistingRecordException,
-    RedirectToSelfException,
+from lektor.sourceobj import VirtualSourceObject
+
+from .bulk import NO_REDIRECTS, read_redirects_file, RedirectsFileInfo, stat_key
+from .index import LiveIndex, RedirectIndex
+from .pagestore import PageStore
+from .prefixes import is_wildcard_url, normalize_wildcard_url, WILDCARD
+from .regexes import is_regex_url
+from .scanner import RecordScanner, ScannedRecord
+from .sharding import (
+    fingerprint_shards,
+    get_shard_key,
+    SHARD_BY_HASH,
+    SHARD_METHODS,
+)
+from .sources import (
+    Redirect,
+    RedirectMap,
+    RedirectMapHashSizes,
+    RedirectMapShard,
+    RedirectUrls,
+)
+from .store import compute_fingerprint, get_store_filename, IndexStore
+from .util import (
+    collect_artifact_url_paths,
+    gzip_compress,
+    normalize_url_path,
+    RecordInfo,
+    sorted_items,
+)
+from .writers import (
+    DEFAULT_MAP_FORMAT,
+    get_map_writer,
+    NginxHashSizes,
+    NginxMapWriter,
 )
-from .sources import Redirect, RedirectMap
-from .util import normalize_url_path, walk_records
 
 # FIXME: this is currently broken if alts are enabled
 
@@ -29,22 +59,209 @@ PLUGIN_ID = "redirect"
 
 DEFAULT_REDIRECT_FROM_FIELD = "redirect_from"
 
+MAP_SECTION_PREFIX = "redirect.map."
+
+DEFAULT_SHARDS = 16
+
+
+class MapConfig(NamedTuple):
+    """The configuration of a redirect map."""
+
+    name: str
+    """The name of the map.
+
+    This is the ``<name>`` from the map's ``[redirect.map.<name>]``
+    configuration section, or the empty string for the map configured in the
+    ``[redirect]`` section.
+    """
+
+    url_path: str
+    """The URL path of the map file."""
+
+    format: str
+    """The format of the map file."""
+
+    shard_by: str | None = None
+    """How to shard the map (``"hash"`` or ``"segment"``), if at all."""
+
+    shards: int = 0
+    """The number of shards, when sharding by hash."""
+
+    include_prefix: str = ""
+    """A prefix for the paths to the shards written in the map's index file."""
+
+    hash_sizes_url: str | None = None
+    """The URL path of an nginx configuration snippet setting hash sizes."""
+
+
+class RenderedPage(NamedTuple):
+    """A rendered redirect page."""
+
+    content: bytes
+
+    dependencies: tuple[str | VirtualSourceObject, ...]
+    """The dependencies recorded while rendering the page."""
+
+
+def _map_file_url(map_file: str) -> str:
+    p = Path(map_file)
+    p = p.relative_to(p.anchor)  # remove any drive (windows)
+    return "/" + p.as_posix()
+
+
+def _make_map_config(name: str, map_file: str, options: Mapping[str, str]) -> MapConfig:
+    map_format = options.get("format") or DEFAULT_MAP_FORMAT
+    shard_by = options.get("shard_by") or None
+    shards = 0
+    if shard_by is not None:
+        if shard_by not in SHARD_METHODS:
+            msg = f"Unknown shard_by {shard_by!r} for redirect map {name!r}"
+            raise RuntimeError(msg)
+        if shard_by == SHARD_BY_HASH:
+            shards = int(options.get("shards") or DEFAULT_SHARDS)
+            if shards <= 0:
+                msg = f"The number of shards for redirect map {name!r} must be positive"
+                raise RuntimeError(msg)
+    include_prefix = options.get("include_prefix", "")
+    hash_sizes_url = None
+    if options.get("hash_sizes_file"):
+        if map_format != "nginx":
+            msg = f"A hash_sizes_file is only supported for nginx maps ({name!r})"
+            raise RuntimeError(msg)
+        hash_sizes_url = _map_file_url(options["hash_sizes_file"])
+    return MapConfig(
+        name,
+        _map_file_url(map_file),
+        map_format,
+        shard_by,
+        shards,
+        include_prefix,
+        hash_sizes_url,
+    )
+
+
+def _normalize_redirect_url(base: Record, redirect_url: str) -> str | None:
+    """Normalize a redirect URL.
+
+    Returns ``None`` (after reporting it) for a URL ending in a ``*`` which
+    does not follow a slash.
+    """
+    if is_regex_url(redirect_url):
+        return redirect_url
+    if redirect_url.endswith(WILDCARD):
+        if redirect_url != WILDCARD and not is_wildcard_url(redirect_url):
+            reporter.report_generic(
+                f"Ignoring redirect from {redirect_url!r}: "
+                f"a {WILDCARD!r} is only allowed after a slash"
+            )
+            return None
+        return normalize_wildcard_url(base, redirect_url)
+    return normalize_url_path(base, redirect_url)
+
 
 class RedirectPlugin(Plugin):  # type: ignore[misc]
     name = "redirect"
     description = "Generate redirects to pages."
 
     _index_cache: MutableMapping[Pad, RedirectIndex]
+    _index_builds: dict[Pad, tuple[int, Future[RedirectIndex]]]
+    _index_lock: threading.Lock
+    _sorted_map_cache: MutableMapping[Pad, Iterable[tuple[str, str]]]
+    _map_shards_cache: MutableMapping[Pad, dict[str, Mapping[str, int]]]
+    _hash_sizes_cache: MutableMapping[Pad, NginxHashSizes]
+    _rendered_page_cache: MutableMapping[Pad, dict[tuple[str, str], RenderedPage]]
+    _gzip_cache: MutableMapping[Pad, dict[bytes, bytes]]
+    _sharded_map_cache: MutableMapping[Pad, dict[str, dict[str, list[tuple[str, str]]]]]
+    _redirects_file_info: RedirectsFileInfo | None
+    _live_index: LiveIndex | None
+
+    full_walks: int
+    """The number of full walks of the site made to build redirect indexes.
+
+    This is reset at the start of each full build.
+    """
 
     def __init__(self, env: Environment, id: str):
         super().__init__(env, id)
         self._index_cache = weakref.WeakKeyDictionary()
+        self._index_builds = {}
+        self._index_lock = threading.Lock()
+        self._sorted_map_cache = weakref.WeakKeyDictionary()
+        self._map_shards_cache = weakref.WeakKeyDictionary()
+        self._sharded_map_cache = weakref.WeakKeyDictionary()
+        self._hash_sizes_cache = weakref.WeakKeyDictionary()
+        self._rendered_page_cache = weakref.WeakKeyDictionary()
+        self._gzip_cache = weakref.WeakKeyDictionary()
+        self._redirects_file_info = None
+        self._live_index = None
+        self.full_walks = 0
 
     def get_index(self, pad: Pad) -> RedirectIndex:
-        with suppress(KeyError):
-            return self._index_cache[pad]
-        self._index_cache[pad] = RedirectIndex(pad)
-        return self._index_cache[pad]
+        """Get the redirect index for ``pad``.
+
+        The index is computed once per pad, so that everything involved in a
+        build (the generators, URL resolution, and the redirect map) shares a
+        single, consistent snapshot.
+
+        This is thread-safe, and construction is single-flight: if several
+        threads need the index for a pad at once, the first builds it while
+        the others wait for the result.
+        """
+        with self._index_lock:
+            with suppress(KeyError):
+                return self._index_cache[pad]
+            try:
+                builder, future = self._index_builds[pad]
+            except KeyError:
+                builder = None
+                future = Future()
+                self._index_builds[pad] = threading.get_ident(), future
+        if builder is not None:
+            if builder == threading.get_ident():
+                msg = "The redirect index was needed while it was being built"
+                raise RuntimeError(msg)
+            return future.result()
+
+        try:
+            index = self._build_index(pad)
+        except BaseException as exc:
+            with self._index_lock:
+                del self._index_builds[pad]
+            future.set_exception(exc)
+            raise
+        with self._index_lock:
+            self._index_cache[pad] = index
+            del self._index_builds[pad]
+        future.set_result(index)
+        return index
+
+    def _build_index(self, pad: Pad) -> RedirectIndex:
+        if self._live_index is not None:
+            index = self._live_index.get_index(pad)
+        elif self.bulk_shadow_check:
+            index = RedirectIndex(
+                pad,
+                artifact_url_paths=self.collect_artifact_url_paths(pad),
+                collapse_chains=self.collapse_chains,
+                imported_redirects=self.get_imported_redirects(pad),
+            )
+        else:
+            index = RedirectIndex(
+                pad,
+                collapse_chains=self.collapse_chains,
+                imported_redirects=self.get_imported_redirects(pad),
+            )
+        return index
+
+    def collect_artifact_url_paths(self, pad: Pad) -> dict[str, str]:
+        """Collect the URL paths of all artifacts, for ``bulk_shadow_check``.
+
+        The sources generated by this plugin whose existence depends on the
+        redirect index (the redirect pages and map shards) are excluded.
+        """
+        return collect_artifact_url_paths(
+            pad, exclude_generators=[Redirect._generator, RedirectMapShard._generator]
+        )
 
     @property
     def redirect_from_field(self) -> str:
@@ -56,15 +273,235 @@ class RedirectPlugin(Plugin):  # type: ignore[misc]
         inifile: IniFile = self.get_config()
         return inifile.get("redirect.template")
 
+    @property
+    def render_once_per_target(self) -> bool:
+        """Whether to render the redirect template only once per target.
+
+        When enabled, the rendered page is reused for every redirect to the
+        same target.  This is only correct if the template's output depends
+        on nothing but ``this.target`` — in particular, it should only use
+        absolute or external URLs.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.render_once_per_target", False)
+
+    def render_redirect_page(self, redirect: Redirect, template: str) -> bytes:
+        """Render the redirect page for ``redirect`` using ``template``.
+
+        The output is cached (once per pad) by template and target.  When a
+        cached page is reused, the dependencies recorded while it was first
+        rendered are recorded again, for the current artifact.
+        """
+        pad = redirect.pad
+        cache = self._rendered_page_cache.setdefault(pad, {})
+        key = template, redirect.target.path
+        ctx = get_ctx()
+        try:
+            page = cache[key]
+        except KeyError:
+            dependencies: list[str | VirtualSourceObject] = []
+            gather = (
+                ctx.gather_dependencies(dependencies.append)
+                if ctx is not None
+                else nullcontext()
+            )
+            with gather:
+                html = self.env.render_template(template, pad, this=redirect)
+            page = cache[key] = RenderedPage(
+                html.encode("utf-8") + b"\n", tuple(dependencies)
+            )
+        else:
+            if ctx is not None:
+                for dependency in page.dependencies:
+                    if isinstance(dependency, str):
+                        ctx.record_dependency(dependency)
+                    else:
+                        ctx.record_virtual_dependency(dependency)
+        return page.content
+
+    @property
+    def hardlink_pages(self) -> bool:
+        """Whether to deduplicate identical redirect pages using hard links.
+
+        When enabled, each distinct redirect page is written once, to a
+        content-addressed store in the output tree, and the redirect page
+        artifacts are hard links to the stored copies.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.hardlink_pages", False)
+
+    @property
+    def gzip_sidecars(self) -> bool:
+        """Whether to write gzipped copies of redirect pages and maps.
+
+        These ``.gz`` sidecar files, written next to the originals, can be
+        served by nginx's ``gzip_static``.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.gzip_sidecars", False)
+
+    def compress_redirect_page(self, pad: Pad, content: bytes) -> bytes:
+        """Gzip the content of a redirect page.
+
+        The compressed payloads are cached (once per pad) by content, so that
+        redirect pages with identical content are compressed only once.
+        """
+        cache = self._gzip_cache.setdefault(pad, {})
+        key = hashlib.md5(content).digest()
+        with suppress(KeyError):
+            return cache[key]
+        compressed = cache[key] = gzip_compress(content)
+        return compressed
+
+    @property
+    def persistent_index(self) -> bool:
+        """Whether to cache the redirect index on disk between runs."""
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.persistent_index", False)
+
+    @property
+    def raw_scan(self) -> bool:
+        """Whether to scan ``.lr`` files directly when building the index."""
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.raw_scan", False)
+
+    @property
+    def scan_workers(self) -> int:
+        """The number of threads used to scan the site for redirects.
+
+        A value of zero (or less) means to use one thread per CPU.
+        """
+        inifile: IniFile = self.get_config()
+        workers = inifile.get_int("redirect.scan_workers", 1)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+        return workers
+
+    @property
+    def bulk_shadow_check(self) -> bool:
+        """Whether to check for shadowed artifacts in bulk.
+
+        When enabled, the URL paths of all artifacts which Lektor will build
+        are collected up front, and redirect URLs are checked against them.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.bulk_shadow_check", False)
+
+    @property
+    def collapse_chains(self) -> bool:
+        """Whether to resolve chains of redirects to their final targets.
+
+        When enabled, a redirect to a record whose URL is itself redirected
+        (by a ``redirect_from`` of some other record) leads directly to the
+        final target, both in the redirect map and on redirect pages.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get_bool("redirect.collapse_chains", False)
+
+    @property
+    def redirects_file(self) -> str | None:
+        """The path to a file listing additional redirects, if any.
+
+        This is interpreted relative to the project directory.
+        """
+        inifile: IniFile = self.get_config()
+        filename = inifile.get("redirect.redirects_file")
+        if not filename:
+            return None
+        return os.path.join(self.env.root_path, filename)
+
+    @property
+    def redirects_file_format(self) -> str | None:
+        """The format of the ``redirects_file``.
+
+        By default, this is determined by the file's extension.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get("redirect.redirects_file_format") or None
+
+    def get_imported_redirects(self, pad: Pad) -> Mapping[str, tuple[str, ...]]:
+        """Get the redirects listed in the ``redirects_file``.
+
+        Returns a mapping from record path to redirect URLs.  The file is
+        re-read only when its modification time (or size) changes.
+        """
+        filename = self.redirects_file
+        if filename is None:
+            return NO_REDIRECTS
+        info = self._redirects_file_info
+        if info is None or info.key != stat_key(filename):
+            root = pad.root
+            info = self._redirects_file_info = read_redirects_file(
+                filename,
+                lambda url: _normalize_redirect_url(root, url),
+                self.redirects_file_format,
+            )
+        return info.redirects
+
+    @property
+    def map_memory_budget(self) -> int:
+        """The memory budget, in bytes, for sorting the redirect map.
+
+        This is configured in megabytes.  If the map is larger, sorting
+        spills to temporary files.
+        """
+        inifile: IniFile = self.get_config()
+        return inifile.get_int("redirect.map_memory_budget", 64) * 1024 * 1024
+
+    @property
+    def map_format(self) -> str:
+        """The format of the redirect map file."""
+        inifile: IniFile = self.get_config()
+        return inifile.get("redirect.map_format", DEFAULT_MAP_FORMAT)
+
     @property
     def redirect_map_url(self) -> str | None:
         inifile: IniFile = self.get_config()
         map_file = inifile.get("redirect.map_file")
         if map_file is None:
             return None
-        p = Path(map_file)
-        p = p.relative_to(p.anchor)  # remove any drive (windows)
-        return "/" + p.as_posix()
+        return _map_file_url(map_file)
+
+    @property
+    def redirect_maps(self) -> Mapping[str, MapConfig]:
+        """The configurations of all redirect maps, keyed by URL path.
+
+        Besides the map configured by ``map_file`` (and ``map_format``,
+        ``map_shard_by``, etc.) in the ``[redirect]`` section, any number of
+        maps may be configured in ``[redirect.map.<name>]`` sections, using
+        the ``file``, ``format``, ``shard_by``, ``shards``, ``include_prefix``
+        and ``hash_sizes_file`` keys.
+        """
+        inifile: IniFile = self.get_config()
+        map_configs = []
+        map_file = inifile.get("redirect.map_file")
+        if map_file is not None:
+            prefix = "redirect.map_"
+            options = {
+                key[len(prefix) :]: value
+                for key, value in inifile.items()
+                if key.startswith(prefix)
+            }
+            map_configs.append(_make_map_config("", map_file, options))
+        for section in inifile.sections():
+            if section.startswith(MAP_SECTION_PREFIX):
+                name = section[len(MAP_SECTION_PREFIX) :]
+                options = inifile.section_as_dict(section)
+                if "file" not in options:
+                    msg = f"No file is configured for redirect map {name!r}"
+                    raise RuntimeError(msg)
+                map_configs.append(_make_map_config(name, options["file"], options))
+
+        redirect_maps: dict[str, MapConfig] = {}
+        for map_config in map_configs:
+            other = redirect_maps.setdefault(map_config.url_path, map_config)
+            if other is not map_config:
+                msg = (
+                    f"Redirect maps {other.name!r} and {map_config.name!r} "
+                    f"are both configured to be written to {map_config.url_path!r}"
+                )
+                raise RuntimeError(msg)
+        return redirect_maps
 
     def _get_redirect_urls(self, record: Record) -> set[str]:
         """Get redirects requested by record.
@@ -79,48 +516,243 @@ class RedirectPlugin(Plugin):  # type: ignore[misc]
             return set()
 
         base = record.parent or record
-        return {
-            normalize_url_path(base, redirect_url) for redirect_url in redirect_from
-        }
+        normalized = (
+            _normalize_redirect_url(base, redirect_url)
+            for redirect_url in redirect_from
+        )
+        return {url for url in normalized if url is not None}
+
+    def get_record_info(self, record: Record) -> RecordInfo:
+        """Extract the redirect information for a record."""
+        redirect_urls = tuple(sorted(self._get_redirect_urls(record)))
+        return RecordInfo(record.path, record.url_path, redirect_urls)
+
+    def make_scanner(self, pad: Pad) -> RecordScanner:
+        return RecordScanner(
+            pad, self.redirect_from_field, self._get_redirect_urls, raw=self.raw_scan
+        )
+
+    def iter_record_infos(self, pad: Pad) -> Iterable[RecordInfo]:
+        """Get the redirect information for all records in the site.
+
+        If ``persistent_index`` is enabled, information for records whose
+        sources have not changed since the last run is loaded from an on-disk
+        cache.
+
+        If ``raw_scan`` is enabled, records' ``.lr`` files are read directly,
+        and only records which declare redirects are fully loaded.
+
+        If ``scan_workers`` is greater than one, the subtrees below the root
+        record are scanned in parallel.
+        """
+        self.full_walks += 1
+        scanner = self.make_scanner(pad)
+        workers = self.scan_workers
+        scanned_records: Iterable[ScannedRecord]
+        if self.persistent_index:
+            fingerprint = compute_fingerprint(pad, [self.config_filename])
+            store = IndexStore(get_store_filename(pad), fingerprint)
+            scanned_records = store.refresh(scanner, workers=workers)
+        else:
+            scanned_records = scanner.walk(workers=workers)
+        return (scanned.record_info for scanned in scanned_records)
 
     def get_redirect_urls(self, record: Record) -> set[str]:
         """Get redirects requested by record.
 
+        These include any redirects to the record imported from the
+        ``redirects_file``.
+
         URL paths returned are normalized and absolute.
         Conflicting redirects are omitted from the results.
         Warnings are logged for any detected conflicting redirect.
         """
-        redirect_urls = self._get_redirect_urls(record)
-        if len(redirect_urls) == 0:
-            return redirect_urls
+        if not isinstance(record, Record):
+            return set()
 
         index = self.get_index(record.pad)
         return {
             redirect_url
-            for redirect_url in self._get_redirect_urls(record)
+            for redirect_url in index.get_declared_urls(record.path)
             if not index.is_conflict(redirect_url, record, warn_on_conflict=True)
         }
 
     def iter_redirect_map(self, pad: Pad) -> Iterator[tuple[str, str]]:
+        """Iterate over the entries of the redirect map, sorted by source URL.
+
+        Entries are sorted using an external merge sort whose memory usage is
+        bounded by ``map_memory_budget``.  The sorted entries are computed
+        once per pad, and shared by all the redirect maps.
+        """
+        with suppress(KeyError):
+            return iter(self._sorted_map_cache[pad])
+        entries = self._sorted_map_cache[pad] = self._sort_redirect_map(pad)
+        return iter(entries)
+
+    def _sort_redirect_map(self, pad: Pad) -> Iterable[tuple[str, str]]:
+        return sorted_items(
+            self._iter_unsorted_redirect_map(pad), self.map_memory_budget
+        )
+
+    def _iter_unsorted_redirect_map(self, pad: Pad) -> Iterator[tuple[str, str]]:
         base_path: str = pad.db.config.base_path
 
         def abs_url(url_path: str) -> str:
+            if is_regex_url(url_path):
+                return url_path  # regexes are matched as written
             return urljoin(base_path, url_path.lstrip("/"))
 
-        index = RedirectIndex(pad)
-        for redirect_url in sorted(index):
-            target = index[redirect_url]
-            if not index.is_conflict(redirect_url, target, warn_on_conflict=True):
-                yield abs_url(redirect_url), abs_url(target.url_path)
+        index = self.get_index(pad)
+        for redirect_url, target_url in index.iter_valid_redirects():
+            yield abs_url(redirect_url), abs_url(target_url)
+
+    def get_nginx_hash_sizes(self, pad: Pad) -> NginxHashSizes:
+        """Compute the nginx ``map_hash_*`` settings needed for the redirect map.
+
+        This is computed, once per pad, from the redirect index, without
+        sorting the map.
+        """
+        with suppress(KeyError):
+            return self._hash_sizes_cache[pad]
+        writer = NginxMapWriter()
+        sizes = writer.get_hash_sizes(self._iter_unsorted_redirect_map(pad))
+        self._hash_sizes_cache[pad] = sizes
+        return sizes
+
+    def get_redirect_map_checksum(self, pad: Pad, map_format: str | None = None) -> str:
+        """Compute a checksum for a redirect map for ``pad``.
+
+        The ``map_format`` defaults to the configured ``map_format``.
+
+        This is computed from the index's fingerprint (which covers the
+        paths, URLs and declared redirects of all records), the plugin
+        configuration, and the site's base path.  It is much cheaper than
+        computing the map itself (which entails checking every redirect for
+        conflicts.)  It also covers anything else, beyond the configuration,
+        which affects the output of the map's writer.
+        """
+        h = hashlib.md5()
+        h.update(self.get_index(pad).fingerprint.encode())
+        if map_format is None:
+            map_format = self.map_format
+        self._hash_map_config(h, pad, map_format)
+        return h.hexdigest()
+
+    def _hash_map_config(self, h: Any, pad: Pad, map_format: str) -> None:
+        inifile: IniFile = self.get_config()
+        h.update(get_map_writer(map_format).checksum_key.encode() + b"\0")
+        h.update(pad.db.config.base_path.encode() + b"\0")
+        for key, value in sorted(inifile.items()):
+            h.update(f"{key}\0{value}\0".encode())
+
+    def get_map_shards(self, pad: Pad, map_config: MapConfig) -> Mapping[str, int]:
+        """Get the shards of a sharded redirect map.
+
+        Returns a mapping from shard key to a fingerprint of the shard's
+        contents.  This is computed (once per pad) from the redirect index,
+        without sorting, or otherwise computing, the map itself.
+        """
+        assert map_config.shard_by is not None
+        shards_by_url = self._map_shards_cache.setdefault(pad, {})
+        with suppress(KeyError):
+            return shards_by_url[map_config.url_path]
+        entries = (
+            (redirect_url.lstrip("/"), target_url.lstrip("/"))
+            for redirect_url, target_url in self.get_index(pad).iter_valid_redirects()
+        )
+        shards = shards_by_url[map_config.url_path] = fingerprint_shards(
+            map_config.shard_by, map_config.shards, entries
+        )
+        return shards
+
+    def iter_map_shard(
+        self, pad: Pad, map_config: MapConfig, key: str
+    ) -> Iterator[tuple[str, str]]:
+        """Iterate over the entries in a shard of a redirect map.
+
+        The map is split into shards (in memory) once per pad, in a single
+        pass over the sorted redirect map.
+        """
+        assert map_config.shard_by is not None
+        sharded_maps = self._sharded_map_cache.setdefault(pad, {})
+        try:
+            sharded_map = sharded_maps[map_config.url_path]
+        except KeyError:
+            base_path: str = pad.db.config.base_path
+            sharded_map = sharded_maps[map_config.url_path] = {}
+            for from_url, to_url in self.iter_redirect_map(pad):
+                url_path = from_url
+                if not is_regex_url(from_url):
+                    url_path = from_url[len(base_path) :]
+                shard_key = get_shard_key(
+                    map_config.shard_by, map_config.shards, url_path
+                )
+                sharded_map.setdefault(shard_key, []).append((from_url, to_url))
+        return iter(sharded_map.get(key, ()))
+
+    def get_map_shard_checksum(self, pad: Pad, map_config: MapConfig, key: str) -> str:
+        """Compute a checksum for a shard of a redirect map.
+
+        This changes only when the contents of the shard (or the plugin
+        configuration) change.
+        """
+        h = hashlib.md5()
+        fingerprint = self.get_map_shards(pad, map_config).get(key, 0)
+        h.update(f"{key}\0{fingerprint:x}\0".encode())
+        self._hash_map_config(h, pad, map_config.format)
+        return h.hexdigest()
+
+    def get_map_index_checksum(self, pad: Pad, map_config: MapConfig) -> str:
+        """Compute a checksum for the index file of a sharded redirect map.
+
+        This changes only when the set of shards (or the plugin configuration)
+        change.
+        """
+        h = hashlib.md5()
+        for key in sorted(self.get_map_shards(pad, map_config)):
+            h.update(f"{key}\0".encode())
+        self._hash_map_config(h, pad, map_config.format)
+        return h.hexdigest()
 
     def on_setup_env(self, **extra: Any) -> None:
         self._ensure_alts_disabled()
         Redirect._setup_env(self.env)
         # XXX: maybe only register if redirect map generation is enabled?
         RedirectMap._setup_env(self.env)
+        RedirectMapShard._setup_env(self.env)
+        RedirectMapHashSizes._setup_env(self.env)
+        RedirectUrls._setup_env(self.env)
 
     def on_before_build_all(self, builder: Builder, **extra: None) -> None:
         self._ensure_alts_disabled()
+        self.full_walks = 0
+        if self._live_index is not None:
+            self._live_index.poll()
+
+    def on_after_build_all(self, builder: Builder, **extra: None) -> None:
+        if self.hardlink_pages:
+            PageStore(builder.destination_path).sweep()
+        if reporter.verbosity >= 1:
+            reporter.report_generic(
+                f"Redirect index: {self.full_walks} full walk(s) of the site"
+            )
+
+    def on_after_prune(self, builder: Builder, **extra: Any) -> None:
+        """Remove stored redirect pages which are no longer linked to."""
+        if self.hardlink_pages:
+            PageStore(builder.destination_path).sweep()
+
+    def on_server_spawn(self, **extra: Any) -> None:
+        """Maintain a live redirect index while the dev server is running.
+
+        The index is patched incrementally, rather than being rebuilt for every
+        fresh pad.  The source tree is checked for changes at the start of
+        each build, in the thread which runs the build.
+        """
+        self._live_index = LiveIndex(self)
+
+    def on_server_stop(self, **extra: Any) -> None:
+        self._live_index = None
 
     def _ensure_alts_disabled(self) -> None:
         env = self.env
@@ -128,77 +760,3 @@ class RedirectPlugin(Plugin):  # type: ignore[misc]
         if alts:
             msg = f"The {self.name} plugin currently does not support alts"
             raise RuntimeError(msg)
-
-
-class RedirectIndex(Mapping[str, Record]):
-    def __init__(self, pad: Pad) -> None:
-        plugin = get_plugin("redirect", env=pad.env)  # FIXME: abstract
-        redirects = defaultdict(set)
-        records_by_url = {}
-
-        for record in walk_records(pad):
-            for url_path in plugin._get_redirect_urls(record):
-                redirects[url_path].add(record)
-            records_by_url[record.url_path] = record
-
-        # ignore redirects to self
-        for url_path, record in records_by_url.items():
-            redirects[url_path].discard(record)
-
-        self._redirects = {
-            url_path: list(targets)
-            for url_path, targets in redirects.items()
-            if len(targets) > 0
-        }
-        self._records_by_url = records_by_url
-
-    def __getitem__(self, key: str, /) -> Record:
-        targets = self._redirects[key]
-        assert len(targets) > 0
-        return targets[0]
-
-    def __len__(self) -> int:
-        return len(self._redirects)
-
-    def __iter__(self) -> Iterator[str]:
-        return iter(self._redirects)
-
-    def raise_on_conflict(self, url_path: str, target: Record) -> None:
-        if target.url_path == url_path:
-            raise RedirectToSelfException(url_path, target)
-
-        existing = self._records_by_url.get(url_path)
-        if existing is None:
-            pad = target.pad
-            with Redirect.disable_url_resolution():
-                existing = pad.resolve_url_path(url_path)
-        if existing is not None:
-            raise RedirectShadowsExistingRecordException(url_path, target, existing)
-
-        for conflict in self._redirects.get(url_path, ()):
-            if conflict != target:
-                raise AmbiguousRedirectException(url_path, target, conflict)
-
-    def is_conflict(
-        self, url_path: str, target: Record, warn_on_conflict: bool = True
-    ) -> bool:
-        """Check if redirect conflicts with another declared redirect.
-
-        If there is no conflict, returns `False`.
-
-        If the redirect is ambiguous, or conflicts with another record, a warning
-        is issued via Lektor's reporter, and `True` is returned.
-
-        """
-        try:
-            self.raise_on_conflict(url_path, target)
-        except RedirectToSelfException as ex:
-            if warn_on_conflict and reporter.verbosity >= 1:
-                reporter.report_generic(f"Ignoring redirect: {ex}")
-            return True
-        except InvalidRedirectException as ex:
-            if warn_on_conflict:
-                reporter.report_generic(f"Invalid redirect: {ex}")
-            return True
-        else:
-            return False
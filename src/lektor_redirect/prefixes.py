@@ -0,0 +1,127 @@
+"""Prefix (wildcard) redirects.
+
+A ``redirect_from`` value ending in ``/*`` (e.g. ``/docs/v1/*``) declares a
+*prefix redirect*: the URL path before the ``*`` (the *prefix*), and all URL
+paths below it, redirect to the corresponding URL paths below the declaring
+record.
+
+Prefix redirects are kept in the redirect index under their wildcard URL
+(e.g. ``/docs/v1/*``), just like other redirects.  The prefixes are also
+stored in a `PrefixTrie`, so that the longest prefix of a URL path can be
+found in time proportional to the depth of the path.
+
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Final, Iterable, Iterator
+
+from lektor.db import Record
+
+from .util import normalize_url_path
+
+WILDCARD: Final = "*"
+
+_END: Final = "/"  # never a path segment
+
+_Node = Dict[str, Any]
+
+
+def is_wildcard_url(url_path: str) -> bool:
+    """Determine whether a (normalized) redirect URL declares a prefix redirect."""
+    return url_path.endswith("/" + WILDCARD)
+
+
+def wildcard_prefix(url_path: str) -> str:
+    """Get the prefix (ending with a slash) of a wildcard redirect URL."""
+    assert is_wildcard_url(url_path)
+    return url_path[: -len(WILDCARD)]
+
+
+def normalize_wildcard_url(record: Record, url_path: str) -> str:
+    """Normalize a wildcard redirect URL.
+
+    The ``url_path`` must end in ``/*`` (or be just ``*``).  The part before
+    the ``*`` is normalized, as by `normalize_url_path`.
+    """
+    prefix = normalize_url_path(record, url_path[: -len(WILDCARD)] or ".")
+    return prefix.rstrip("/") + "/" + WILDCARD
+
+
+def _segments(url_path: str) -> list[str]:
+    return [segment for segment in url_path.split("/") if segment]
+
+
+class PrefixTrie:
+    """A set of URL path prefixes, stored as a trie of path segments."""
+
+    def __init__(self, prefixes: Iterable[str] = ()):
+        self._root: _Node = {}
+        self._len = 0
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def copy(self) -> PrefixTrie:
+        return PrefixTrie(self)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[str]:
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            for key, child in node.items():
+                if key == _END:
+                    yield child
+                else:
+                    nodes.append(child)
+
+    def __contains__(self, prefix: object) -> bool:
+        if not isinstance(prefix, str):
+            return False
+        node: _Node = self._root
+        for segment in _segments(prefix):
+            if segment not in node:
+                return False
+            node = node[segment]
+        return _END in node
+
+    def add(self, prefix: str) -> None:
+        node = self._root
+        for segment in _segments(prefix):
+            node = node.setdefault(segment, {})
+        if _END not in node:
+            self._len += 1
+        node[_END] = prefix
+
+    def discard(self, prefix: str) -> None:
+        path = [self._root]
+        for segment in _segments(prefix):
+            node = path[-1].get(segment)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].pop(_END, None) is None:
+            return
+        self._len -= 1
+        # Prune empty nodes
+        for segment in reversed(_segments(prefix)):
+            if path.pop():
+                break
+            del path[-1][segment]
+
+    def longest_prefix(self, url_path: str) -> str | None:
+        """Find the longest prefix of ``url_path`` in the trie.
+
+        This takes time proportional to the number of segments in
+        ``url_path``.
+        """
+        node: _Node = self._root
+        longest: str | None = node.get(_END)
+        for segment in _segments(url_path):
+            if segment not in node:
+                break
+            node = node[segment]
+            longest = node.get(_END, longest)
+        return longest
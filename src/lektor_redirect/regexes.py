@@ -0,0 +1,107 @@
+"""Regex redirects.
+
+A ``redirect_from`` value starting with ``~`` (e.g. ``~^/node/\\d+/?$``)
+declares a *regex redirect*: any URL path matching the regular expression
+(which follows the ``~``) redirects to the declaring record.  As with nginx,
+the regex is searched for anywhere in the URL path, so it should usually be
+anchored.
+
+Regex redirects are kept in the redirect index under their declared value,
+just like other redirects.  For URL resolution, the regexes are combined
+into a single `RegexMatcher`, so that each URL path is matched only once,
+no matter how many regexes there are.  (Regexes which can not safely be
+combined with others are matched separately.)
+
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Final, Iterable
+
+REGEX_MARKER: Final = "~"
+
+
+def is_regex_url(url_path: str) -> bool:
+    """Determine whether a redirect URL declares a regex redirect."""
+    return url_path.startswith(REGEX_MARKER)
+
+
+def regex_pattern(url_path: str) -> str:
+    """Get the regular expression of a regex redirect URL."""
+    assert is_regex_url(url_path)
+    return url_path[len(REGEX_MARKER) :]
+
+
+def check_regex_url(url_path: str) -> str | None:
+    """Check that the regular expression of a regex redirect URL compiles.
+
+    Returns the error message if it does not, otherwise `None`.
+    """
+    try:
+        re.compile(regex_pattern(url_path))
+    except re.error as exc:
+        return str(exc)
+    return None
+
+
+_GROUP_NAME_PREFIX: Final = "_"
+
+_NUMBERED_GROUP_REFERENCE: Final = re.compile(r"\\[1-9]|\(\?\(\d")
+
+
+def _is_combinable(regex: re.Pattern[str], group_names: set[str]) -> bool:
+    """Determine whether ``regex`` can be combined into an alternation.
+
+    Regexes with global inline flags (e.g. ``(?i)``), which would apply to
+    the whole alternation, can not be.  Nor can those with numbered group
+    references (which would refer to the wrong groups), or with named groups
+    whose names are already used (in ``group_names``).
+    """
+    if regex.flags & ~re.UNICODE:
+        return False
+    if regex.groups and _NUMBERED_GROUP_REFERENCE.search(regex.pattern):
+        return False
+    return not any(
+        name in group_names or name.startswith(_GROUP_NAME_PREFIX)
+        for name in regex.groupindex
+    )
+
+
+class RegexMatcher:
+    """Match URL paths against a number of regex redirect URLs at once.
+
+    The regexes are combined, in the order given, into a single alternation.
+    Where more than one regex matches a URL path, the first matching regex
+    (at the leftmost matching position) wins.
+
+    Regexes which can not be combined (see `_is_combinable`) are matched
+    separately, with the same result.
+    """
+
+    def __init__(self, regex_urls: Iterable[str]):
+        self.regex_urls = list(regex_urls)
+        alternatives = []
+        group_names: set[str] = set()
+        self._separate: list[tuple[int, re.Pattern[str]]] = []
+        for n, regex_url in enumerate(self.regex_urls):
+            regex = re.compile(regex_pattern(regex_url))
+            if _is_combinable(regex, group_names):
+                alternatives.append(f"(?P<{_GROUP_NAME_PREFIX}{n}>{regex.pattern})")
+                group_names.update(regex.groupindex)
+            else:
+                self._separate.append((n, regex))
+        self._regex = re.compile("|".join(alternatives)) if alternatives else None
+
+    def match(self, url_path: str) -> str | None:
+        """Find the regex redirect URL matching ``url_path``, if any."""
+        best: tuple[int, int] | None = None
+        if self._regex is not None:
+            m = self._regex.search(url_path)
+            if m is not None and m.lastgroup is not None:
+                best = m.start(), int(m.lastgroup[len(_GROUP_NAME_PREFIX) :])
+        for n, regex in self._separate:
+            m = regex.search(url_path)
+            if m is not None and (best is None or (m.start(), n) < best):
+                best = m.start(), n
+        return self.regex_urls[best[1]] if best is not None else None
@@ -0,0 +1,338 @@
+"""Walk the content tree, extracting redirect information from records.
+
+By default, each record is loaded from the Lektor DB in order to determine its
+URL, datamodel, visibility and the redirects it declares.
+
+In *raw* mode, the scanner instead reads only a handful of system fields and
+the redirect field directly from each record's ``.lr`` file using
+`lektor.metaformat`, and computes URL paths from slugs itself.  Only records
+which actually declare redirects (or whose URLs can not be cheaply computed,
+e.g. because their parent configures a ``slug_format``) are fully loaded.
+
+In either mode, the scanner consults the datamodels to avoid work for records
+which can not declare redirects.  Attachments without metadata files whose
+model lacks the redirect field are never loaded, and subtrees below pages
+whose children and attachments default (via ``children.model`` and
+``attachments.model``) to models which, recursively, lack the redirect
+field are always scanned in raw mode.  (They are still walked, since a
+record may override its implied model using ``_model``.)
+
+"""
+
+from __future__ import annotations
+
+import os
+import posixpath
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Mapping, NamedTuple, Optional
+
+from lektor import metaformat
+from lektor.datamodel import DataModel
+from lektor.db import Pad, Record
+from lektor.utils import bool_from_string, slugify
+from lektorlib.context import disable_dependency_recording
+
+from .util import RecordInfo
+
+_SYSTEM_FIELDS = ("_model", "_slug", "_hidden")
+
+
+class ScannedRecord(NamedTuple):
+    """The information about a record gathered by the `RecordScanner`."""
+
+    path: str
+    url_path: str
+    model: str
+    hidden: bool
+    redirect_urls: tuple[str, ...]
+
+    @property
+    def record_info(self) -> RecordInfo:
+        return RecordInfo(self.path, self.url_path, self.redirect_urls)
+
+
+ScanFunc = Callable[[str, bool, Optional[ScannedRecord]], Optional[ScannedRecord]]
+
+
+def _redirect_free_models(datamodels: Mapping[str, DataModel], field: str) -> set[str]:
+    """Find the models below which records can declare redirects only by
+    overriding their implied model.
+
+    These are the models which lack the redirect field, whose attachments are
+    either disabled or default to a model lacking the redirect field, and whose
+    children are either disabled or default to another such model.
+    """
+
+    def lacks_field(model_id: str | None) -> bool:
+        datamodel = datamodels.get(model_id) if model_id is not None else None
+        return datamodel is not None and field not in datamodel.field_map
+
+    candidates = {
+        model_id
+        for model_id, datamodel in datamodels.items()
+        if lacks_field(model_id)
+        and (
+            not datamodel.attachment_config.enabled
+            or lacks_field(datamodel.attachment_config.model)
+        )
+    }
+    # Iterate to the greatest fixed point, so that recursive models work
+    while True:
+        redirect_free = {
+            model_id
+            for model_id in candidates
+            if not datamodels[model_id].child_config.enabled
+            or datamodels[model_id].child_config.model in candidates
+        }
+        if redirect_free == candidates:
+            return redirect_free
+        candidates = redirect_free
+
+
+def _child_base(url_path: str) -> str:
+    """The "clean" URL path prefix (without slashes) for a page's children."""
+    # See https://www.getlektor.com/docs/content/urls/#content-below-dotted-slugs
+    head, sep, tail = url_path.strip("/").rpartition("/")
+    if "." in tail:
+        tail = f"_{tail}"
+    return f"{head}{sep}{tail}"
+
+
+class RecordScanner:
+    """Scan records for redirect information."""
+
+    def __init__(
+        self,
+        pad: Pad,
+        redirect_from_field: str,
+        get_redirect_urls: Callable[[Record], set[str]],
+        raw: bool = False,
+    ):
+        self._local = threading.local()
+        self._local.pad = pad
+        self._db = pad.db
+        self.redirect_from_field = redirect_from_field
+        self.get_redirect_urls = get_redirect_urls
+        self.raw = raw
+        datamodels = self._db.datamodels
+        self.redirect_models = frozenset(
+            model_id
+            for model_id, datamodel in datamodels.items()
+            if redirect_from_field in datamodel.field_map
+        )
+        """The ids of the models which have a redirect field."""
+        self.redirect_free_models = frozenset(
+            _redirect_free_models(datamodels, redirect_from_field)
+        )
+        """The ids of the models below which records are scanned in raw mode."""
+
+    @property
+    def pad(self) -> Pad:
+        """The pad used to load records.
+
+        Each worker thread gets its own pad, since pads are not thread-safe.
+        """
+        pad = getattr(self._local, "pad", None)
+        if pad is None:
+            pad = self._local.pad = self._db.new_pad()
+        return pad
+
+    def iter_children(self, path: str) -> list[tuple[str, bool]]:
+        """List the paths of the children and attachments of a page.
+
+        Returns a sorted list of ``(path, is_attachment)`` pairs.
+        """
+        return sorted(
+            (posixpath.join(path, name), is_attachment)
+            for name, _, is_attachment in self._db.iter_items(path)
+        )
+
+    def walk(
+        self, scan: ScanFunc | None = None, workers: int = 1
+    ) -> Iterator[ScannedRecord]:
+        """Walk the content tree.
+
+        Hidden records (and their descendants) are skipped.
+
+        The tree is split at the children of the root record.  If ``workers`` is
+        greater than one, those subtrees are scanned concurrently in a thread pool.
+        In any case, the results are yielded in the same order: the root record,
+        followed by each subtree, walked breadth-first.
+        """
+        if scan is None:
+            scan = self.scan
+        with disable_dependency_recording():
+            root = scan("/", False, None)
+            if root is None or root.hidden:
+                return  # pragma: no cover
+            yield root
+            subtrees = [
+                (path, is_attachment, root)
+                for path, is_attachment in self.iter_children("/")
+            ]
+
+        def walk_subtree(item: tuple[str, bool, ScannedRecord]) -> list[ScannedRecord]:
+            with disable_dependency_recording():
+                return list(self.walk_subtree(scan, *item))
+
+        if workers > 1 and len(subtrees) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for scanned_records in executor.map(walk_subtree, subtrees):
+                    yield from scanned_records
+        else:
+            for item in subtrees:
+                yield from walk_subtree(item)
+
+    def walk_subtree(
+        self, scan: ScanFunc, path: str, is_attachment: bool, parent: ScannedRecord
+    ) -> Iterator[ScannedRecord]:
+        """Walk the subtree rooted at ``path``, breadth-first."""
+        items = deque([(path, is_attachment, parent)])
+        while items:
+            path, is_attachment, parent = items.popleft()
+            scanned = scan(path, is_attachment, parent)
+            if scanned is None or scanned.hidden:
+                continue
+            yield scanned
+            if not is_attachment:
+                items.extend(
+                    (child_path, child_is_attachment, scanned)
+                    for child_path, child_is_attachment in self.iter_children(path)
+                )
+
+    def scan(
+        self, path: str, is_attachment: bool, parent: ScannedRecord | None
+    ) -> ScannedRecord | None:
+        """Scan a single record.
+
+        The ``parent`` argument must be the result of scanning the record's
+        parent.  (It is only used in raw mode.)  Records below a page whose
+        model is in `redirect_free_models` are always scanned in raw mode:
+        they are only fully loaded if they override their model to one with
+        the redirect field, and declare redirects.
+        """
+        if self.raw or (
+            parent is not None and parent.model in self.redirect_free_models
+        ):
+            return self._scan_raw(path, is_attachment, parent)
+        if is_attachment and parent is not None:
+            if not self._has_metadata(path):
+                datamodel = self._get_datamodel(path, is_attachment, parent, "")
+                if datamodel.id not in self.redirect_models:
+                    # Attachment can not declare redirects, no need to load it
+                    return self._scan_raw(path, is_attachment, parent, {})
+        return self._scan_record(path)
+
+    def _scan_record(self, path: str) -> ScannedRecord | None:
+        with disable_dependency_recording():
+            record = self.pad.get(path, persist=False)
+            if record is None:
+                return None
+            model = record.datamodel.id
+            redirect_urls: tuple[str, ...] = ()
+            if model in self.redirect_models:
+                redirect_urls = tuple(sorted(self.get_redirect_urls(record)))
+            return ScannedRecord(
+                path, record.url_path, model, record.is_hidden, redirect_urls
+            )
+
+    def _has_metadata(self, path: str) -> bool:
+        return os.path.isfile(f"{self._db.to_fs_path(path)}.lr")
+
+    def _read_fields(self, path: str, is_attachment: bool) -> dict[str, str]:
+        fs_path = self._db.to_fs_path(path)
+        if is_attachment:
+            filename = f"{fs_path}.lr"
+        else:
+            filename = os.path.join(fs_path, "contents.lr")
+
+        interesting = {*_SYSTEM_FIELDS, self.redirect_from_field}
+        try:
+            with open(filename, "rb") as fp:
+                return {
+                    key: "".join(lines)
+                    for key, lines in metaformat.tokenize(
+                        fp, interesting_keys=interesting, encoding="utf-8"
+                    )
+                    if key in interesting
+                }
+        except FileNotFoundError:
+            return {}
+
+    def _get_datamodel(
+        self, path: str, is_attachment: bool, parent: ScannedRecord | None, model: str
+    ) -> DataModel:
+        datamodels = self._db.datamodels
+        if not model and parent is not None:
+            parent_model = datamodels[parent.model]
+            if is_attachment:
+                model = parent_model.attachment_config.model
+            else:
+                model = parent_model.child_config.model
+
+        # This mirrors lektor.db._iter_datamodel_choices
+        choices = [model]
+        if not is_attachment:
+            basename = posixpath.basename(path).split(".")[0]
+            choices.extend([basename.replace("-", "_").lower(), "page"])
+        for choice in choices:
+            if choice in datamodels:
+                return datamodels[choice]
+        return datamodels["none"]
+
+    def _is_hidden(
+        self, is_attachment: bool, parent: ScannedRecord | None, hidden: str
+    ) -> bool:
+        # This mirrors Record.is_hidden
+        value = bool_from_string(hidden.strip().lower())
+        if value is not None:
+            return bool(value)
+        if parent is None:
+            return False
+        parent_model = self._db.datamodels[parent.model]
+        if is_attachment:
+            return bool(parent_model.attachment_config.hidden)
+        if parent_model.child_config.hidden is not None:
+            return bool(parent_model.child_config.hidden)
+        return parent.hidden
+
+    def _scan_raw(
+        self,
+        path: str,
+        is_attachment: bool,
+        parent: ScannedRecord | None,
+        fields: dict[str, str] | None = None,
+    ) -> ScannedRecord | None:
+        if fields is None:
+            fields = self._read_fields(path, is_attachment)
+        datamodel = self._get_datamodel(
+            path, is_attachment, parent, fields.get("_model", "").strip()
+        )
+        if (
+            fields.get(self.redirect_from_field, "").strip()
+            and datamodel.id in self.redirect_models
+        ):
+            # The record declares redirects. Let Lektor do the full processing.
+            return self._scan_record(path)
+
+        hidden = self._is_hidden(is_attachment, parent, fields.get("_hidden", ""))
+
+        slug = slugify(fields.get("_slug", "")).strip("/")
+        if not slug and parent is not None:
+            if self._db.datamodels[parent.model].child_config.slug_format:
+                # The default slug is computed from a template
+                return self._scan_record(path)
+            slug = posixpath.basename(path)
+
+        base = _child_base(parent.url_path) if parent is not None else ""
+        url_path = "/" + posixpath.join(base, slug).strip("/")
+        if not is_attachment:
+            if "." not in posixpath.basename(url_path):
+                url_path = url_path.rstrip("/") + "/"
+            elif datamodel.pagination_config.enabled:
+                # Lektor does not allow this.  Let it complain.
+                return self._scan_record(path)
+
+        return ScannedRecord(path, url_path, datamodel.id, hidden, ())
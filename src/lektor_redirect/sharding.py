@@ -0,0 +1,123 @@
+"""Split redirect maps into shards.
+
+A sharded redirect map is written as a number of *shard* files, plus an
+*index* file (written at the map's configured path) which refers to them.
+Redirects are assigned to shards either by their top-level URL path segment,
+or by a stable hash of their URL path.  Each shard has its own checksum, so
+that only those shards whose contents have changed are rewritten.
+
+Prefix and regex redirects are matched in order (longest prefix first), so
+they are all kept together, in a dedicated shard which is listed first.
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import zlib
+from typing import Final, Iterable, Mapping
+from urllib.parse import quote
+
+from .prefixes import is_wildcard_url
+from .regexes import is_regex_url
+
+SHARD_BY_HASH: Final = "hash"
+SHARD_BY_SEGMENT: Final = "segment"
+
+SHARD_METHODS: Final = (SHARD_BY_HASH, SHARD_BY_SEGMENT)
+
+ROOT_SHARD: Final = "@root"
+"""The key of the shard for URLs which are not below any top-level segment.
+
+(Since segments are percent-encoded, this can not conflict with any segment.)
+"""
+
+PATTERNS_SHARD: Final = "@patterns"
+"""The key of the shard for prefix and regex redirects."""
+
+_ENTRY_HASH_SIZE: Final = 16
+
+_SHARD_SUFFIX: Final = ".map"
+
+
+def shard_url(map_url: str, key: str) -> str:
+    """The URL path of a shard of a map.
+
+    The shards of a map are stored in a directory alongside the map's index.
+    """
+    return f"{map_url}.d/{key}{_SHARD_SUFFIX}"
+
+
+def parse_shard_url(map_url: str, url_path: str) -> str | None:
+    """Get the shard key from the URL path of a shard of a map.
+
+    Returns `None` if ``url_path`` is not the URL path of a shard of the map.
+    """
+    prefix = f"{map_url}.d/"
+    if url_path.startswith(prefix) and url_path.endswith(_SHARD_SUFFIX):
+        key = url_path[len(prefix) : -len(_SHARD_SUFFIX)]
+        if key and "/" not in key:
+            return key
+    return None
+
+
+def _hash_shard_key(n: int, shards: int) -> str:
+    width = len(str(shards - 1))
+    return f"{n:0{width}d}"
+
+
+def hash_shard_keys(shards: int) -> list[str]:
+    """The keys of the shards used when sharding by hash."""
+    return [_hash_shard_key(n, shards) for n in range(shards)]
+
+
+def get_shard_key(shard_by: str, shards: int, url_path: str) -> str:
+    """Compute the key of the shard to which a redirect belongs.
+
+    The ``url_path`` is the redirect's URL path, relative to the site's base
+    path (i.e. with no leading slash.)
+    """
+    if is_regex_url(url_path) or is_wildcard_url("/" + url_path):
+        return PATTERNS_SHARD
+    if shard_by == SHARD_BY_HASH:
+        return _hash_shard_key(zlib.crc32(url_path.encode()) % shards, shards)
+    head, sep, _ = url_path.partition("/")
+    return quote(head, safe="") if sep else ROOT_SHARD
+
+
+def sorted_shard_keys(keys: Iterable[str]) -> list[str]:
+    """Sort shard keys into the order in which the shards are listed.
+
+    The `PATTERNS_SHARD` comes first, followed by the others in sorted order.
+    """
+    return sorted(keys, key=lambda key: (key != PATTERNS_SHARD, key))
+
+
+def entry_hash(from_url: str, to_url: str) -> int:
+    """A hash of a redirect map entry.
+
+    These are XOR-ed together to compute order-independent fingerprints of
+    the shards.
+    """
+    h = hashlib.blake2b(f"{from_url}\0{to_url}".encode(), digest_size=_ENTRY_HASH_SIZE)
+    return int.from_bytes(h.digest(), "big")
+
+
+def fingerprint_shards(
+    shard_by: str, shards: int, entries: Iterable[tuple[str, str]]
+) -> Mapping[str, int]:
+    """Compute fingerprints for the shards of a map.
+
+    The ``entries`` are ``(url_path, target_url_path)`` pairs, where the URL
+    paths are relative to the site's base path.  They need not be sorted.
+
+    When sharding by hash, all shards are included (even if empty.)
+    """
+    fingerprints: dict[str, int] = {}
+    if shard_by == SHARD_BY_HASH:
+        fingerprints = dict.fromkeys(hash_shard_keys(shards), 0)
+    for url_path, target_url_path in entries:
+        key = get_shard_key(shard_by, shards, url_path)
+        fingerprint = fingerprints.get(key, 0)
+        fingerprints[key] = fingerprint ^ entry_hash(url_path, target_url_path)
+    return fingerprints
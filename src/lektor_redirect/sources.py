@@ -1,21 +1,46 @@
 from __future__ import annotations
 
 import hashlib
+import os
 import posixpath
 import sys
-from contextlib import contextmanager
+from contextlib import contextmanager, suppress
 from contextvars import ContextVar
-from functools import cached_property
-from typing import ClassVar, Final, Iterator, Mapping, Sequence, TYPE_CHECKING
+from typing import (
+    Callable,
+    ClassVar,
+    Final,
+    IO,
+    Iterator,
+    Sequence,
+    TYPE_CHECKING,
+)
 
 from lektor.build_programs import BuildProgram as LektorBuildProgram
 from lektor.builder import Artifact, PathCache
+from lektor.context import Context, get_ctx
 from lektor.db import Record
 from lektor.environment import Environment
 from lektor.pluginsystem import get_plugin
+from lektor.reporter import reporter
 from lektor.sourceobj import VirtualSourceObject
-
-from .util import nginx_quote_for_map, normalize_url_path
+from lektorlib.context import (
+    DependencyIgnoringContextProxy,
+    disable_dependency_recording,
+)
+
+from .exceptions import InvalidRedirectException
+from .pagestore import PageStore
+from .prefixes import is_wildcard_url, wildcard_prefix
+from .regexes import is_regex_url
+from .sharding import parse_shard_url, shard_url, sorted_shard_keys
+from .util import (
+    builtin_redirect_page,
+    gzip_copy_file,
+    normalize_url_path,
+    walk_records,
+)
+from .writers import get_map_writer, NginxHashSizes, NginxMapWriter
 
 if sys.version_info >= (3, 11):
     from typing import Self
@@ -23,11 +48,15 @@ else:
     from typing_extensions import Self
 
 if TYPE_CHECKING:
-    from lektor_redirect.plugin import RedirectPlugin  # circ dep
+    from lektor_redirect.index import RedirectIndex  # circ dep
+    from lektor_redirect.plugin import MapConfig, RedirectPlugin  # circ dep
 
 
 HTML_EXTS: Final = {".html", ".htm"}
 
+BUILTIN_TEMPLATE: Final = ":builtin:"
+"""The ``template`` setting selecting the built-in redirect page."""
+
 
 def _get_redirect_plugin(env: Environment) -> RedirectPlugin:
     from .plugin import RedirectPlugin  # FIXME: circ dep
@@ -87,9 +116,56 @@ class Redirect(_VirtualSourceBase):
 
     @property
     def target(self) -> Record:
-        """The target record of the redirect."""
+        """The target record of the redirect.
+
+        If ``collapse_chains`` is enabled, this is the final target of any
+        chain of redirects.
+        """
+        plugin = _get_redirect_plugin(self.pad.env)
+        if plugin.collapse_chains:
+            index = plugin.get_index(self.pad)
+            with suppress(LookupError, InvalidRedirectException):
+                return index.get_final_target(self.url_path)
         return self.record
 
+    def render_builtin_page(self) -> bytes:
+        """Render the built-in redirect page, without using Jinja.
+
+        The page links to the target's external URL, if the project's ``url``
+        is configured, otherwise to its absolute URL.
+        """
+        target = self.target
+        location = self.url_to(target, absolute=True)
+        canonical = location
+        if self.pad.db.config.base_url:
+            canonical = self.url_to(target, external=True)
+        return builtin_redirect_page(location, canonical)
+
+    def get_checksum(self, path_cache: PathCache) -> str:
+        """A checksum of everything, besides the template, the page depends on.
+
+        This covers the record the redirect currently leads to (which changes
+        if the redirect is moved to another record, or removed), the URL of
+        its target, and the template setting and project URL.  It does not
+        depend on the content of the target record.
+        """
+        pad = self.pad
+        plugin = _get_redirect_plugin(pad.env)
+        current = _lookup_redirect(plugin.get_index(pad), self.url_path)
+        target = self.target
+        h = hashlib.md5()
+        for value in (
+            self.url_path,
+            current.path if current is not None else "",
+            target.path,
+            target.url_path,
+            plugin.redirect_template or "",
+            pad.db.config.base_url or "",
+            pad.db.config.base_path,
+        ):
+            h.update(value.encode() + b"\0")
+        return h.hexdigest()
+
     _disable_url_resolution: ClassVar = ContextVar(
         f"{__qualname__}._disable_url_resolution", default=False
     )
@@ -108,9 +184,8 @@ class Redirect(_VirtualSourceBase):
         if not cls._disable_url_resolution.get():
             pad = record.pad
             plugin = _get_redirect_plugin(pad.env)
-            index = plugin.get_index(pad)
             from_url = normalize_url_path(record, "/".join(url_path))
-            target = index.get(from_url)
+            target = _lookup_redirect(plugin.get_index(pad), from_url)
             if target is not None:
                 return cls(target, from_url)
         return None
@@ -124,7 +199,38 @@ class Redirect(_VirtualSourceBase):
         template = plugin.redirect_template
         if template:
             for redirect_url in plugin.get_redirect_urls(source):
-                yield cls(source, redirect_url)
+                if is_regex_url(redirect_url):
+                    continue  # the matching URLs can not be enumerated
+                if is_wildcard_url(redirect_url):
+                    yield from cls._iter_prefix_redirects(source, redirect_url)
+                else:
+                    yield cls(source, redirect_url)
+
+    @classmethod
+    def _iter_prefix_redirects(
+        cls, source: Record, wildcard_url: str
+    ) -> Iterator[Self]:
+        """Generate redirect pages for a prefix redirect.
+
+        A page is generated for each record below (and including) ``source``
+        whose URL path, below the prefix, is not otherwise in use.
+        """
+        pad = source.pad
+        index = _get_redirect_plugin(pad.env).get_index(pad)
+        prefix = wildcard_prefix(wildcard_url)
+        for record in walk_records(pad, source):
+            if not record.url_path.startswith(source.url_path):
+                continue
+            from_url = prefix + record.url_path[len(source.url_path) :]
+            if from_url in index:
+                continue  # an exact redirect takes precedence
+            target = index.get_prefix_target(from_url)
+            if target is None or target.path != record.path:
+                continue  # a longer prefix takes precedence
+            with disable_dependency_recording(), cls.disable_url_resolution():
+                if pad.resolve_url_path(from_url) is not None:
+                    continue
+            yield cls(record, from_url)
 
     class BuildProgram(LektorBuildProgram):  # type: ignore[misc]
         def produce_artifacts(self) -> None:
@@ -136,15 +242,137 @@ class Redirect(_VirtualSourceBase):
             elif posixpath.splitext(artifact_name)[1].lower() not in HTML_EXTS:
                 artifact_name += "/index.html"
 
-            sources = list(source.record.iter_source_filenames())
+            # The page depends on the target's URL, not on its content: that
+            # dependency is tracked by the redirect's checksum.  The target's
+            # directory (or, for an attachment, its file) is declared as the
+            # source only so that the page is pruned along with the target.
+            record = source.record
+            sources = [record.pad.db.to_fs_path(record.path)]
 
             self.declare_artifact(artifact_name, sources=sources)
 
         def build_artifact(self, artifact: Artifact) -> None:
-            plugin = _get_redirect_plugin(self.build_state.env)
+            ctx = get_ctx()
+            if ctx is not None:
+                # Rebuild the page when the redirect's checksum changes
+                ctx.record_virtual_dependency(self.source)
+            env = self.build_state.env
+            plugin = _get_redirect_plugin(env)
             template = plugin.redirect_template
-            if template:
+            if not template:
+                return
+            # Rendering looks at the target (and its parents), which would
+            # otherwise record dependencies on their content.
+            with record_template_dependencies_only(env):
+                self._build_page(artifact, plugin, template)
+
+        def _build_page(
+            self, artifact: Artifact, plugin: RedirectPlugin, template: str
+        ) -> None:
+            if template == BUILTIN_TEMPLATE:
+                content = self.source.render_builtin_page()
+            elif plugin.render_once_per_target:
+                content = plugin.render_redirect_page(self.source, template)
+            elif plugin.gzip_sidecars or plugin.hardlink_pages:
+                html = self.build_state.env.render_template(
+                    template, self.build_state.pad, this=self.source
+                )
+                content = html.encode("utf-8") + b"\n"
+            else:
                 artifact.render_template_into(template, this=self.source)
+                return
+            self._write_page(artifact, content, plugin.hardlink_pages)
+            if plugin.gzip_sidecars:
+                pad = self.build_state.pad
+                _add_gzip_sidecar(
+                    artifact,
+                    hashlib.md5(content).hexdigest(),
+                    lambda fp: fp.write(plugin.compress_redirect_page(pad, content)),
+                )
+
+        def _write_page(
+            self, artifact: Artifact, content: bytes, hardlink: bool
+        ) -> None:
+            if hardlink:
+                store = PageStore(self.build_state.builder.destination_path)
+                try:
+                    link_filename = store.link(content, artifact.dst_filename)
+                except OSError as exc:
+                    reporter.report_generic(
+                        f"Can not hard link redirect page ({exc}), writing a copy"
+                    )
+                else:
+                    artifact.replace_with_file(link_filename)
+                    return
+            with artifact.open("wb") as fp:
+                fp.write(content)
+
+
+class _TemplateDependencyContextProxy(DependencyIgnoringContextProxy):
+    """A context proxy which records only dependencies on template files."""
+
+    __slots__ = ["_template_dirs"]
+
+    def __init__(self, ctx: Context, template_dirs: Sequence[str]):
+        super().__init__(ctx)
+        self._template_dirs = tuple(
+            os.path.join(os.path.abspath(path), "") for path in template_dirs
+        )
+
+    def record_dependency(self, filename: str, affects_url: bool | None = None) -> None:
+        if os.path.abspath(filename).startswith(self._template_dirs):
+            self._ctx.record_dependency(filename)
+
+
+@contextmanager
+def record_template_dependencies_only(env: Environment) -> Iterator[None]:
+    """Record only dependencies on templates within context.
+
+    Other file dependencies, as well as virtual dependencies, are ignored.
+    """
+    ctx = get_ctx()
+    if ctx is None:
+        yield
+    else:
+        with _TemplateDependencyContextProxy(ctx, env.jinja_env.loader.searchpath):
+            yield
+
+
+def _add_gzip_sidecar(
+    artifact: Artifact, content_hash: str, compress: Callable[[IO[bytes]], object]
+) -> None:
+    """Arrange for a gzipped copy of ``artifact`` to be written next to it.
+
+    The ``.gz`` sidecar is built as a sub-artifact, after ``artifact`` has
+    been written, by ``compress``, which writes the payload to the file object
+    it is passed.  Its config hash is ``content_hash`` (which identifies the
+    content of ``artifact``), so it is rewritten only when the content changes.
+    """
+    ctx = get_ctx()
+    if ctx is None:
+        return
+
+    def build_sidecar(sidecar: Artifact) -> None:
+        with sidecar.open("wb") as fp:
+            compress(fp)
+
+    ctx.add_sub_artifact(
+        artifact.artifact_name + ".gz",
+        build_func=build_sidecar,
+        sources=artifact.sources,
+        source_obj=artifact.source_obj,
+        config_hash=content_hash,
+    )
+
+
+def _lookup_redirect(index: RedirectIndex, url_path: str) -> Record | None:
+    """Find the target of the redirect (exact, prefix or regex) from a URL path."""
+    target = index.get(url_path)
+    if target is None:
+        target = index.get_prefix_target(url_path)
+    if target is None:
+        target = index.get_regex_target(url_path)
+    return target
 
 
 _HASH_BYTES: Final = (sys.hash_info.width + 7) // 8
@@ -153,16 +381,46 @@ _HASH_BYTES: Final = (sys.hash_info.width + 7) // 8
 class RedirectMap(_VirtualSourceBase):
     VPATH_PREFIX: Final = "redirect-map"
 
-    @cached_property
-    def redirect_map(self) -> Mapping[str, str]:
+    def iter_redirect_map(self) -> Iterator[tuple[str, str]]:
         plugin = _get_redirect_plugin(self.pad.env)
-        return dict(plugin.iter_redirect_map(self.pad))
+        return plugin.iter_redirect_map(self.pad)
+
+    @property
+    def map_config(self) -> MapConfig:
+        """The configuration of this redirect map."""
+        from .plugin import MapConfig  # FIXME: circ dep
+
+        plugin = _get_redirect_plugin(self.pad.env)
+        map_config = plugin.redirect_maps.get(self.url_path)
+        if map_config is None:
+            return MapConfig("", self.url_path, plugin.map_format)
+        return map_config
+
+    @property
+    def map_format(self) -> str:
+        """The format of this redirect map."""
+        return self.map_config.format
+
+    def iter_shard_paths(self) -> Iterator[str]:
+        """Iterate over the paths to the shards of a sharded map.
+
+        These are the paths written to the map's index file: the
+        ``include_prefix`` followed by the path of the shard relative to the
+        directory containing the index.
+        """
+        map_config = self.map_config
+        plugin = _get_redirect_plugin(self.pad.env)
+        map_dir = posixpath.dirname(self.url_path)
+        for key in sorted_shard_keys(plugin.get_map_shards(self.pad, map_config)):
+            url_path = shard_url(self.url_path, key)
+            yield map_config.include_prefix + posixpath.relpath(url_path, map_dir)
 
     def get_checksum(self, path_cache: PathCache) -> str:
-        h = hashlib.md5()
-        for from_url, to_url in self.redirect_map.items():
-            h.update(f"{from_url}\0{to_url}\0".encode())
-        return h.hexdigest()
+        plugin = _get_redirect_plugin(self.pad.env)
+        map_config = self.map_config
+        if map_config.shard_by is not None:
+            return plugin.get_map_index_checksum(self.pad, map_config)
+        return plugin.get_redirect_map_checksum(self.pad, map_config.format)
 
     @classmethod
     def _resolve_url_path(cls, record: Record, url_path: Sequence[str]) -> Self | None:
@@ -170,7 +428,7 @@ class RedirectMap(_VirtualSourceBase):
             pad = record.pad
             plugin = _get_redirect_plugin(pad.env)
             map_url = normalize_url_path(record, "/".join(url_path))
-            if map_url == plugin.redirect_map_url:
+            if map_url in plugin.redirect_maps:
                 return RedirectMap(record, map_url)
         return None
 
@@ -179,8 +437,7 @@ class RedirectMap(_VirtualSourceBase):
         if source.path == "/":
             pad = source.pad
             plugin = _get_redirect_plugin(pad.env)
-            redirect_map_url = plugin.redirect_map_url
-            if redirect_map_url is not None:
+            for redirect_map_url in plugin.redirect_maps:
                 yield RedirectMap(source, redirect_map_url)
 
     class BuildProgram(LektorBuildProgram):  # type: ignore[misc]
@@ -191,7 +448,232 @@ class RedirectMap(_VirtualSourceBase):
             self.declare_artifact(artifact_name, sources=sources)
 
         def build_artifact(self, artifact: Artifact) -> None:
-            quote = nginx_quote_for_map
-            with artifact.open("w") as fp:
-                for from_url, to_url in self.source.redirect_map.items():
-                    print(f"{quote(from_url)} {quote(to_url)};", file=fp)
+            ctx = get_ctx()
+            if ctx is not None:
+                # Rebuild the map when its checksum changes
+                ctx.record_virtual_dependency(self.source)
+            source = self.source
+            map_config = source.map_config
+            writer = get_map_writer(map_config.format)
+            if map_config.shard_by is not None:
+                writer.write_index(artifact, source.iter_shard_paths())
+            else:
+                writer.write(artifact, source.iter_redirect_map())
+            plugin = _get_redirect_plugin(self.build_state.env)
+            if plugin.gzip_sidecars:
+                checksum = source.get_checksum(self.build_state.path_cache)
+                _add_gzip_sidecar(
+                    artifact,
+                    checksum,
+                    lambda fp: gzip_copy_file(artifact.dst_filename, fp),
+                )
+
+
+class RedirectMapShard(_VirtualSourceBase):
+    """A shard of a sharded redirect map."""
+
+    VPATH_PREFIX: Final = "redirect-map-shard"
+
+    @property
+    def shard(self) -> tuple[MapConfig, str]:
+        """The configuration of the map, and the key of this shard."""
+        plugin = _get_redirect_plugin(self.pad.env)
+        shard = _find_shard(plugin, self.url_path)
+        if shard is None:
+            msg = f"{self.url_path!r} is not the URL of a redirect map shard"
+            raise LookupError(msg)
+        return shard
+
+    def iter_redirect_map(self) -> Iterator[tuple[str, str]]:
+        plugin = _get_redirect_plugin(self.pad.env)
+        map_config, key = self.shard
+        return plugin.iter_map_shard(self.pad, map_config, key)
+
+    def get_checksum(self, path_cache: PathCache) -> str:
+        plugin = _get_redirect_plugin(self.pad.env)
+        map_config, key = self.shard
+        return plugin.get_map_shard_checksum(self.pad, map_config, key)
+
+    @classmethod
+    def _resolve_url_path(cls, record: Record, url_path: Sequence[str]) -> Self | None:
+        if record.path == "/":
+            pad = record.pad
+            plugin = _get_redirect_plugin(pad.env)
+            shard_url_path = normalize_url_path(record, "/".join(url_path))
+            shard = _find_shard(plugin, shard_url_path)
+            if shard is not None:
+                map_config, key = shard
+                # Which shards exist depends on the redirect index.  While the
+                # index is checking redirects for conflicts, any possible shard
+                # URL is taken to be that of a shard.
+                if Redirect._disable_url_resolution.get() or (
+                    key in plugin.get_map_shards(pad, map_config)
+                ):
+                    return cls(record, shard_url_path)
+        return None
+
+    @classmethod
+    def _generator(cls, source: Record) -> Iterator[Self]:
+        if source.path == "/":
+            pad = source.pad
+            plugin = _get_redirect_plugin(pad.env)
+            for map_url, map_config in plugin.redirect_maps.items():
+                if map_config.shard_by is not None:
+                    for key in sorted(plugin.get_map_shards(pad, map_config)):
+                        yield cls(source, shard_url(map_url, key))
+
+    class BuildProgram(LektorBuildProgram):  # type: ignore[misc]
+        def produce_artifacts(self) -> None:
+            source = self.source
+            artifact_name = source.url_path
+            sources = list(source.record.iter_source_filenames())
+            self.declare_artifact(artifact_name, sources=sources)
+
+        def build_artifact(self, artifact: Artifact) -> None:
+            ctx = get_ctx()
+            if ctx is not None:
+                # Rebuild the shard when its checksum changes
+                ctx.record_virtual_dependency(self.source)
+            map_config, _ = self.source.shard
+            writer = get_map_writer(map_config.format)
+            writer.write(artifact, self.source.iter_redirect_map())
+            plugin = _get_redirect_plugin(self.build_state.env)
+            if plugin.gzip_sidecars:
+                checksum = self.source.get_checksum(self.build_state.path_cache)
+                _add_gzip_sidecar(
+                    artifact,
+                    checksum,
+                    lambda fp: gzip_copy_file(artifact.dst_filename, fp),
+                )
+
+
+class RedirectMapHashSizes(_VirtualSourceBase):
+    """An nginx configuration snippet setting hash sizes for a redirect map."""
+
+    VPATH_PREFIX: Final = "redirect-map-hash-sizes"
+
+    @property
+    def hash_sizes(self) -> NginxHashSizes:
+        plugin = _get_redirect_plugin(self.pad.env)
+        return plugin.get_nginx_hash_sizes(self.pad)
+
+    def get_checksum(self, path_cache: PathCache) -> str:
+        # The snippet is rewritten only when the sizes change
+        return hashlib.md5(repr(tuple(self.hash_sizes)).encode()).hexdigest()
+
+    @classmethod
+    def _iter_hash_sizes_urls(cls, plugin: RedirectPlugin) -> Iterator[str]:
+        for map_config in plugin.redirect_maps.values():
+            if map_config.hash_sizes_url is not None:
+                yield map_config.hash_sizes_url
+
+    @classmethod
+    def _resolve_url_path(cls, record: Record, url_path: Sequence[str]) -> Self | None:
+        if record.path == "/":
+            pad = record.pad
+            plugin = _get_redirect_plugin(pad.env)
+            sizes_url = normalize_url_path(record, "/".join(url_path))
+            if sizes_url in cls._iter_hash_sizes_urls(plugin):
+                return cls(record, sizes_url)
+        return None
+
+    @classmethod
+    def _generator(cls, source: Record) -> Iterator[Self]:
+        if source.path == "/":
+            plugin = _get_redirect_plugin(source.pad.env)
+            for sizes_url in cls._iter_hash_sizes_urls(plugin):
+                yield cls(source, sizes_url)
+
+    class BuildProgram(LektorBuildProgram):  # type: ignore[misc]
+        def produce_artifacts(self) -> None:
+            source = self.source
+            artifact_name = source.url_path
+            sources = list(source.record.iter_source_filenames())
+            self.declare_artifact(artifact_name, sources=sources)
+
+        def build_artifact(self, artifact: Artifact) -> None:
+            ctx = get_ctx()
+            if ctx is not None:
+                # Rebuild the snippet when the sizes change
+                ctx.record_virtual_dependency(self.source)
+            sizes = self.source.hash_sizes
+            NginxMapWriter().write_hash_sizes(artifact, sizes)
+            if reporter.verbosity >= 1:
+                reporter.report_generic(
+                    f"nginx redirect map hash: {sizes.keys} keys, "
+                    f"map_hash_bucket_size {sizes.bucket_size}, "
+                    f"map_hash_max_size {sizes.max_size}, "
+                    f"up to {sizes.memory // 1024} KiB"
+                )
+
+
+class RedirectUrls(VirtualSourceObject):  # type: ignore[misc]
+    """The URLs which redirect to a record.
+
+    This is not built.  It exists so that pages which list the redirects to
+    a record (using the ``redirect_urls`` template filter) can depend on it,
+    and so be rebuilt when the list changes.
+    """
+
+    VPATH_PREFIX: Final = "redirect-urls"
+
+    @property
+    def path(self) -> str:
+        return f"{self.record.path}@{self.VPATH_PREFIX}"
+
+    @property
+    def redirect_urls(self) -> tuple[str, ...]:
+        """The URL paths of the valid exact redirects to the record, sorted."""
+        plugin = _get_redirect_plugin(self.pad.env)
+        return plugin.get_index(self.pad).get_redirect_urls(self.record.path)
+
+    def get_checksum(self, path_cache: PathCache) -> str:
+        return hashlib.md5("\0".join(self.redirect_urls).encode()).hexdigest()
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RedirectUrls):
+            return self.path == other.path
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.path)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.record!r})"
+
+    @classmethod
+    def _setup_env(cls, env: Environment) -> None:
+        env.virtualpathresolver(cls.VPATH_PREFIX)(cls._vpath_resolver)
+        env.jinja_env.filters["redirect_urls"] = cls._redirect_urls_filter
+
+    @classmethod
+    def _vpath_resolver(cls, record: Record, pieces: Sequence[str]) -> Self | None:
+        if pieces:
+            return None
+        return cls(record)
+
+    @staticmethod
+    def _redirect_urls_filter(record: object) -> tuple[str, ...]:
+        """The ``redirect_urls`` template filter.
+
+        E.g. ``{{ this|redirect_urls }}`` gives the URL paths which redirect
+        to the current page.
+        """
+        if not isinstance(record, Record):
+            return ()
+        source = RedirectUrls(record)
+        ctx = get_ctx()
+        if ctx is not None:
+            # Rebuild the page when the list of redirects changes
+            ctx.record_virtual_dependency(source)
+        return source.redirect_urls
+
+
+def _find_shard(plugin: RedirectPlugin, url_path: str) -> tuple[MapConfig, str] | None:
+    """Find the sharded map, and the shard key, for a shard's URL path."""
+    for map_url, map_config in plugin.redirect_maps.items():
+        if map_config.shard_by is not None:
+            key = parse_shard_url(map_url, url_path)
+            if key is not None:
+                return map_config, key
+    return None
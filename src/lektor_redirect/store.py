@@ -0,0 +1,218 @@
+"""A persistent, on-disk cache of per-record redirect information.
+
+Building the redirect index requires visiting every record in the site.
+Instantiating each `Record` is expensive on large sites.  The `IndexStore`
+remembers the redirect information extracted from each record, along with
+the size and mtime of the record's source file, in an SQLite database.
+On subsequent runs, only records whose sources have changed need be loaded.
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+from importlib.metadata import version
+from pathlib import Path
+from typing import Iterable, Mapping, NamedTuple, Tuple, TYPE_CHECKING
+
+from lektor.db import Pad
+from lektor.utils import get_cache_dir
+
+from .scanner import RecordScanner, ScannedRecord
+
+if TYPE_CHECKING:
+    from _typeshed import StrPath
+
+SCHEMA_VERSION = 1
+
+Signature = Tuple[int, int]
+MISSING: Signature = (-1, -1)
+
+
+class _Entry(NamedTuple):
+    signature: Signature
+    scanned: ScannedRecord
+
+    @property
+    def children_context(self) -> tuple[str, str, bool]:
+        """The parts of the entry which may affect the entries of its children."""
+        scanned = self.scanned
+        return scanned.url_path, scanned.model, scanned.hidden
+
+
+def get_store_filename(pad: Pad) -> Path:
+    """The default location of the index store for the project."""
+    project_id = pad.env.project.id
+    return Path(get_cache_dir(), "plugins", "redirect", f"{project_id}.sqlite")
+
+
+def stat_signature(filename: StrPath) -> Signature:
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return MISSING
+    return st.st_mtime_ns, st.st_size
+
+
+def compute_fingerprint(pad: Pad, extra_files: Iterable[StrPath] = ()) -> str:
+    """Compute a fingerprint of the global state which affects all records.
+
+    This includes the project file, datamodel definitions, and any additional
+    configuration files (e.g. the plugin's config) that are passed.
+    If the fingerprint changes, all cached entries are discarded.
+    """
+    h = hashlib.md5()
+    h.update(f"{SCHEMA_VERSION}\0{version('lektor')}\0".encode())
+    filenames: list[StrPath] = [pad.env.project.project_file, *extra_files]
+    filenames.extend(
+        datamodel.filename
+        for datamodel in pad.db.datamodels.values()
+        if datamodel.filename
+    )
+    for filename in sorted(os.fspath(f) for f in filenames):
+        mtime_ns, size = stat_signature(filename)
+        h.update(f"{filename}\0{mtime_ns}\0{size}\0".encode())
+    return h.hexdigest()
+
+
+def _source_filename(pad: Pad, path: str, is_attachment: bool) -> str:
+    fs_path = pad.db.to_fs_path(path)
+    if is_attachment:
+        return f"{fs_path}.lr"
+    return os.path.join(fs_path, "contents.lr")
+
+
+class IndexStore:
+    """An SQLite-backed store of per-record redirect information.
+
+    Entries are keyed by record path and validated against the mtime and size of
+    the record's source file.
+    """
+
+    def __init__(self, filename: StrPath, fingerprint: str):
+        self.filename = Path(filename)
+        self.fingerprint = fingerprint
+
+    def _connect(self) -> sqlite3.Connection:
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.filename)
+        con.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                url_path TEXT NOT NULL,
+                model TEXT NOT NULL,
+                hidden INTEGER NOT NULL,
+                redirect_urls TEXT NOT NULL
+            );
+            """
+        )
+        return con
+
+    def load(self) -> dict[str, _Entry]:
+        """Load all valid entries from the store."""
+        with closing(self._connect()) as con:
+            row = con.execute(
+                "SELECT value FROM meta WHERE key = 'fingerprint'"
+            ).fetchone()
+            if row is None or row[0] != self.fingerprint:
+                return {}
+            return {
+                path: _Entry(
+                    (mtime_ns, size),
+                    ScannedRecord(
+                        path,
+                        url_path,
+                        model,
+                        bool(hidden),
+                        tuple(json.loads(redirect_urls)),
+                    ),
+                )
+                for path, mtime_ns, size, url_path, model, hidden, redirect_urls in (
+                    con.execute("SELECT * FROM records")
+                )
+            }
+
+    def save(self, old: Mapping[str, _Entry], new: Mapping[str, _Entry]) -> None:
+        """Update the store.
+
+        Only the differences between `old` (as returned by `load`) and `new` are
+        written.
+        """
+        with closing(self._connect()) as con, con:
+            row = con.execute(
+                "SELECT value FROM meta WHERE key = 'fingerprint'"
+            ).fetchone()
+            if row is None or row[0] != self.fingerprint:
+                con.execute("DELETE FROM records")
+                con.execute(
+                    "INSERT OR REPLACE INTO meta (key, value)"
+                    " VALUES ('fingerprint', ?)",
+                    (self.fingerprint,),
+                )
+                old = {}
+            con.executemany(
+                "DELETE FROM records WHERE path = ?",
+                [(path,) for path in old.keys() - new.keys()],
+            )
+            con.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        path,
+                        *entry.signature,
+                        entry.scanned.url_path,
+                        entry.scanned.model,
+                        int(entry.scanned.hidden),
+                        json.dumps(entry.scanned.redirect_urls),
+                    )
+                    for path, entry in new.items()
+                    if old.get(path) != entry
+                ],
+            )
+
+    def refresh(self, scanner: RecordScanner, workers: int = 1) -> list[ScannedRecord]:
+        """Walk the site, returning the scanned information for all records.
+
+        Records are only rescanned when their source file has changed since the
+        last run, or when a change to their parent's URL, datamodel or visibility
+        may have affected them.
+        """
+        pad = scanner.pad
+        old = self.load()
+        new: dict[str, _Entry] = {}
+        stable: set[str] = set()
+
+        def scan(
+            path: str, is_attachment: bool, parent: ScannedRecord | None
+        ) -> ScannedRecord | None:
+            signature = stat_signature(_source_filename(pad, path, is_attachment))
+            cached = old.get(path)
+            parent_stable = parent is None or parent.path in stable
+            if parent_stable and cached is not None and cached.signature == signature:
+                entry = cached
+                stable.add(path)
+            else:
+                scanned = scanner.scan(path, is_attachment, parent)
+                if scanned is None:
+                    return None  # pragma: no cover (deleted while walking)
+                entry = _Entry(signature, scanned)
+                if cached is not None:
+                    if cached.children_context == entry.children_context:
+                        stable.add(path)
+            new[path] = entry
+            return entry.scanned
+
+        scanned_records = list(scanner.walk(scan, workers=workers))
+        self.save(old, new)
+        return scanned_records
@@ -1,12 +1,54 @@
+from __future__ import annotations
+
+import gzip
+import heapq
+import html
+import json
 import posixpath
 import re
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
 from collections import deque
-from typing import Iterator
+from contextlib import ExitStack
+from itertools import chain
+from typing import (
+    Any,
+    Callable,
+    Container,
+    Final,
+    IO,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Tuple,
+    TypeVar,
+)
+from urllib.parse import quote
 
+from lektor.assets import Directory
+from lektor.build_programs import builtin_build_programs
 from lektor.db import Pad, Page, Record
+from lektor.sourceobj import SourceObject
 from lektorlib.context import disable_dependency_recording
 
 
+class RecordInfo(NamedTuple):
+    """The redirect-related information extracted from a single record."""
+
+    path: str
+    """The Lektor path of the record."""
+
+    url_path: str
+    """The URL path of the record."""
+
+    redirect_urls: tuple[str, ...]
+    """Normalized, absolute URL paths which should redirect to the record."""
+
+
 def normalize_url_path(record: Record, url_path: str) -> str:
     """Normalize url_path.
 
@@ -24,15 +66,20 @@ def normalize_url_path(record: Record, url_path: str) -> str:
     return url_path
 
 
-def nginx_quote_for_map(s: str) -> str:
-    """Quote string, if necessary, for nginx map file."""
+def nginx_quote_for_map(s: str, variables: bool = False) -> str:
+    """Quote string, if necessary, for nginx map file.
+
+    If ``variables`` is set, ``$`` is not escaped, so that variables (and
+    regex captures) are interpolated.
+    """
     quot = ""
     if re.search(r"[ \"'{};]", s):
         quot = '"'
         if quot in s and "'" not in s:
             quot = "'"
 
-    escaped = re.sub(rf"[{quot}$\\]", r"\\\g<0>", s)
+    dollar = "" if variables else "$"
+    escaped = re.sub(rf"[{quot}{dollar}\\]", r"\\\g<0>", s)
     if not quot and re.match(r"(default|hostnames|include|volatile)\b", escaped):
         # Nginx map "special parameters" must be escaped to prevent magic
         # See https://nginx.org/en/docs/http/ngx_http_map_module.html#map
@@ -41,10 +88,134 @@ def nginx_quote_for_map(s: str) -> str:
     return f"{quot}{escaped}{quot}"
 
 
-def walk_records(pad: Pad) -> Iterator[Record]:
-    """Iterate over all records in the Lektor DB."""
+def nginx_regex_for_prefix(prefix: str) -> str:
+    """An nginx map regex key matching URLs which start with ``prefix``.
+
+    The rest of the URL is captured as ``$1``.
+    """
+    return nginx_quote_for_map(f"~^{re.escape(prefix)}(.*)$", variables=True)
+
+
+def apache_quote_for_rewrite_map(s: str) -> str:
+    """Quote string, if necessary, for an Apache ``txt:`` RewriteMap.
+
+    Keys and values in such maps are separated by whitespace, and there is no
+    quoting mechanism, so whitespace (and a leading ``#``, which would
+    start a comment) is percent-encoded.
+    """
+    escaped = re.sub(r"\s", lambda m: quote(m.group()), s)
+    if escaped.startswith("#"):
+        escaped = "%23" + escaped[1:]
+    return escaped
+
+
+_BUILTIN_REDIRECT_PAGE: Final = """\
+<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Page Moved</title>
+<link rel="canonical" href="{canonical}">
+<meta http-equiv="refresh" content="0; url={location}">
+<script>window.location.href = {location_js};</script>
+</head>
+<body>
+<h1>Page Moved</h1>
+<p>If you are not automatically redirected, the page you want can be found at
+<a href="{location}">{canonical}</a>.</p>
+</body>
+</html>
+"""
+
+# Characters escaped to keep a JSON string literal inert inside <script>
+_SCRIPT_ESCAPES: Final = str.maketrans(
+    {"<": "\\u003c", ">": "\\u003e", "&": "\\u0026", "'": "\\u0027"}
+)
+
+
+def builtin_redirect_page(location: str, canonical: str) -> bytes:
+    """Format the built-in redirect page (used when ``template = :builtin:``).
+
+    The page redirects to ``location`` by meta refresh and by JavaScript, and
+    links to ``canonical`` (the target's external URL).
+    """
+    return _BUILTIN_REDIRECT_PAGE.format(
+        location=html.escape(location),
+        canonical=html.escape(canonical),
+        location_js=json.dumps(location).translate(_SCRIPT_ESCAPES),
+    ).encode("utf-8")
+
+
+def gzip_compress(content: bytes) -> bytes:
+    """Compress ``content`` for a ``.gz`` sidecar file.
+
+    No timestamp is included, so that the same content always compresses to
+    the same bytes.
+    """
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def gzip_copy_file(filename: str, fp: IO[bytes]) -> None:
+    """Write a compressed copy of the file ``filename`` to ``fp``.
+
+    The file is streamed, rather than read into memory.  As with
+    :func:`gzip_compress`, no timestamp (or file name) is included.
+    """
+    with open(filename, "rb") as src, gzip.GzipFile(
+        filename="", mode="wb", compresslevel=9, fileobj=fp, mtime=0
+    ) as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def collapse_chains(
+    redirects: Mapping[str, str],
+) -> tuple[dict[str, str], dict[str, tuple[str, ...]]]:
+    """Resolve chains of redirects to their final targets.
+
+    The ``redirects`` map URL paths to target URL paths.  Where a target is
+    itself redirected, the chain of redirects is followed to its end.
+
+    Returns a pair of dicts.  The first maps each URL path to its final
+    target.  The second maps each URL path which leads to a cycle to the
+    cycle's URL paths.  (Each URL path appears in exactly one of the dicts.)
+
+    This runs in time linear in the number of redirects: the result for each
+    URL path is memoised, so each chain is followed only once.
+    """
+    final: dict[str, str] = {}
+    cycles: dict[str, tuple[str, ...]] = {}
+    for start in redirects:
+        chain: list[str] = []
+        on_chain: dict[str, int] = {}
+        url_path = start
+        while url_path in redirects and url_path not in final:
+            if url_path in cycles:
+                break
+            if url_path in on_chain:
+                cycle = tuple(chain[on_chain[url_path] :])
+                cycles.update(dict.fromkeys(cycle, cycle))
+                break
+            on_chain[url_path] = len(chain)
+            chain.append(url_path)
+            url_path = redirects[url_path]
+
+        if url_path in cycles:
+            cycle = cycles[url_path]
+            for member in chain:
+                cycles.setdefault(member, cycle)
+        else:
+            target = final.get(url_path, url_path)
+            final.update(dict.fromkeys(chain, target))
+    return final, cycles
+
+
+def walk_records(pad: Pad, root: Record | None = None) -> Iterator[Record]:
+    """Iterate over all records in the Lektor DB.
+
+    If ``root`` is given, only it and the records below it are visited.
+    """
     with disable_dependency_recording():
-        records = deque([pad.root])
+        records = deque([pad.root if root is None else root])
         while records:
             record = records.popleft()
             if isinstance(record, Page):
@@ -59,3 +230,151 @@ def walk_records(pad: Pad) -> Iterator[Record]:
                 query._include_attachments = True
                 records.extend(query)
             yield record
+
+
+def source_key(source: SourceObject) -> str:
+    """A string identifying a source.
+
+    This is the source's Lektor path or, for sources which do not have one
+    (assets), its URL path.
+    """
+    path: str | None = source.path
+    return path if path is not None else source.url_path
+
+
+def collect_artifact_url_paths(
+    pad: Pad,
+    exclude_generators: Container[
+        Callable[[SourceObject], Iterable[SourceObject]]
+    ] = (),
+) -> dict[str, str]:
+    """Collect the URL paths of all the artifacts which Lektor will build.
+
+    This enumerates sources in the same way as
+    `lektor.builder.Builder.build_all`: starting from the roots, it follows
+    each source's build program's child sources, and the output of the
+    environment's custom generators (except those in ``exclude_generators``).
+    Virtual sources and sources generated by other plugins are included.
+
+    Returns a dict mapping URL path to the `source_key` of the source whose
+    artifact lives there.
+    """
+    env = pad.env
+    generators = [gen for gen in env.custom_generators if gen not in exclude_generators]
+    build_programs = list(
+        chain(reversed(env.build_programs), reversed(builtin_build_programs))
+    )
+
+    url_paths: dict[str, str] = {}
+    with disable_dependency_recording():
+        sources: deque[SourceObject] = deque(pad.get_all_roots())
+        while sources:
+            source = sources.popleft()
+            if source.is_visible and not isinstance(source, Directory):
+                url_paths.setdefault(source.url_path, source_key(source))
+            for cls, build_program in build_programs:
+                if isinstance(source, cls):
+                    sources.extend(build_program(source, None).iter_child_sources())
+                    break
+            for generator in generators:
+                sources.extend(generator(source) or ())
+    return url_paths
+
+
+StrTuple = TypeVar("StrTuple", bound=Tuple[str, ...])
+
+_MAX_RUNS = 64  # the maximum number of sorted runs to merge at once
+
+
+def _estimate_size(item: tuple[str, ...]) -> int:
+    return sys.getsizeof(item) + sum(map(sys.getsizeof, item))
+
+
+def _write_run(items: Iterable[tuple[str, ...]], stack: ExitStack) -> IO[str]:
+    fp = stack.enter_context(tempfile.TemporaryFile("w+", encoding="utf-8"))
+    fp.writelines(json.dumps(item) + "\n" for item in items)
+    fp.seek(0)
+    return fp
+
+
+def _read_run(fp: IO[str]) -> Iterator[Any]:
+    for line in fp:
+        yield tuple(json.loads(line))
+
+
+def external_sort(items: Iterable[StrTuple], memory_budget: int) -> Iterator[StrTuple]:
+    """Sort tuples of strings, using bounded memory.
+
+    Items are accumulated in memory until their (estimated) size exceeds
+    ``memory_budget`` bytes.  At that point they are sorted and spilled to a
+    temporary file.  The sorted runs are finally merged.
+    """
+    runs: list[IO[str]] = []
+    buffer: list[StrTuple] = []
+    size = 0
+    with ExitStack() as stack:
+        for item in items:
+            buffer.append(item)
+            size += _estimate_size(item)
+            if size > memory_budget:
+                buffer.sort()
+                runs.append(_write_run(buffer, stack))
+                buffer = []
+                size = 0
+                if len(runs) >= _MAX_RUNS:
+                    # Limit the number of open files
+                    merged = _write_run(heapq.merge(*map(_read_run, runs)), stack)
+                    for fp in runs:
+                        fp.close()
+                    runs = [merged]
+        buffer.sort()
+        yield from heapq.merge(*map(_read_run, runs), buffer)
+
+
+class _SpilledRun:
+    """Sorted items, stored as JSON lines in a temporary file.
+
+    Unlike the iterator returned by `external_sort`, this may be iterated
+    over repeatedly (even concurrently.)
+    """
+
+    _CHUNK_SIZE: Final = 64 * 1024
+
+    def __init__(self, items: Iterable[tuple[str, ...]]):
+        self._fp = tempfile.TemporaryFile()
+        self._lock = threading.Lock()
+        weakref.finalize(self, self._fp.close)
+        self._fp.writelines(json.dumps(item).encode() + b"\n" for item in items)
+
+    def __iter__(self) -> Iterator[Any]:
+        offset = 0
+        partial = b""
+        while True:
+            with self._lock:
+                self._fp.seek(offset)
+                chunk = self._fp.read(self._CHUNK_SIZE)
+            if not chunk:
+                return
+            offset += len(chunk)
+            *lines, partial = (partial + chunk).split(b"\n")
+            for line in lines:
+                yield tuple(json.loads(line))
+
+
+def sorted_items(items: Iterable[StrTuple], memory_budget: int) -> Iterable[StrTuple]:
+    """Sort tuples of strings, using bounded memory.
+
+    This returns an iterable which can be iterated over repeatedly.  If the
+    sorted items fit within ``memory_budget`` bytes, that is a list.
+    Otherwise, the sorted items are stored in a temporary file.
+    """
+    buffer: list[StrTuple] = []
+    size = 0
+    merged = external_sort(items, memory_budget)
+    for item in merged:
+        buffer.append(item)
+        size += _estimate_size(item)
+        if size > memory_budget:
+            spilled: Iterable[StrTuple] = _SpilledRun(chain(buffer, merged))
+            return spilled
+    return buffer
@@ -0,0 +1,356 @@
+"""Writers for the various redirect map file formats.
+
+The format of the redirect map is selected by the ``map_format`` setting.
+Writers are registered, by format name, using `register_map_writer`.
+Each writer consumes the (sorted) map entries as a stream.
+
+Entries for prefix redirects have a wildcard source URL (see
+`lektor_redirect.prefixes`), and those for regex redirects a ``~``-prefixed
+one (see `lektor_redirect.regexes`).  Writers for formats which support them
+(``supports_patterns``) write a single rule for each; others omit them,
+with a warning.
+
+"""
+
+from __future__ import annotations
+
+import importlib
+import os
+import tempfile
+from types import ModuleType
+from typing import (
+    ClassVar,
+    Final,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from lektor.builder import Artifact
+from lektor.reporter import reporter
+
+from .prefixes import is_wildcard_url, wildcard_prefix
+from .regexes import is_regex_url
+from .util import (
+    apache_quote_for_rewrite_map,
+    nginx_quote_for_map,
+    nginx_regex_for_prefix,
+)
+
+DEFAULT_MAP_FORMAT = "nginx"
+
+MapEntries = Iterable[Tuple[str, str]]
+
+
+class MapWriter:
+    """Write the redirect map to an artifact."""
+
+    format_name: ClassVar[str]
+
+    supports_patterns: ClassVar[bool] = False
+    """Whether the format can express prefix and regex redirects."""
+
+    @property
+    def checksum_key(self) -> str:
+        """A string identifying the output format.
+
+        This is included in the redirect map's checksum, so that the map is
+        rebuilt if anything affecting the format of its output changes.
+        """
+        return self.format_name
+
+    def write(self, artifact: Artifact, entries: MapEntries) -> None:
+        raise NotImplementedError
+
+    def iter_exact_entries(
+        self, entries: MapEntries, pattern_entries: list[tuple[str, str]]
+    ) -> Iterator[tuple[str, str]]:
+        """Iterate over the entries which are not for prefix or regex redirects.
+
+        If the format supports them, the entries for prefix and regex
+        redirects are appended to ``pattern_entries``.  Otherwise they are
+        dropped, with a warning.
+        """
+        for from_url, to_url in entries:
+            kind = _pattern_kind(from_url)
+            if kind is None:
+                yield from_url, to_url
+            elif self.supports_patterns:
+                pattern_entries.append((from_url, to_url))
+            else:
+                reporter.report_generic(
+                    f"{kind} redirect {from_url!r} => {to_url!r} "
+                    f"omitted from {self.format_name} redirect map"
+                )
+
+    def write_index(self, artifact: Artifact, shard_paths: Iterable[str]) -> None:
+        """Write the index file of a sharded map.
+
+        By default, this simply lists the paths to the shards, one per line.
+        """
+        with artifact.open("w") as fp:
+            for shard_path in shard_paths:
+                print(shard_path, file=fp)
+
+
+def _pattern_kind(from_url: str) -> str | None:
+    if is_regex_url(from_url):
+        return "Regex"
+    if is_wildcard_url(from_url):
+        return "Prefix"
+    return None
+
+
+def _pattern_order(entry: tuple[str, str]) -> tuple[int, int, tuple[str, str]]:
+    """Order prefix rules (longest prefix first) before regex rules."""
+    from_url = entry[0]
+    if is_regex_url(from_url):
+        return 1, 0, entry
+    return 0, -len(from_url), entry
+
+
+_MAP_WRITERS: dict[str, type[MapWriter]] = {}
+
+MapWriterType = TypeVar("MapWriterType", bound=Type[MapWriter])
+
+
+def register_map_writer(cls: MapWriterType) -> MapWriterType:
+    """Class decorator to register a `MapWriter` for its ``format_name``."""
+    _MAP_WRITERS[cls.format_name] = cls
+    return cls
+
+
+def get_map_writer(format_name: str) -> MapWriter:
+    """Get a writer for the named map format."""
+    try:
+        writer_class = _MAP_WRITERS[format_name]
+    except KeyError:
+        known = ", ".join(sorted(_MAP_WRITERS))
+        msg = f"Unknown redirect map_format {format_name!r} (known formats: {known})"
+        raise RuntimeError(msg) from None
+    return writer_class()
+
+
+class TextMapWriter(MapWriter):
+    """Write the redirect map as a text file, one entry per line."""
+
+    def quote(self, s: str) -> str:
+        """Quote a URL for inclusion in the map."""
+        raise NotImplementedError
+
+    def format_entry(self, from_url: str, to_url: str) -> str:
+        return f"{self.quote(from_url)} {self.quote(to_url)}"
+
+    def format_prefix_entry(self, from_url: str, to_url: str) -> str:
+        """Format the entry for a prefix redirect."""
+        raise NotImplementedError
+
+    def format_regex_entry(self, from_url: str, to_url: str) -> str:
+        """Format the entry for a regex redirect."""
+        raise NotImplementedError
+
+    def write(self, artifact: Artifact, entries: MapEntries) -> None:
+        pattern_entries: list[tuple[str, str]] = []
+        with artifact.open("w") as fp:
+            for from_url, to_url in self.iter_exact_entries(entries, pattern_entries):
+                print(self.format_entry(from_url, to_url), file=fp)
+            # Prefix rules, then regex rules, follow the exact entries
+            for from_url, to_url in sorted(pattern_entries, key=_pattern_order):
+                if is_regex_url(from_url):
+                    print(self.format_regex_entry(from_url, to_url), file=fp)
+                else:
+                    print(self.format_prefix_entry(from_url, to_url), file=fp)
+
+
+@register_map_writer
+class NginxMapWriter(TextMapWriter):
+    """Entries for an nginx ``map`` block (to be ``include``-ed into one)."""
+
+    format_name = "nginx"
+
+    supports_patterns = True
+
+    def quote(self, s: str) -> str:
+        return nginx_quote_for_map(s)
+
+    def format_entry(self, from_url: str, to_url: str) -> str:
+        return super().format_entry(from_url, to_url) + ";"
+
+    def format_prefix_entry(self, from_url: str, to_url: str) -> str:
+        """Format a regex entry for a prefix redirect.
+
+        Nginx checks regexes in order, after all the exact entries.
+        """
+        from_regex = nginx_regex_for_prefix(wildcard_prefix(from_url))
+        to_regex = nginx_quote_for_map(f"{to_url}$1", variables=True)
+        return f"{from_regex} {to_regex};"
+
+    def format_regex_entry(self, from_url: str, to_url: str) -> str:
+        from_regex = nginx_quote_for_map(from_url, variables=True)
+        return f"{from_regex} {self.quote(to_url)};"
+
+    def write_index(self, artifact: Artifact, shard_paths: Iterable[str]) -> None:
+        """Write ``include`` directives for the shards of the map."""
+        with artifact.open("w") as fp:
+            for shard_path in shard_paths:
+                print(f"include {nginx_quote_for_map(shard_path)};", file=fp)
+
+    def get_hash_sizes(self, entries: MapEntries) -> NginxHashSizes:
+        """Compute the ``map_hash_*`` settings needed for a map."""
+        return NginxHashSizes.from_keys(
+            self.quote(from_url)
+            for from_url, _ in entries
+            if _pattern_kind(from_url) is None  # regexes are not hashed
+        )
+
+    def write_hash_sizes(self, artifact: Artifact, sizes: NginxHashSizes) -> None:
+        """Write an nginx configuration snippet setting the hash sizes."""
+        with artifact.open("w") as fp:
+            print(
+                f"# {sizes.keys} keys, the longest of length {sizes.max_key_length}",
+                file=fp,
+            )
+            print(f"map_hash_bucket_size {sizes.bucket_size};", file=fp)
+            print(f"map_hash_max_size {sizes.max_size};", file=fp)
+
+
+@register_map_writer
+class ApacheTxtMapWriter(TextMapWriter):
+    """An Apache ``RewriteMap`` of type ``txt:``."""
+
+    format_name = "txt"
+
+    def quote(self, s: str) -> str:
+        return apache_quote_for_rewrite_map(s)
+
+
+@register_map_writer
+class ApacheDbmMapWriter(MapWriter):
+    """An Apache ``RewriteMap`` of type ``dbm:``.
+
+    The map is built using the first available of the `DBM_MODULES`.  Only
+    those which store the database in a single file are usable.  With
+    `dbm.gnu`, Apache should be configured to use ``dbm=gdbm:``; with
+    `dbm.ndbm` the appropriate type depends on the library Python was built
+    against (see `dbm.ndbm.library`).
+    """
+
+    format_name = "dbm"
+
+    DBM_MODULES: ClassVar[tuple[str, ...]] = ("dbm.gnu", "dbm.ndbm")
+
+    @property
+    def dbm_module(self) -> ModuleType:
+        for name in self.DBM_MODULES:
+            try:
+                return importlib.import_module(name)
+            except ImportError:
+                pass
+        modules = ", ".join(self.DBM_MODULES)
+        msg = f"The dbm map_format requires one of these Python modules: {modules}"
+        raise RuntimeError(msg)
+
+    @property
+    def checksum_key(self) -> str:
+        return f"{self.format_name}:{self.dbm_module.__name__}"
+
+    def write(self, artifact: Artifact, entries: MapEntries) -> None:
+        dbm_module = self.dbm_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "redirect")
+            with dbm_module.open(db_path, "n") as db:
+                for from_url, to_url in self.iter_exact_entries(entries, []):
+                    db[from_url.encode("utf-8")] = to_url.encode("utf-8")
+            filenames = os.listdir(tmpdir)
+            if len(filenames) != 1:
+                msg = (
+                    f"{dbm_module.__name__} did not write a single file "
+                    f"(wrote {', '.join(sorted(filenames))})"
+                )
+                raise RuntimeError(msg)
+            artifact.replace_with_file(os.path.join(tmpdir, filenames[0]), copy=True)
+
+
+@register_map_writer
+class HAProxyMapWriter(ApacheTxtMapWriter):
+    """An HAProxy map file (for use with, e.g., the ``map_str`` converter.)
+
+    These have the same syntax as Apache ``txt:`` RewriteMaps.
+    """
+
+    format_name = "haproxy"
+
+
+_POINTER_SIZE: Final = 8  # assume a 64-bit nginx
+_CACHELINE_SIZE: Final = 64
+_MIN_KEYS_PER_BUCKET: Final = 4
+_DEFAULT_MAP_HASH_MAX_SIZE: Final = 2048
+
+
+def _next_power_of_two(n: int) -> int:
+    return 1 << max(0, n - 1).bit_length()
+
+
+class NginxHashSizes(NamedTuple):
+    """Settings for nginx's ``map_hash_*`` directives, suitable for a map."""
+
+    keys: int
+    """The number of keys in the map."""
+
+    max_key_length: int
+    """The length of the longest (quoted) key in the map."""
+
+    bucket_size: int
+    """A value for ``map_hash_bucket_size``."""
+
+    max_size: int
+    """A value for ``map_hash_max_size``."""
+
+    @property
+    def memory(self) -> int:
+        """A rough upper bound on the memory (in bytes) used by the hash table.
+
+        This counts the table of bucket pointers, the hash elements, and the
+        padding of each bucket to a cache line.
+        """
+        buckets = min(self.keys, self.max_size)
+        return (
+            self.max_size * _POINTER_SIZE
+            + self.keys * _nginx_hash_elt_size(self.max_key_length)
+            + buckets * (_POINTER_SIZE + _CACHELINE_SIZE)
+        )
+
+    @classmethod
+    def from_keys(cls, keys: Iterable[str]) -> NginxHashSizes:
+        """Compute the hash sizes needed for a map with the given (quoted) keys.
+
+        The bucket size is chosen so that each bucket can hold several of the
+        longest keys.  (Nginx fails to build the hash if any key is larger
+        than a bucket, and it is hard to find a table size with no overfull
+        buckets if each bucket can only hold one or two keys.)  The maximum
+        hash size is chosen to leave nginx ample room in its search for a
+        table size in which no bucket overflows.
+        """
+        count = 0
+        max_key_length = 0
+        for key in keys:
+            count += 1
+            max_key_length = max(max_key_length, len(key))
+        elt_size = _nginx_hash_elt_size(max_key_length)
+        bucket_size = _next_power_of_two(
+            max(
+                _CACHELINE_SIZE,
+                _MIN_KEYS_PER_BUCKET * elt_size + _POINTER_SIZE,
+            )
+        )
+        max_size = max(_DEFAULT_MAP_HASH_MAX_SIZE, _next_power_of_two(2 * count))
+        return cls(count, max_key_length, bucket_size, max_size)
+
+
+def _nginx_hash_elt_size(key_length: int) -> int:
+    # This mirrors the NGX_HASH_ELT_SIZE macro
+    aligned_length = -(-(key_length + 2) // _POINTER_SIZE) * _POINTER_SIZE
+    return _POINTER_SIZE + aligned_length
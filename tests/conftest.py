@@ -6,6 +6,7 @@ import shutil
 from contextlib import contextmanager, ExitStack
 from pathlib import Path
 from typing import (
+    Any,
     Callable,
     ContextManager,
     Iterable,
@@ -13,6 +14,7 @@ from typing import (
     MutableMapping,
     TYPE_CHECKING,
 )
+from unittest import mock
 
 import pytest
 from inifile import IniFile
@@ -196,3 +198,44 @@ class ReporterCaptureFixture(BufferReporter):  # type: ignore[misc]
     def __repr__(self) -> str:  # pragma: no cover
         messages = self.get_generic_messages()
         return f"<{self.__class__.__name__}: messages={messages!r}>"
+
+
+@contextmanager
+def spy_on(owner: object, name: str) -> Iterator[mock.Mock]:
+    """Count (and record) the calls to the method ``name`` of ``owner``."""
+    method = getattr(owner, name)
+    with mock.patch.object(owner, name, autospec=True, side_effect=method) as spy:
+        yield spy
+
+
+class BuildSiteFixture:
+    """Build the test site from scratch (with a fresh environment).
+
+    The environment used for, and the reports made during, the last build are
+    available as ``env`` and ``reports``.
+    """
+
+    env: Environment
+    reports: list[tuple[str, dict[str, Any]]]
+
+    def __init__(self, site_dir: Path, output_path: Path):
+        self.site_dir = site_dir
+        self.output_path = output_path
+
+    def __call__(self, *, count: tuple[object, str] | None = None) -> int:
+        """Build the site, returning the number of calls to the ``count`` method."""
+        env = self.env = Project.from_path(self.site_dir).make_env(load_plugins=False)
+        env.plugin_controller.instanciate_plugin("redirect", RedirectPlugin)
+        env.plugin_controller.emit("setup-env")
+        builder = Builder(env.new_pad(), self.output_path)
+        with ExitStack() as stack:
+            spy = stack.enter_context(spy_on(*count)) if count is not None else None
+            reporter = stack.enter_context(BufferReporter(env, verbosity=1))
+            assert builder.build_all() == 0
+        self.reports = reporter.buffer
+        return spy.call_count if spy is not None else 0
+
+
+@pytest.fixture
+def build_site(tmp_site_dir: Path, tmp_path: Path) -> BuildSiteFixture:
+    return BuildSiteFixture(tmp_site_dir, tmp_path / "output")
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from lektor_redirect.bulk import (
+    guess_format,
+    iter_redirects_file,
+    read_redirects_file,
+    stat_key,
+)
+
+from .conftest import ReporterCaptureFixture
+
+
+@pytest.mark.parametrize(
+    "filename, file_format",
+    [
+        ("redirects.csv", "csv"),
+        ("redirects.TSV", "tsv"),
+        ("data/redirects.jsonl", "jsonl"),
+    ],
+)
+def test_guess_format(filename: str, file_format: str) -> None:
+    assert guess_format(filename) == file_format
+
+
+def test_guess_format_unknown() -> None:
+    with pytest.raises(RuntimeError, match=r"format of redirects file"):
+        guess_format("redirects.txt")
+
+
+@pytest.mark.parametrize(
+    "filename, data",
+    [
+        ("r.csv", '# comment\n/old/,/about\n\n"/a,b/", /projects\n'),
+        ("r.tsv", "/old/\t/about\n/a,b/\t/projects\n"),
+        (
+            "r.jsonl",
+            '["/old/", "/about"]\n{"url": "/a,b/", "path": "/projects"}\n',
+        ),
+    ],
+)
+def test_iter_redirects_file(tmp_path: Path, filename: str, data: str) -> None:
+    redirects_file = tmp_path / filename
+    redirects_file.write_text(data)
+    assert list(iter_redirects_file(redirects_file)) == [
+        ("/old/", "/about"),
+        ("/a,b/", "/projects"),
+    ]
+
+
+def test_iter_redirects_file_skips_bad_entries(
+    tmp_path: Path, captured_reports: ReporterCaptureFixture
+) -> None:
+    redirects_file = tmp_path / "r.jsonl"
+    redirects_file.write_text('["/old/"]\n{"url": "/x/"}\nnot json\n["/a/", "/b"]\n')
+    assert list(iter_redirects_file(redirects_file)) == [("/a/", "/b")]
+    messages = captured_reports.get_generic_messages()
+    assert [message.rsplit(":", 1)[1] for message in messages] == ["1", "2", "3"]
+
+
+def test_read_redirects_file(tmp_path: Path) -> None:
+    redirects_file = tmp_path / "r.csv"
+    redirects_file.write_text("/b/,/about/\n/a/,about\n/a/,/about\nold,/\n")
+    info = read_redirects_file(redirects_file, lambda url: url.upper())
+    assert info.key == stat_key(redirects_file)
+    assert info.redirects == {"/about": ("/A/", "/B/"), "/": ("OLD",)}
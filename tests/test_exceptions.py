@@ -6,6 +6,8 @@ from lektor.db import Pad
 
 from lektor_redirect.exceptions import (
     AmbiguousRedirectException,
+    InvalidRedirectRegexException,
+    RedirectCycleException,
     RedirectShadowsExistingRecordException,
     RedirectToSelfException,
 )
@@ -33,3 +35,21 @@ def test_RedirectToSelfException_message(pad: Pad) -> None:
     expected = r"./foo. => <Page .*\bpath=./.*>: redirect to self\Z"
     exc = RedirectToSelfException("/foo", pad.root)
     assert re.match(expected, exc.message())
+
+
+def test_RedirectCycleException_message(pad: Pad) -> None:
+    expected = (
+        r"./foo/. => <Page .*\bpath=./.*>: "
+        r"redirect leads to a cycle: ./a/. => ./b/. => ./a/.\Z"
+    )
+    exc = RedirectCycleException("/foo/", pad.root, ["/a/", "/b/"])
+    assert re.match(expected, exc.message())
+
+
+def test_InvalidRedirectRegexException_message(pad: Pad) -> None:
+    expected = (
+        r"'~\^/\(' => <Page .*\bpath=./.*>: "
+        r"invalid regular expression: missing \)\Z"
+    )
+    exc = InvalidRedirectRegexException("~^/(", pad.root, "missing )")
+    assert re.match(expected, exc.message())
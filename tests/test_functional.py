@@ -1,14 +1,32 @@
 from __future__ import annotations
 
+import gzip
 import os
+import stat
 from pathlib import Path
 
 import pytest
 from lektor.builder import Builder
+from lektor.pluginsystem import get_plugin
 from lektor.project import Project
 from lektor.reporter import CliReporter
 
 from lektor_redirect import RedirectPlugin
+from lektor_redirect.pagestore import STORE_DIR
+from lektor_redirect.sources import (
+    Redirect,
+    RedirectMap,
+    RedirectMapHashSizes,
+    RedirectMapShard,
+)
+
+from .conftest import (
+    BuildSiteFixture,
+    OpenConfigFileFixture,
+    OpenContentsLrFixture,
+    SetRedirectFromFixture,
+    spy_on,
+)
 
 
 @pytest.fixture(scope="module")
@@ -28,6 +46,11 @@ def demo_output(site_dir_src: str, tmp_path_factory: pytest.TempPathFactory) ->
     return output_path
 
 
+@pytest.fixture
+def output_path(tmp_path: Path) -> Path:
+    return tmp_path / "output"
+
+
 def test_output_files(demo_output: Path) -> None:
     # Look for the redirect pages generated by our redirect.html template
     redirectors = {
@@ -51,3 +74,307 @@ def test_redirect_map(demo_output: Path) -> None:
         "/details/ /about/more-detail/;\n"
         "/images/apple-cake.jpg /images/apple-pie.jpg;\n"
     )
+
+
+def test_build_walks_site_once(build_site: BuildSiteFixture) -> None:
+    build_site()
+    plugin = get_plugin(RedirectPlugin, build_site.env)
+    assert plugin.full_walks == 1
+    assert ("generic", {"message": "Redirect index: 1 full walk(s) of the site"}) in (
+        build_site.reports
+    )
+
+
+def test_map_rebuilt_only_when_changed(
+    tmp_site_dir: Path,
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    set_redirect_from: SetRedirectFromFixture,
+) -> None:
+    def build() -> int:
+        """Build the site, returning the number of times the map was built."""
+        return build_site(count=(RedirectMap.BuildProgram, "build_artifact"))
+
+    assert build() == 1
+    assert build() == 0
+
+    # A new asset shadows one of the redirects
+    asset = tmp_site_dir / "assets/about/projects.html"
+    asset.parent.mkdir()
+    asset.write_text("<p>Projects</p>")
+    assert build() == 1
+    assert "/about/projects.html" not in (output_path / ".redirect.map").read_text()
+
+    set_redirect_from("/projects", ["/old-projects"])
+    assert build() == 1
+    assert "/old-projects/ /projects/;" in (output_path / ".redirect.map").read_text()
+
+
+def test_redirect_pages_for_imported_redirects(
+    tmp_site_dir: Path,
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+) -> None:
+    (tmp_site_dir / "redirects.csv").write_text("/legacy/one/,/projects\n")
+    with open_config_file() as inifile:
+        inifile["redirect.redirects_file"] = "redirects.csv"
+
+    build_site()
+    assert "/projects/" in (output_path / "legacy/one/index.html").read_text()
+    assert "/legacy/one/ /projects/;" in (output_path / ".redirect.map").read_text()
+
+
+def test_redirect_pages_rebuilt_only_when_target_url_changes(
+    tmp_site_dir: Path,
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_contents_lr: OpenContentsLrFixture,
+) -> None:
+    def build() -> int:
+        """Build the site, returning the number of redirect pages built."""
+        return build_site(count=(Redirect.BuildProgram, "build_artifact"))
+
+    assert build() == 4
+    assert build() == 0
+    with open_contents_lr("/about/more-detail") as data:
+        data["body"] = "Edited"
+    assert build() == 0
+    with open_contents_lr("/about/more-detail") as data:
+        data["_slug"] = "moved"
+    assert build() == 2
+    assert "/about/moved/" in (output_path / "details/index.html").read_text()
+    template = tmp_site_dir / "templates/redirect.html"
+    template.write_text(template.read_text() + "<!-- edited -->\n")
+    assert build() == 4
+
+
+def test_gzip_sidecars(
+    tmp_site_dir: Path,
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+    set_redirect_from: SetRedirectFromFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.gzip_sidecars"] = "true"
+
+    def build() -> int:
+        """Build the site, returning the number of redirect pages compressed."""
+        return build_site(count=(RedirectPlugin, "compress_redirect_page"))
+
+    def assert_sidecars_match() -> None:
+        for name in ("details/index.html", "about/projects.html", ".redirect.map"):
+            sidecar = output_path / f"{name}.gz"
+            content = (output_path / name).read_bytes()
+            assert gzip.decompress(sidecar.read_bytes()) == content
+
+    assert build() == 4
+    assert_sidecars_match()
+    assert build() == 0
+
+    # Redirect pages are rebuilt, but their content does not change
+    template = tmp_site_dir / "templates/redirect.html"
+    template.write_text(template.read_text() + "{# no output #}")
+    assert build() == 0
+
+    set_redirect_from("/projects", ["/old-projects"])
+    assert build() == 1
+    assert_sidecars_match()
+    map_gz = (output_path / ".redirect.map.gz").read_bytes()
+    assert b"/old-projects/ /projects/;" in gzip.decompress(map_gz)
+
+
+def test_hardlink_pages(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+    open_contents_lr: OpenContentsLrFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.template"] = ":builtin:"
+        inifile["redirect.hardlink_pages"] = "true"
+
+    build_site()
+    details = output_path / "details/index.html"
+    info = output_path / "about/info/index.html"
+    assert b"/about/more-detail/" in details.read_bytes()
+    assert os.path.samefile(details, info)
+    # The pages get the mode Lektor 3.3 gives its artifacts (the 3.4 betas
+    # leave artifacts with mkstemp's 0600), not that of a private temp file
+    assert stat.S_IMODE(details.stat().st_mode) == 0o644
+    store_dir = output_path / STORE_DIR
+    assert len(os.listdir(store_dir)) == 3
+
+    with open_contents_lr("/about/more-detail") as data:
+        data["_slug"] = "moved"
+    build_site()
+    assert b"/about/moved/" in details.read_bytes()
+    assert os.path.samefile(details, info)
+    # The page for the old URL has been swept from the store
+    assert len(os.listdir(store_dir)) == 3
+
+
+def test_apache_txt_redirect_map(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.map_format"] = "txt"
+    build_site()
+    assert (output_path / ".redirect.map").read_text() == (
+        "/about/info/ /about/more-detail/\n"
+        "/about/projects.html /projects/\n"
+        "/details/ /about/more-detail/\n"
+        "/images/apple-cake.jpg /images/apple-pie.jpg\n"
+    )
+
+
+def test_multiple_redirect_maps(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.map.edge.file"] = "edge/haproxy.map"
+        inifile["redirect.map.edge.format"] = "haproxy"
+    assert build_site(count=(RedirectPlugin, "_sort_redirect_map")) == 1
+    assert get_plugin(RedirectPlugin, build_site.env).full_walks == 1
+    assert (output_path / ".redirect.map").read_text().splitlines() == [
+        "/about/info/ /about/more-detail/;",
+        "/about/projects.html /projects/;",
+        "/details/ /about/more-detail/;",
+        "/images/apple-cake.jpg /images/apple-pie.jpg;",
+    ]
+    assert (output_path / "edge/haproxy.map").read_text().splitlines() == [
+        "/about/info/ /about/more-detail/",
+        "/about/projects.html /projects/",
+        "/details/ /about/more-detail/",
+        "/images/apple-cake.jpg /images/apple-pie.jpg",
+    ]
+
+
+def test_sharded_redirect_map(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+    set_redirect_from: SetRedirectFromFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.map_shard_by"] = "segment"
+
+    def build() -> set[str]:
+        """Build the site, returning the URL paths of the rebuilt map files."""
+        with spy_on(RedirectMap.BuildProgram, "build_artifact") as build_index, spy_on(
+            RedirectMapShard.BuildProgram, "build_artifact"
+        ) as build_shard:
+            build_site()
+        return {
+            call.args[0].source.url_path
+            for call in build_index.call_args_list + build_shard.call_args_list
+        }
+
+    assert build() == {
+        "/.redirect.map",
+        "/.redirect.map.d/about.map",
+        "/.redirect.map.d/details.map",
+        "/.redirect.map.d/images.map",
+    }
+    assert (output_path / ".redirect.map").read_text() == (
+        "include .redirect.map.d/about.map;\n"
+        "include .redirect.map.d/details.map;\n"
+        "include .redirect.map.d/images.map;\n"
+    )
+    assert (output_path / ".redirect.map.d/about.map").read_text() == (
+        "/about/info/ /about/more-detail/;\n/about/projects.html /projects/;\n"
+    )
+    assert build() == set()
+
+    set_redirect_from("/projects", ["/about/old-projects"])
+    assert build() == {"/.redirect.map.d/about.map"}
+    assert "/about/old-projects/ /projects/;" in (
+        (output_path / ".redirect.map.d/about.map").read_text()
+    )
+
+    set_redirect_from("/projects", ["/old-projects"])
+    assert build() == {
+        "/.redirect.map",
+        "/.redirect.map.d/about.map",
+        "/.redirect.map.d/old-projects.map",
+    }
+
+
+def test_nginx_hash_sizes_file(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+    set_redirect_from: SetRedirectFromFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.map_hash_sizes_file"] = "map-hash.conf"
+
+    def build() -> int:
+        """Build the site, returning the number of times the snippet was built."""
+        count = build_site(count=(RedirectMapHashSizes.BuildProgram, "build_artifact"))
+        if count:
+            messages = [data.get("message", "") for _, data in build_site.reports]
+            assert any(m.startswith("nginx redirect map hash: ") for m in messages)
+        return count
+
+    assert build() == 1
+    assert (output_path / "map-hash.conf").read_text() == (
+        "# 4 keys, the longest of length 22\n"
+        "map_hash_bucket_size 256;\n"
+        "map_hash_max_size 2048;\n"
+    )
+    assert build() == 0
+    # Changing a redirect does not change the sizes
+    set_redirect_from("/projects", ["/old-projects"])
+    assert build() == 0
+    set_redirect_from("/projects", ["/old-projects", "/other-projects"])
+    assert build() == 1
+    assert "# 5 keys" in (output_path / "map-hash.conf").read_text()
+
+
+@pytest.mark.parametrize("shard_by", ["segment", "hash"])
+def test_sharded_redirect_map_with_bulk_shadow_check(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+    shard_by: str,
+) -> None:
+    # Building the redirect index in bulk mode must not require the shards,
+    # which themselves depend on the index
+    with open_config_file() as inifile:
+        inifile["redirect.bulk_shadow_check"] = "true"
+        inifile["redirect.map_shard_by"] = shard_by
+
+    build_site()
+    shards = output_path / ".redirect.map.d"
+    entries = "".join(shard.read_text() for shard in shards.iterdir())
+    assert "/about/projects.html /projects/;\n" in entries
+    assert "/about/info/ /about/more-detail/;\n" in entries
+
+
+def test_sharded_redirect_map_keeps_patterns_together(
+    output_path: Path,
+    build_site: BuildSiteFixture,
+    open_config_file: OpenConfigFileFixture,
+    set_redirect_from: SetRedirectFromFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.map_shard_by"] = "hash"
+        inifile["redirect.map_shards"] = "4"
+    set_redirect_from("/projects", ["/old/*", "/old/about/more/*", "~^/p/"])
+
+    build_site()
+    index = (output_path / ".redirect.map").read_text().splitlines()
+    assert index[0] == "include .redirect.map.d/@patterns.map;"
+    assert len(index) == 5
+    patterns = (output_path / ".redirect.map.d/@patterns.map").read_text()
+    assert [line.split()[0] for line in patterns.splitlines()] == [
+        "~^/old/about/more/(.*)$",
+        "~^/old/(.*)$",
+        "~^/p/",
+    ]
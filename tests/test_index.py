@@ -0,0 +1,552 @@
+from __future__ import annotations
+
+import os
+import shutil
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from lektor.db import Pad
+from lektor.environment import Environment
+
+from lektor_redirect import RedirectPlugin
+from lektor_redirect.exceptions import (
+    RedirectCycleException,
+    RedirectShadowsExistingRecordException,
+)
+from lektor_redirect.index import (
+    AMBIGUOUS,
+    CYCLE,
+    INVALID_REGEX,
+    LiveIndex,
+    OK,
+    RedirectIndex,
+    SELF,
+    SHADOWS_RECORD,
+    Verdict,
+)
+from lektor_redirect.sources import Redirect
+from lektor_redirect.util import collect_artifact_url_paths, RecordInfo, source_key
+
+from .conftest import (
+    OpenConfigFileFixture,
+    OpenContentsLrFixture,
+    ReporterCaptureFixture,
+    SetRedirectFromFixture,
+)
+
+pytestmark = pytest.mark.usefixtures("plugin")
+
+
+def test_bind(env: Environment) -> None:
+    index = RedirectIndex(env.new_pad())
+    pad = env.new_pad()
+    bound = index.bind(pad)
+    assert bound.pad is pad
+    assert dict(bound) == {url: pad.get(rec.path) for url, rec in index.items()}
+
+
+def test_updated(env: Environment) -> None:
+    pad = env.new_pad()
+    index = RedirectIndex(pad)
+    more_detail = RecordInfo(
+        "/about/more-detail", "/about/more-detail/", ("/about/info/", "/details/")
+    )
+    updated = index.updated(
+        [more_detail], [more_detail._replace(redirect_urls=("/more/",))]
+    )
+    assert set(updated) == {"/about/projects.html", "/images/apple-cake.jpg", "/more/"}
+    assert updated["/more/"] == pad.get("/about/more-detail")
+    # The original is unchanged
+    assert set(index) == {
+        "/about/info/",
+        "/about/projects.html",
+        "/details/",
+        "/images/apple-cake.jpg",
+    }
+
+
+@pytest.mark.parametrize(
+    "url_path, target_path, verdict",
+    [
+        ("/details/", "/about/more-detail", Verdict(OK)),
+        ("/projects/", "/projects", Verdict(SELF, "/projects")),
+        ("/projects/", "/about", Verdict(SHADOWS_RECORD, "/projects")),
+        (
+            "/.redirect.map",
+            "/about",
+            Verdict(SHADOWS_RECORD, "/@redirect-map/.redirect.map"),
+        ),
+        (
+            "/static/style.css",
+            "/about",
+            Verdict(SHADOWS_RECORD, "/static/style.css"),
+        ),
+        ("/about/projects.html", "/about", Verdict(AMBIGUOUS, "/projects")),
+    ],
+)
+@pytest.mark.parametrize("bulk", [False, True])
+def test_get_verdict(
+    pad: Pad, url_path: str, target_path: str, verdict: Verdict, bulk: bool
+) -> None:
+    artifact_url_paths = None
+    if bulk:
+        artifact_url_paths = collect_artifact_url_paths(pad, [Redirect._generator])
+    index = RedirectIndex(pad, artifact_url_paths=artifact_url_paths)
+    assert index.get_verdict(url_path, pad.get(target_path)) == verdict
+
+
+def test_iter_valid_redirects(
+    pad: Pad,
+    set_redirect_from: SetRedirectFromFixture,
+    captured_reports: ReporterCaptureFixture,
+) -> None:
+    set_redirect_from("/about", ["/details"])
+    index = RedirectIndex(pad)
+    with mock.patch.object(pad, "get", wraps=pad.get) as pad_get:
+        redirects = sorted(index.iter_valid_redirects())
+    assert redirects == [
+        ("/about/info/", "/about/more-detail/"),
+        ("/about/projects.html", "/projects/"),
+        ("/images/apple-cake.jpg", "/images/apple-pie.jpg"),
+    ]
+    # Records are loaded only to report the conflict
+    loaded = {call.args[0] for call in pad_get.call_args_list}
+    assert loaded == {"/about", "/about/more-detail"}
+    assert captured_reports.message_matches(r"Invalid redirect\b.*'/details/'")
+
+
+def test_get_redirect_urls(pad: Pad, set_redirect_from: SetRedirectFromFixture) -> None:
+    set_redirect_from("/projects", ["/about/", "/old-projects", "/old/*", "~^/p/"])
+    index = RedirectIndex(pad)
+    assert index.get_redirect_urls("/about/more-detail") == (
+        "/about/info/",
+        "/details/",
+    )
+    # Conflicting, prefix and regex redirects are omitted
+    assert index.get_redirect_urls("/projects") == ("/old-projects/",)
+    assert index.get_redirect_urls("/images") == ()
+
+
+def test_get_redirect_urls_updated(pad: Pad) -> None:
+    index = RedirectIndex(pad)
+    updated = index.updated(
+        [RecordInfo("/projects", "/projects/", ("/about/projects.html",))],
+        [RecordInfo("/projects", "/projects/", ("/old/",))],
+    )
+    assert updated.get_redirect_urls("/projects") == ("/old/",)
+    assert index.get_redirect_urls("/projects") == ("/about/projects.html",)
+
+
+def test_collapse_chains(pad: Pad, set_redirect_from: SetRedirectFromFixture) -> None:
+    set_redirect_from("/projects", ["/about/projects.html", "/about/more-detail/"])
+    index = RedirectIndex(pad, collapse_chains=True)
+    assert sorted(index.iter_valid_redirects(warn_on_conflict=False)) == [
+        ("/about/info/", "/projects/"),
+        ("/about/projects.html", "/projects/"),
+        ("/details/", "/projects/"),
+        ("/images/apple-cake.jpg", "/images/apple-pie.jpg"),
+    ]
+    assert index.get_final_target("/details/") == pad.get("/projects")
+    assert index.get_final_target("/about/projects.html") == pad.get("/projects")
+    # The redirect from the URL of an existing record is still a conflict
+    verdict = index.get_verdict("/about/more-detail/", pad.get("/projects"))
+    assert verdict.status == SHADOWS_RECORD
+
+
+def test_collapse_chains_disabled(
+    pad: Pad, set_redirect_from: SetRedirectFromFixture
+) -> None:
+    set_redirect_from("/projects", ["/about/more-detail/"])
+    index = RedirectIndex(pad)
+    assert ("/details/", "/about/more-detail/") in set(
+        index.iter_valid_redirects(warn_on_conflict=False)
+    )
+    assert index.get_final_target("/details/") == pad.get("/about/more-detail")
+
+
+def test_collapse_chains_cycle(
+    pad: Pad,
+    set_redirect_from: SetRedirectFromFixture,
+    captured_reports: ReporterCaptureFixture,
+) -> None:
+    set_redirect_from("/projects", ["/about/more-detail/"])
+    set_redirect_from("/about/more-detail", ["/details", "/projects/"])
+    index = RedirectIndex(pad, collapse_chains=True)
+    more_detail = pad.get("/about/more-detail")
+    assert index.get_verdict("/details/", more_detail) == Verdict(CYCLE)
+    assert sorted(index.iter_valid_redirects()) == [
+        ("/images/apple-cake.jpg", "/images/apple-pie.jpg"),
+    ]
+    assert captured_reports.message_matches(r"Invalid redirect\b.*\bcycle\b")
+    with pytest.raises(RedirectCycleException) as exc_info:
+        index.get_final_target("/details/")
+    assert set(exc_info.value.cycle) == {"/about/more-detail/", "/projects/"}
+
+
+def test_prefix_redirects(pad: Pad, set_redirect_from: SetRedirectFromFixture) -> None:
+    set_redirect_from("/about", ["/old-about/*"])
+    set_redirect_from("/about/more-detail", ["/old-about/detail/*"])
+    index = RedirectIndex(pad)
+    assert ("/old-about/*", "/about/") in set(index.iter_valid_redirects())
+    more_detail = pad.get("/about/more-detail")
+    assert index.get_prefix_target("/old-about/") == pad.get("/about")
+    assert index.get_prefix_target("/old-about/more-detail/") == more_detail
+    assert index.get_prefix_target("/old-about/detail/") == more_detail
+    assert index.get_prefix_target("/old-about/missing/") is None
+    assert index.get_prefix_target("/elsewhere/") is None
+
+    updated = index.updated(
+        [RecordInfo("/about", "/about/", ("/old-about/*",))],
+        [RecordInfo("/about", "/about/", ())],
+    )
+    assert updated.get_prefix_target("/old-about/more-detail/") is None
+    assert updated.get_prefix_target("/old-about/detail/") == more_detail
+
+
+@pytest.mark.parametrize(
+    "url_path, target_path, verdict",
+    [
+        ("/old/*", "/about", Verdict(OK)),
+        ("/about/*", "/about", Verdict(SELF, "/about")),
+        ("/*", "/about", Verdict(SHADOWS_RECORD, "/about")),
+        ("/projects/*", "/about", Verdict(SHADOWS_RECORD, "/projects")),
+    ],
+)
+def test_get_verdict_prefix(
+    pad: Pad, url_path: str, target_path: str, verdict: Verdict
+) -> None:
+    index = RedirectIndex(pad)
+    assert index.get_verdict(url_path, pad.get(target_path)) == verdict
+
+
+def test_regex_redirects(
+    pad: Pad,
+    set_redirect_from: SetRedirectFromFixture,
+    captured_reports: ReporterCaptureFixture,
+) -> None:
+    set_redirect_from("/about", [r"~^/node/1\d*/$", "~^/bad(/"])
+    set_redirect_from("/projects", [r"~^/node/\d+/$"])
+    index = RedirectIndex(pad)
+    about = pad.get("/about")
+    assert index.get_regex_target("/node/12/") == about
+    assert index.get_regex_target("/node/42/") == pad.get("/projects")
+    assert index.get_regex_target("/node/x/") is None
+    assert index.get_verdict("~^/bad(/", about).status == INVALID_REGEX
+    assert index.get_verdict("~^/about/$", about) == Verdict(SHADOWS_RECORD, "/about")
+    assert set(index.iter_valid_redirects()) >= {
+        (r"~^/node/1\d*/$", "/about/"),
+        (r"~^/node/\d+/$", "/projects/"),
+    }
+    assert captured_reports.message_matches(r"Invalid redirect\b.*regular expression")
+
+
+def test_imported_redirects(pad: Pad, captured_reports: ReporterCaptureFixture) -> None:
+    imported = {"/about": ("/old-about/",), "/missing": ("/gone/",)}
+    index = RedirectIndex(pad, imported_redirects=imported)
+    assert index["/old-about/"] == pad.get("/about")
+    assert "/gone/" not in index
+    assert captured_reports.message_matches(r"Ignoring .* missing record '/missing'")
+    assert index.fingerprint != RedirectIndex(pad).fingerprint
+
+    info = RecordInfo("/about", "/about/", ())
+    updated = index.updated([info], [info], {"/about": ("/older-about/",)})
+    assert set(updated) - set(index) == {"/older-about/"}
+    assert set(index) - set(updated) == {"/old-about/"}
+
+
+def test_fingerprint(env: Environment) -> None:
+    index = RedirectIndex(env.new_pad())
+    assert RedirectIndex(env.new_pad()).fingerprint == index.fingerprint
+    info = RecordInfo("/new", "/new/", ("/old/",))
+    updated = index.updated([], [info])
+    assert updated.fingerprint != index.fingerprint
+    assert updated.updated([info], []).fingerprint == index.fingerprint
+
+
+def test_fingerprint_covers_shadowing_assets(
+    env: Environment, tmp_site_dir: Path
+) -> None:
+    index = RedirectIndex(env.new_pad())
+    asset = tmp_site_dir / "assets/about/projects.html"
+    asset.parent.mkdir()
+    asset.write_text("<p>Projects</p>")
+    assert RedirectIndex(env.new_pad()).fingerprint != index.fingerprint
+
+
+def test_bulk_shadow_check_catches_other_generators(pad: Pad) -> None:
+    index = RedirectIndex(pad, artifact_url_paths={"/feed.xml": "/@feed"})
+    about = pad.get("/about")
+    assert index.get_verdict("/feed.xml", about) == Verdict(SHADOWS_RECORD, "/@feed")
+    assert index.get_verdict("/other.xml", about) == Verdict(OK)
+
+
+def test_raise_on_conflict_with_asset(
+    pad: Pad,
+) -> None:
+    index = RedirectIndex(pad)
+    with pytest.raises(RedirectShadowsExistingRecordException) as exc_info:
+        index.raise_on_conflict("/static/style.css", pad.get("/about"))
+    conflict = exc_info.value.conflict
+    assert source_key(conflict) == source_key(pad.get_asset("/static/style.css"))
+
+
+def test_verdicts_are_precomputed(
+    env: Environment, set_redirect_from: SetRedirectFromFixture
+) -> None:
+    set_redirect_from("/about", ["/projects", "/details", "/.redirect.map"])
+    pad = env.new_pad()
+    index = RedirectIndex(pad)
+    about = pad.get("/about")
+    with mock.patch.object(pad, "resolve_url_path") as resolve_url_path:
+        assert index.is_conflict("/projects/", about)
+        assert index.is_conflict("/details/", about)
+        assert index.is_conflict("/.redirect.map", about)
+    assert resolve_url_path.call_count == 0
+
+
+def test_redirect_from_shard_url(
+    env: Environment,
+    open_config_file: OpenConfigFileFixture,
+    set_redirect_from: SetRedirectFromFixture,
+) -> None:
+    with open_config_file() as inifile:
+        inifile["redirect.map_shard_by"] = "segment"
+    set_redirect_from("/about", ["/.redirect.map.d/about.map"])
+    pad = env.new_pad()
+    index = RedirectIndex(pad)
+    verdict = index.get_verdict("/.redirect.map.d/about.map", pad.get("/about"))
+    assert verdict.status == SHADOWS_RECORD
+
+
+def test_is_conflict_warns_once(
+    pad: Pad, captured_reports: ReporterCaptureFixture
+) -> None:
+    index = RedirectIndex(pad)
+    more_detail = pad.get("/about/more-detail")
+    assert index.is_conflict("/about/projects.html", more_detail)
+    assert index.is_conflict("/about/projects.html", more_detail)
+    assert len(captured_reports.get_generic_messages()) == 1
+    # Bound copies have their own record of issued warnings
+    assert index.bind(pad).is_conflict("/about/projects.html", more_detail)
+    assert len(captured_reports.get_generic_messages()) == 2
+
+
+class TestLiveIndex:
+    @pytest.fixture
+    def live_index(self, plugin: RedirectPlugin) -> LiveIndex:
+        return LiveIndex(plugin)
+
+    def get_redirects(self, live_index: LiveIndex, env: Environment) -> dict[str, str]:
+        index = live_index.get_index(env.new_pad())
+        return {url_path: record.path for url_path, record in index.items()}
+
+    def get_valid_redirects(self, live_index: LiveIndex, env: Environment) -> set[str]:
+        index = live_index.get_index(env.new_pad())
+        return {url_path for url_path, _ in index.iter_valid_redirects(False)}
+
+    def test_get_index_is_bound_to_pad(
+        self, live_index: LiveIndex, env: Environment
+    ) -> None:
+        pad = env.new_pad()
+        assert live_index.get_index(pad).pad is pad
+
+    def test_full_walk_only_once(
+        self, live_index: LiveIndex, plugin: RedirectPlugin, env: Environment
+    ) -> None:
+        with mock.patch.object(
+            plugin, "make_scanner", wraps=plugin.make_scanner
+        ) as make_scanner:
+            live_index.get_index(env.new_pad())
+            live_index.get_index(env.new_pad())
+        assert make_scanner.call_count == 1
+
+    def test_patch_changed_record(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        set_redirect_from: SetRedirectFromFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        self.get_redirects(live_index, env)
+        set_redirect_from("/about", ["/old-about"])
+        live_index.invalidate([tmp_site_dir / "content/about/contents.lr"])
+        pad = env.new_pad()
+        with mock.patch.object(pad, "get", wraps=pad.get) as pad_get:
+            index = live_index.get_index(pad)
+        loaded = {call.args[0] for call in pad_get.mock_calls}
+        assert "/about" in loaded
+        assert not loaded & {"/about/more-detail", "/images/apple-pie.jpg"}
+        assert index["/old-about/"] == pad.get("/about")
+        assert len(index) == 5
+
+    def test_reimport_redirects_file(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        open_config_file: OpenConfigFileFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        redirects_file = tmp_site_dir / "redirects.tsv"
+        redirects_file.write_text("/old-about/\t/about\n")
+        with open_config_file() as inifile:
+            inifile["redirect.redirects_file"] = "redirects.tsv"
+        assert self.get_redirects(live_index, env)["/old-about/"] == "/about"
+
+        redirects_file.write_text("/old-projects/\t/projects\n")
+        os.utime(redirects_file, ns=(0, 0))
+        with mock.patch.object(
+            live_index.plugin, "make_scanner", wraps=live_index.plugin.make_scanner
+        ) as make_scanner:
+            redirects = self.get_redirects(live_index, env)
+        assert make_scanner.call_count == 0
+        assert "/old-about/" not in redirects
+        assert redirects["/old-projects/"] == "/projects"
+
+    def test_patch_attachment_metadata(
+        self, live_index: LiveIndex, env: Environment, tmp_site_dir: Path
+    ) -> None:
+        self.get_redirects(live_index, env)
+        metadata = tmp_site_dir / "content/images/apple-pie.jpg.lr"
+        metadata.write_text("redirect_from: apple-tart.jpg\n")
+        live_index.invalidate([metadata])
+        redirects = self.get_redirects(live_index, env)
+        assert redirects["/images/apple-tart.jpg"] == "/images/apple-pie.jpg"
+        assert "/images/apple-cake.jpg" not in redirects
+
+    def test_patch_new_and_deleted_records(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        tmp_site_dir: Path,
+    ) -> None:
+        self.get_redirects(live_index, env)
+        content = tmp_site_dir / "content"
+        new_page = content / "projects/new"
+        new_page.mkdir()
+        (new_page / "contents.lr").write_text("redirect_from: /new\n")
+        shutil.rmtree(content / "about")
+        live_index.invalidate(
+            [new_page / "contents.lr", content / "about/contents.lr", content / "about"]
+        )
+        assert self.get_redirects(live_index, env) == {
+            "/about/projects.html": "/projects",
+            "/images/apple-cake.jpg": "/images/apple-pie.jpg",
+            "/new/": "/projects/new",
+        }
+        # The incrementally maintained fingerprint matches that of a fresh index
+        fresh_index = LiveIndex(live_index.plugin).get_index(env.new_pad())
+        assert live_index.get_index(env.new_pad()).fingerprint == (
+            fresh_index.fingerprint
+        )
+
+    def test_patch_moved_record_rescans_children(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        open_contents_lr: OpenContentsLrFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        self.get_redirects(live_index, env)
+        with open_contents_lr("/about") as data:
+            data["_slug"] = "about-us"
+        live_index.invalidate([tmp_site_dir / "content/about/contents.lr"])
+        redirects = self.get_redirects(live_index, env)
+        assert redirects["/about-us/info/"] == "/about/more-detail"
+        assert "/about/info/" not in redirects
+
+    def test_patch_hidden_record(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        open_contents_lr: OpenContentsLrFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        self.get_redirects(live_index, env)
+        with open_contents_lr("/about") as data:
+            data["_hidden"] = "yes"
+        live_index.invalidate([tmp_site_dir / "content/about/contents.lr"])
+        assert set(self.get_redirects(live_index, env)) == {
+            "/about/projects.html",
+            "/images/apple-cake.jpg",
+        }
+
+        with open_contents_lr("/about") as data:
+            data["_hidden"] = "no"
+        live_index.invalidate([tmp_site_dir / "content/about/contents.lr"])
+        assert len(self.get_redirects(live_index, env)) == 4
+
+    def test_config_change_forces_full_walk(
+        self,
+        live_index: LiveIndex,
+        plugin: RedirectPlugin,
+        env: Environment,
+        open_config_file: OpenConfigFileFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        self.get_redirects(live_index, env)
+        with open_config_file() as inifile:
+            inifile["redirect.redirect_from_field"] = "other"
+        with mock.patch.object(
+            plugin, "make_scanner", wraps=plugin.make_scanner
+        ) as make_scanner:
+            live_index.invalidate([tmp_site_dir / "templates/redirect.html"])
+            self.get_redirects(live_index, env)
+            assert make_scanner.call_count == 0
+            live_index.invalidate([tmp_site_dir / "configs/redirect.ini"])
+            assert self.get_redirects(live_index, env) == {}
+            assert make_scanner.call_count == 1
+
+    def test_poll(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        set_redirect_from: SetRedirectFromFixture,
+    ) -> None:
+        self.get_redirects(live_index, env)
+        live_index.poll()
+        assert not live_index._dirty
+        set_redirect_from("/about", ["/old-about"])
+        live_index.poll()
+        assert live_index._dirty == {"/about"}
+        assert self.get_redirects(live_index, env)["/old-about/"] == "/about"
+
+    @pytest.mark.parametrize("bulk_shadow_check", [False, True])
+    def test_asset_shadowing_redirect(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        open_config_file: OpenConfigFileFixture,
+        tmp_site_dir: Path,
+        bulk_shadow_check: bool,
+    ) -> None:
+        if bulk_shadow_check:
+            with open_config_file() as inifile:
+                inifile["redirect.bulk_shadow_check"] = "true"
+        assert "/about/projects.html" in self.get_valid_redirects(live_index, env)
+        asset = tmp_site_dir / "assets/about/projects.html"
+        asset.parent.mkdir()
+        asset.write_text("shadow")
+        live_index.poll()
+        with mock.patch.object(
+            live_index.plugin, "make_scanner", wraps=live_index.plugin.make_scanner
+        ) as make_scanner:
+            redirects = self.get_valid_redirects(live_index, env)
+        assert make_scanner.call_count == 0
+        assert "/about/projects.html" not in redirects
+
+    def test_bulk_shadow_check_sees_new_records(
+        self,
+        live_index: LiveIndex,
+        env: Environment,
+        open_config_file: OpenConfigFileFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.bulk_shadow_check"] = "true"
+        assert "/about/projects.html" in self.get_valid_redirects(live_index, env)
+        new_page = tmp_site_dir / "content/about/projects.html"
+        new_page.mkdir()
+        (new_page / "contents.lr").write_text("_slug: projects.html\n")
+        live_index.invalidate([new_page / "contents.lr"])
+        assert "/about/projects.html" not in self.get_valid_redirects(live_index, env)
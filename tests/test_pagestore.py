@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from lektor_redirect.pagestore import PageStore, STORE_DIR
+
+
+def test_store(tmp_path: Path) -> None:
+    store = PageStore(tmp_path)
+    filename = store.store(b"page")
+    assert os.path.dirname(filename) == os.fspath(tmp_path / STORE_DIR)
+    assert Path(filename).read_bytes() == b"page"
+    assert store.store(b"page") == filename
+    assert store.store(b"other") != filename
+
+
+def test_link(tmp_path: Path) -> None:
+    store = PageStore(tmp_path)
+    for name in ("a/index.html", "b/index.html"):
+        dst_filename = os.fspath(tmp_path / name)
+        os.replace(store.link(b"page", dst_filename), dst_filename)
+    a = tmp_path / "a/index.html"
+    b = tmp_path / "b/index.html"
+    assert a.read_bytes() == b"page"
+    assert os.path.samefile(a, b)
+    assert a.stat().st_nlink == 3
+
+
+def test_sweep(tmp_path: Path) -> None:
+    store = PageStore(tmp_path)
+    assert store.sweep() == 0
+    dst_filename = os.fspath(tmp_path / "index.html")
+    os.replace(store.link(b"linked", dst_filename), dst_filename)
+    store.store(b"unlinked")
+    assert store.sweep() == 1
+    assert len(os.listdir(tmp_path / STORE_DIR)) == 1
+    os.unlink(dst_filename)
+    assert store.sweep() == 1
+    assert os.listdir(tmp_path / STORE_DIR) == []
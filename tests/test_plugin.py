@@ -1,5 +1,12 @@
 from __future__ import annotations
 
+import gzip
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable
 from unittest import mock
 
 import pytest
@@ -11,13 +18,16 @@ from lektor_redirect.exceptions import (
     RedirectShadowsExistingRecordException,
     RedirectToSelfException,
 )
-from lektor_redirect.plugin import RedirectIndex, RedirectPlugin
+from lektor_redirect.index import RedirectIndex
+from lektor_redirect.plugin import MapConfig, RedirectPlugin
 from lektor_redirect.sources import Redirect, RedirectMap
+from lektor_redirect.util import RecordInfo, sorted_items
 
 from .conftest import (
     OpenConfigFileFixture,
     OpenSiteConfigFixture,
     ReporterCaptureFixture,
+    SetRedirectFromFixture,
 )
 
 
@@ -31,6 +41,40 @@ class TestRedirectPlugin:
         assert plugin.get_index(pad) is index
         assert plugin.get_index(plugin.env.new_pad()) is not index
 
+    def test_get_index_is_single_flight(self, plugin: RedirectPlugin, pad: Pad) -> None:
+        n_threads = 16
+        barrier = threading.Barrier(n_threads)
+        iter_record_infos = plugin.iter_record_infos
+
+        def slow_iter_record_infos(pad: Pad) -> Iterable[RecordInfo]:
+            time.sleep(0.1)  # give the other threads time to pile up
+            return iter_record_infos(pad)
+
+        def resolve() -> list[Redirect | None]:
+            barrier.wait()
+            return [
+                Redirect._resolve_url_path(pad.root, ["about", "info"])
+                for _ in range(50)
+            ]
+
+        with mock.patch.object(
+            plugin, "iter_record_infos", side_effect=slow_iter_record_infos
+        ), ThreadPoolExecutor(n_threads) as executor:
+            futures = [executor.submit(resolve) for _ in range(n_threads)]
+            results = [redirect for f in futures for redirect in f.result()]
+
+        assert plugin.full_walks == 1
+        assert set(results) == {Redirect(pad.get("/about/more-detail"), "/about/info/")}
+
+    def test_get_index_retries_after_failure(
+        self, plugin: RedirectPlugin, pad: Pad
+    ) -> None:
+        with mock.patch.object(
+            plugin, "iter_record_infos", side_effect=RuntimeError("boom")
+        ), pytest.raises(RuntimeError):
+            plugin.get_index(pad)
+        assert "/about/info/" in plugin.get_index(pad)
+
     def test_redirect_from_field(self, plugin: RedirectPlugin) -> None:
         assert plugin.redirect_from_field == "redirect_from"
 
@@ -55,6 +99,123 @@ class TestRedirectPlugin:
             inifile.pop("redirect.template", None)
         assert plugin.redirect_template is None
 
+    def test_persistent_index(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert not plugin.persistent_index
+        with open_config_file() as inifile:
+            inifile["redirect.persistent_index"] = "yes"
+        assert plugin.persistent_index
+
+    def test_bulk_shadow_check(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert not plugin.bulk_shadow_check
+        with open_config_file() as inifile:
+            inifile["redirect.bulk_shadow_check"] = "yes"
+        assert plugin.bulk_shadow_check
+
+    def test_get_index_with_bulk_shadow_check(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.bulk_shadow_check"] = "yes"
+        pad = plugin.env.new_pad()
+        index = plugin.get_index(pad)
+        about = pad.get("/about")
+        with mock.patch.object(pad, "resolve_url_path") as resolve_url_path:
+            assert index.is_conflict("/static/style.css", about, False)
+            assert not index.is_conflict("/elsewhere/", about, False)
+        assert resolve_url_path.call_count == 0
+
+    def test_render_once_per_target(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert not plugin.render_once_per_target
+        with open_config_file() as inifile:
+            inifile["redirect.render_once_per_target"] = "true"
+        assert plugin.render_once_per_target
+
+    def test_compress_redirect_page(self, plugin: RedirectPlugin, pad: Pad) -> None:
+        compressed = plugin.compress_redirect_page(pad, b"<p>moved</p>")
+        assert gzip.decompress(compressed) == b"<p>moved</p>"
+        # Identical content reuses the compressed payload
+        assert plugin.compress_redirect_page(pad, b"<p>moved</p>") is compressed
+
+    def test_collapse_chains(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert not plugin.collapse_chains
+        with open_config_file() as inifile:
+            inifile["redirect.collapse_chains"] = "yes"
+        assert plugin.collapse_chains
+        assert plugin.get_index(plugin.env.new_pad()).collapse_chains
+
+    def test_get_imported_redirects(
+        self,
+        plugin: RedirectPlugin,
+        open_config_file: OpenConfigFileFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        pad = plugin.env.new_pad()
+        assert plugin.get_imported_redirects(pad) == {}
+        redirects_file = tmp_site_dir / "redirects.csv"
+        redirects_file.write_text("/old-about/,/about\nold-info,/about/\n")
+        with open_config_file() as inifile:
+            inifile["redirect.redirects_file"] = "redirects.csv"
+        imported = plugin.get_imported_redirects(pad)
+        assert imported == {"/about": ("/old-about/", "/old-info/")}
+        assert plugin.get_imported_redirects(pad) is imported
+        assert plugin.get_index(pad)["/old-info/"] == pad.get("/about")
+
+        redirects_file.write_text("/old-about/,/projects\n")
+        os.utime(redirects_file, ns=(0, 0))
+        assert plugin.get_imported_redirects(pad) == {"/projects": ("/old-about/",)}
+
+    def test_map_memory_budget(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert plugin.map_memory_budget == 64 * 1024 * 1024
+        with open_config_file() as inifile:
+            inifile["redirect.map_memory_budget"] = "1"
+        assert plugin.map_memory_budget == 1024 * 1024
+
+    def test_map_format(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert plugin.map_format == "nginx"
+        with open_config_file() as inifile:
+            inifile["redirect.map_format"] = "txt"
+        assert plugin.map_format == "txt"
+
+    def test_raw_scan(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        assert not plugin.raw_scan
+        with open_config_file() as inifile:
+            inifile["redirect.raw_scan"] = "yes"
+        assert plugin.raw_scan
+
+    @pytest.mark.parametrize(
+        "value, workers",
+        [
+            (None, 1),
+            ("4", 4),
+            ("0", os.cpu_count()),
+        ],
+    )
+    def test_scan_workers(
+        self,
+        plugin: RedirectPlugin,
+        open_config_file: OpenConfigFileFixture,
+        value: str | None,
+        workers: int,
+    ) -> None:
+        if value is not None:
+            with open_config_file() as inifile:
+                inifile["redirect.scan_workers"] = value
+        assert plugin.scan_workers == workers
+
     @pytest.mark.parametrize(
         "map_file, map_url",
         [
@@ -76,10 +237,223 @@ class TestRedirectPlugin:
     def test_redirect_map_url_none(self, plugin: RedirectPlugin) -> None:
         assert plugin.redirect_map_url is None
 
+    def test_redirect_maps(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map_file"] = ".redirect.map"
+            inifile["redirect.map.edge.file"] = "edge/haproxy.map"
+            inifile["redirect.map.edge.format"] = "haproxy"
+            inifile["redirect.map.apache.file"] = "/apache.map"
+        assert plugin.redirect_maps == {
+            "/.redirect.map": MapConfig("", "/.redirect.map", "nginx"),
+            "/edge/haproxy.map": MapConfig("edge", "/edge/haproxy.map", "haproxy"),
+            "/apache.map": MapConfig("apache", "/apache.map", "nginx"),
+        }
+
+    def test_redirect_maps_sharded(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map_file"] = ".redirect.map"
+            inifile["redirect.map_shard_by"] = "hash"
+            inifile["redirect.map_include_prefix"] = "/srv/www/"
+            inifile["redirect.map.edge.file"] = "edge.map"
+            inifile["redirect.map.edge.shard_by"] = "segment"
+            inifile["redirect.map.hashed.file"] = "hashed.map"
+            inifile["redirect.map.hashed.shard_by"] = "hash"
+            inifile["redirect.map.hashed.shards"] = "4"
+        assert plugin.redirect_maps == {
+            "/.redirect.map": MapConfig(
+                "", "/.redirect.map", "nginx", "hash", 16, "/srv/www/"
+            ),
+            "/edge.map": MapConfig("edge", "/edge.map", "nginx", "segment"),
+            "/hashed.map": MapConfig("hashed", "/hashed.map", "nginx", "hash", 4),
+        }
+
+    @pytest.mark.parametrize(
+        "options, message",
+        [
+            ({"shard_by": "bogus"}, r"Unknown shard_by 'bogus'"),
+            ({"shard_by": "hash", "shards": "0"}, r"must be positive"),
+        ],
+    )
+    def test_redirect_maps_bad_sharding(
+        self,
+        plugin: RedirectPlugin,
+        open_config_file: OpenConfigFileFixture,
+        options: dict[str, str],
+        message: str,
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map.edge.file"] = "edge.map"
+            for key, value in options.items():
+                inifile[f"redirect.map.edge.{key}"] = value
+        with pytest.raises(RuntimeError, match=message):
+            _ = plugin.redirect_maps
+
+    def test_redirect_maps_hash_sizes_file(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map_file"] = ".redirect.map"
+            inifile["redirect.map_hash_sizes_file"] = "map-hash.conf"
+        map_config = plugin.redirect_maps["/.redirect.map"]
+        assert map_config.hash_sizes_url == "/map-hash.conf"
+
+    def test_redirect_maps_hash_sizes_file_requires_nginx(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map.edge.file"] = "edge.map"
+            inifile["redirect.map.edge.format"] = "txt"
+            inifile["redirect.map.edge.hash_sizes_file"] = "edge.conf"
+        with pytest.raises(RuntimeError, match=r"only supported for nginx"):
+            _ = plugin.redirect_maps
+
+    def test_get_nginx_hash_sizes(self, plugin: RedirectPlugin, pad: Pad) -> None:
+        sizes = plugin.get_nginx_hash_sizes(pad)
+        assert sizes.keys == 4
+        assert sizes.max_key_length == len("/images/apple-cake.jpg")
+        assert plugin.get_nginx_hash_sizes(pad) is sizes
+
+    def test_get_map_shards(self, plugin: RedirectPlugin, pad: Pad) -> None:
+        map_config = MapConfig("", "/.redirect.map", "nginx", "segment")
+        shards = plugin.get_map_shards(pad, map_config)
+        assert set(shards) == {"about", "details", "images"}
+        assert plugin.get_map_shards(pad, map_config) is shards
+
+    def test_iter_map_shard(self, plugin: RedirectPlugin, pad: Pad) -> None:
+        map_config = MapConfig("", "/.redirect.map", "nginx", "segment")
+        assert list(plugin.iter_map_shard(pad, map_config, "about")) == [
+            ("/about/info/", "/about/more-detail/"),
+            ("/about/projects.html", "/projects/"),
+        ]
+        assert list(plugin.iter_map_shard(pad, map_config, "missing")) == []
+
+    def test_map_shard_checksums(
+        self,
+        plugin: RedirectPlugin,
+        env: Environment,
+        set_redirect_from: SetRedirectFromFixture,
+    ) -> None:
+        map_config = MapConfig("", "/.redirect.map", "nginx", "segment")
+
+        def get_checksums() -> dict[str, str]:
+            pad = env.new_pad()
+            checksums = {
+                key: plugin.get_map_shard_checksum(pad, map_config, key)
+                for key in plugin.get_map_shards(pad, map_config)
+            }
+            checksums[""] = plugin.get_map_index_checksum(pad, map_config)
+            return checksums
+
+        checksums = get_checksums()
+        set_redirect_from("/projects", ["/about/old-projects"])
+        new_checksums = get_checksums()
+        changed = {key for key in checksums if checksums[key] != new_checksums[key]}
+        assert changed == {"about"}
+
+    @pytest.mark.usefixtures("redirect_map_disabled")
+    def test_redirect_maps_none(self, plugin: RedirectPlugin) -> None:
+        assert plugin.redirect_maps == {}
+
+    def test_redirect_maps_missing_file(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map.edge.format"] = "txt"
+        with pytest.raises(RuntimeError, match=r"No file .* 'edge'"):
+            _ = plugin.redirect_maps
+
+    def test_redirect_maps_conflict(
+        self, plugin: RedirectPlugin, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map_file"] = ".redirect.map"
+            inifile["redirect.map.edge.file"] = ".redirect.map"
+        with pytest.raises(RuntimeError, match=r"'' and 'edge' .* '/.redirect.map'"):
+            _ = plugin.redirect_maps
+
     def test_get_redirect_urls(self, plugin: RedirectPlugin, pad: Pad) -> None:
         record = pad.get("/about/more-detail")
         assert plugin.get_redirect_urls(record) == {"/about/info/", "/details/"}
 
+    def test_get_record_info_patterns(
+        self,
+        plugin: RedirectPlugin,
+        pad: Pad,
+        set_redirect_from: SetRedirectFromFixture,
+    ) -> None:
+        set_redirect_from("/about/more-detail", ["old/*", r"~^/node/\d+/$"])
+        record = pad.get("/about/more-detail")
+        assert plugin.get_record_info(record).redirect_urls == (
+            "/about/old/*",
+            r"~^/node/\d+/$",
+        )
+
+    def test_get_record_info_ignores_bare_trailing_wildcard(
+        self,
+        plugin: RedirectPlugin,
+        pad: Pad,
+        set_redirect_from: SetRedirectFromFixture,
+        captured_reports: ReporterCaptureFixture,
+    ) -> None:
+        set_redirect_from("/about/more-detail", ["/old-foo*", "/old-bar/*"])
+        record = pad.get("/about/more-detail")
+        assert plugin.get_record_info(record).redirect_urls == ("/old-bar/*",)
+        assert captured_reports.message_matches(r"Ignoring redirect from '/old-foo\*'")
+
+    def test_get_record_info(self, plugin: RedirectPlugin, pad: Pad) -> None:
+        record = pad.get("/about/more-detail")
+        assert plugin.get_record_info(record) == RecordInfo(
+            "/about/more-detail", "/about/more-detail/", ("/about/info/", "/details/")
+        )
+
+    @pytest.mark.parametrize("persistent_index", [False, True])
+    @pytest.mark.parametrize("raw_scan", [False, True])
+    @pytest.mark.parametrize("scan_workers", [1, 2])
+    def test_iter_record_infos(
+        self,
+        plugin: RedirectPlugin,
+        open_config_file: OpenConfigFileFixture,
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+        persistent_index: bool,
+        raw_scan: bool,
+        scan_workers: int,
+    ) -> None:
+        monkeypatch.setenv("XDG_CACHE_HOME", os.fspath(tmp_path / "cache"))
+        with open_config_file() as inifile:
+            inifile["redirect.persistent_index"] = str(persistent_index).lower()
+            inifile["redirect.raw_scan"] = str(raw_scan).lower()
+            inifile["redirect.scan_workers"] = str(scan_workers)
+        pad = plugin.env.new_pad()
+        infos = {info.path: info for info in plugin.iter_record_infos(pad)}
+        assert infos["/projects"] == RecordInfo(
+            "/projects", "/projects/", ("/about/projects.html",)
+        )
+        assert len(infos) == 6
+        assert (tmp_path / "cache").exists() is persistent_index
+
+    def test_get_redirect_urls_includes_imported(
+        self,
+        plugin: RedirectPlugin,
+        open_config_file: OpenConfigFileFixture,
+        tmp_site_dir: Path,
+    ) -> None:
+        redirects_file = tmp_site_dir / "redirects.csv"
+        redirects_file.write_text("/legacy/info/,/about/more-detail\n")
+        with open_config_file() as inifile:
+            inifile["redirect.redirects_file"] = "redirects.csv"
+        pad = plugin.env.new_pad()
+        record = pad.get("/about/more-detail")
+        assert plugin.get_redirect_urls(record) == {
+            "/about/info/",
+            "/details/",
+            "/legacy/info/",
+        }
+
     def test_get_redirect_urls_survives_non_subscriptable_records(
         self, plugin: RedirectPlugin
     ) -> None:
@@ -102,6 +476,54 @@ class TestRedirectPlugin:
             (f"{prefix}images/apple-cake.jpg", f"{prefix}images/apple-pie.jpg"),
         ]
 
+    def test_get_index_uses_live_index_in_server(
+        self,
+        plugin: RedirectPlugin,
+        env: Environment,
+        set_redirect_from: SetRedirectFromFixture,
+    ) -> None:
+        plugin.on_server_spawn()
+        try:
+            index = plugin.get_index(env.new_pad())
+            assert plugin.get_index(env.new_pad())._redirects is index._redirects
+
+            set_redirect_from("/about", ["/old-about"])
+            plugin.on_before_build_all(mock.Mock(name="builder"))
+            index = plugin.get_index(env.new_pad())
+            assert index["/old-about/"].path == "/about"
+            assert plugin.full_walks == 0
+        finally:
+            plugin.on_server_stop()
+        pad = env.new_pad()
+        assert plugin.get_index(pad) is plugin.get_index(pad)
+
+    def test_iter_redirect_map_spills(
+        self, plugin: RedirectPlugin, env: Environment
+    ) -> None:
+        expected = list(plugin.iter_redirect_map(env.new_pad()))
+        with mock.patch.object(
+            RedirectPlugin, "map_memory_budget", new_callable=mock.PropertyMock
+        ) as map_memory_budget:
+            map_memory_budget.return_value = 0
+            assert list(plugin.iter_redirect_map(env.new_pad())) == expected
+
+    def test_iter_redirect_map_sorts_once(
+        self, plugin: RedirectPlugin, pad: Pad
+    ) -> None:
+        with mock.patch(
+            "lektor_redirect.plugin.sorted_items", wraps=sorted_items
+        ) as sorted_items_:
+            first = list(plugin.iter_redirect_map(pad))
+            assert list(plugin.iter_redirect_map(pad)) == first
+        assert sorted_items_.call_count == 1
+
+    def test_iter_redirect_map_uses_cached_index(
+        self, plugin: RedirectPlugin, pad: Pad
+    ) -> None:
+        plugin.get_index(pad)
+        list(plugin.iter_redirect_map(pad))
+        assert plugin.full_walks == 1
+
     def test_on_setup_env(self, env: Environment, plugin: RedirectPlugin) -> None:
         assert (Redirect, Redirect.BuildProgram) in env.build_programs
         assert (RedirectMap, RedirectMap.BuildProgram) in env.build_programs
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import pytest
+from lektor.db import Pad
+
+from lektor_redirect.prefixes import (
+    is_wildcard_url,
+    normalize_wildcard_url,
+    PrefixTrie,
+    wildcard_prefix,
+)
+
+
+@pytest.mark.parametrize(
+    "url_path, expected",
+    [
+        ("/docs/v1/*", True),
+        ("/*", True),
+        ("/docs/v1/", False),
+        ("/docs/v1*/", False),
+        ("/docs.*", False),
+    ],
+)
+def test_is_wildcard_url(url_path: str, expected: bool) -> None:
+    assert is_wildcard_url(url_path) is expected
+
+
+def test_wildcard_prefix() -> None:
+    assert wildcard_prefix("/docs/v1/*") == "/docs/v1/"
+
+
+@pytest.mark.parametrize(
+    "url_path, normalized",
+    [
+        ("/docs/v1/*", "/docs/v1/*"),
+        ("/docs//v1/*", "/docs/v1/*"),
+        ("old/*", "/about/old/*"),
+        ("*", "/about/*"),
+        ("/files.d/*", "/files.d/*"),
+    ],
+)
+def test_normalize_wildcard_url(pad: Pad, url_path: str, normalized: str) -> None:
+    assert normalize_wildcard_url(pad.get("/about"), url_path) == normalized
+
+
+class TestPrefixTrie:
+    @pytest.fixture
+    def trie(self) -> PrefixTrie:
+        return PrefixTrie(["/docs/", "/docs/v1/", "/a/b/"])
+
+    def test_iter(self, trie: PrefixTrie) -> None:
+        assert len(trie) == 3
+        assert sorted(trie) == ["/a/b/", "/docs/", "/docs/v1/"]
+        assert "/docs/v1/" in trie
+        assert "/a/" not in trie
+
+    @pytest.mark.parametrize(
+        "url_path, prefix",
+        [
+            ("/docs/v1/intro/", "/docs/v1/"),
+            ("/docs/v1/", "/docs/v1/"),
+            ("/docs/v2/", "/docs/"),
+            ("/docs/v1x/", "/docs/"),
+            ("/a/", None),
+            ("/", None),
+        ],
+    )
+    def test_longest_prefix(
+        self, trie: PrefixTrie, url_path: str, prefix: str | None
+    ) -> None:
+        assert trie.longest_prefix(url_path) == prefix
+
+    def test_discard(self, trie: PrefixTrie) -> None:
+        trie.discard("/a/b/")
+        trie.discard("/docs/v1/")
+        trie.discard("/not/there/")
+        assert len(trie) == 1
+        assert trie.longest_prefix("/docs/v1/intro/") == "/docs/"
+        assert trie._root == {"docs": {"/": "/docs/"}}
+
+    def test_copy(self, trie: PrefixTrie) -> None:
+        copy = trie.copy()
+        copy.add("/")
+        assert copy.longest_prefix("/x/") == "/"
+        assert trie.longest_prefix("/x/") is None
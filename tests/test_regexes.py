@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import pytest
+
+from lektor_redirect.regexes import (
+    check_regex_url,
+    is_regex_url,
+    regex_pattern,
+    RegexMatcher,
+)
+
+
+def test_is_regex_url() -> None:
+    assert is_regex_url(r"~^/node/\d+/$")
+    assert not is_regex_url("/node/")
+
+
+def test_regex_pattern() -> None:
+    assert regex_pattern(r"~^/node/\d+/$") == r"^/node/\d+/$"
+
+
+def test_check_regex_url() -> None:
+    assert check_regex_url(r"~^/node/\d+/$") is None
+    assert "missing )" in str(check_regex_url("~^/node/(/$"))
+
+
+class TestRegexMatcher:
+    @pytest.fixture
+    def matcher(self) -> RegexMatcher:
+        return RegexMatcher([r"~^/node/1\d*/$", r"~^/node/(\d+)/$", "~^/blog/"])
+
+    @pytest.mark.parametrize(
+        "url_path, regex_url",
+        [
+            ("/node/12/", r"~^/node/1\d*/$"),
+            ("/node/42/", r"~^/node/(\d+)/$"),
+            ("/blog/2001/post/", "~^/blog/"),
+            ("/node/x/", None),
+            ("/other/blog/", None),
+        ],
+    )
+    def test_match(
+        self, matcher: RegexMatcher, url_path: str, regex_url: str | None
+    ) -> None:
+        assert matcher.match(url_path) == regex_url
+
+    def test_empty(self) -> None:
+        assert RegexMatcher([]).match("/") is None
+
+    @pytest.mark.parametrize(
+        "regex_urls, url_path, regex_url",
+        [
+            # Inline global flags apply only to their own regex
+            (["~(?i)^/foo/", "~^/bar/"], "/FOO/", "~(?i)^/foo/"),
+            (["~(?i)^/foo/", "~^/bar/"], "/BAR/", None),
+            (["~^/bar/", "~(?i)^/foo/"], "/Foo/x", "~(?i)^/foo/"),
+            # Duplicate group names
+            (["~^/(?P<n>a)/", "~^/(?P<n>b)/"], "/b/", "~^/(?P<n>b)/"),
+            (["~^/(?P<_0>a)/", "~^/b/"], "/a/", "~^/(?P<_0>a)/"),
+            # Numbered backreferences
+            ([r"~^/(x)/", r"~^/(\w)\1/"], "/aa/", r"~^/(\w)\1/"),
+            ([r"~^/(x)/", r"~^/(\w)\1/"], "/ab/", None),
+        ],
+    )
+    def test_match_uncombinable(
+        self, regex_urls: list[str], url_path: str, regex_url: str | None
+    ) -> None:
+        assert RegexMatcher(regex_urls).match(url_path) == regex_url
+
+    @pytest.mark.parametrize(
+        "regex_urls",
+        [
+            ["~b", "~(?i)a"],
+            ["~(?i)b", "~a"],
+            ["~(?i)a", "~b"],
+        ],
+    )
+    def test_match_leftmost_first(self, regex_urls: list[str]) -> None:
+        # The same regex wins as if all the regexes were combined
+        combinable = [url.replace("(?i)", "") for url in regex_urls]
+        expected = combinable.index(RegexMatcher(combinable).match("/ab/") or "")
+        assert RegexMatcher(regex_urls).match("/ab/") == regex_urls[expected]
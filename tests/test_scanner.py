@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Callable
+from unittest import mock
+
+import pytest
+from inifile import IniFile
+from lektor.environment import Environment
+
+from lektor_redirect import RedirectPlugin
+from lektor_redirect.scanner import RecordScanner, ScannedRecord
+from lektor_redirect.util import RecordInfo
+
+from .conftest import OpenContentsLrFixture
+
+pytestmark = pytest.mark.usefixtures("plugin")
+
+MakeScannerFixture = Callable[..., RecordScanner]
+
+
+@pytest.fixture
+def make_scanner(plugin: RedirectPlugin, env: Environment) -> MakeScannerFixture:
+    def make_scanner(raw: bool = False) -> RecordScanner:
+        return RecordScanner(
+            env.new_pad(), "redirect_from", plugin._get_redirect_urls, raw=raw
+        )
+
+    return make_scanner
+
+
+def test_scanned_record_info() -> None:
+    scanned = ScannedRecord("/about", "/about/", "page", False, ("/info/",))
+    assert scanned.record_info == RecordInfo("/about", "/about/", ("/info/",))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("raw", [False, True])
+def test_walk(make_scanner: MakeScannerFixture, raw: bool, workers: int) -> None:
+    scanner = make_scanner(raw=raw)
+    assert list(scanner.walk(workers=workers)) == [
+        ScannedRecord("/", "/", "page", False, ()),
+        ScannedRecord("/about", "/about/", "page", False, ()),
+        ScannedRecord(
+            "/about/more-detail",
+            "/about/more-detail/",
+            "page",
+            False,
+            ("/about/info/", "/details/"),
+        ),
+        ScannedRecord("/images", "/images/", "page", False, ()),
+        ScannedRecord(
+            "/images/apple-pie.jpg",
+            "/images/apple-pie.jpg",
+            "attachment",
+            False,
+            ("/images/apple-cake.jpg",),
+        ),
+        ScannedRecord(
+            "/projects", "/projects/", "page", False, ("/about/projects.html",)
+        ),
+    ]
+
+
+def test_parallel_walk_uses_pad_per_thread(make_scanner: MakeScannerFixture) -> None:
+    scanner = make_scanner()
+    pads = {}
+
+    def scan(
+        path: str, is_attachment: bool, parent: ScannedRecord | None
+    ) -> ScannedRecord | None:
+        pads[path] = (threading.get_ident(), scanner.pad)
+        return scanner.scan(path, is_attachment, parent)
+
+    list(scanner.walk(scan, workers=4))
+    # Records within a subtree are scanned by the same thread
+    assert pads["/about"] == pads["/about/more-detail"]
+    assert pads["/images"] == pads["/images/apple-pie.jpg"]
+    # Each thread has its own pad
+    assert len({thread for thread, _ in pads.values()}) == len(
+        {id(pad) for _, pad in pads.values()}
+    )
+
+
+def test_raw_walk_only_loads_records_declaring_redirects(
+    make_scanner: MakeScannerFixture,
+) -> None:
+    scanner = make_scanner(raw=True)
+    with mock.patch.object(
+        scanner, "_scan_record", wraps=scanner._scan_record
+    ) as scan_record:
+        list(scanner.walk())
+    assert {call.args[0] for call in scan_record.mock_calls} == {
+        "/about/more-detail",
+        "/images/apple-pie.jpg",
+        "/projects",
+    }
+
+
+@pytest.fixture
+def set_model_option(tmp_site_dir: Path) -> Callable[[str, str, str], None]:
+    def set_model_option(model: str, key: str, value: str) -> None:
+        inifile = IniFile(tmp_site_dir / "models" / f"{model}.ini")
+        inifile[key] = value
+        inifile.save()
+
+    return set_model_option
+
+
+@pytest.fixture
+def write_model(tmp_site_dir: Path) -> Callable[..., None]:
+    def write_model(model: str, **options: str) -> None:
+        inifile = IniFile(tmp_site_dir / "models" / f"{model}.ini")
+        inifile["model.name"] = model.title()
+        inifile["fields.title.type"] = "string"
+        inifile.update(options)
+        inifile.save()
+
+    return write_model
+
+
+def test_redirect_models(make_scanner: MakeScannerFixture) -> None:
+    scanner = make_scanner()
+    assert scanner.redirect_models == {"page", "attachment"}
+    assert scanner.redirect_free_models == set()
+
+
+def test_redirect_free_models(
+    make_scanner: MakeScannerFixture, write_model: Callable[..., None]
+) -> None:
+    write_model("photo")
+    write_model("gallery", **{"children.enabled": "no", "attachments.model": "photo"})
+    write_model("folder", **{"children.model": "folder", "attachments.enabled": "no"})
+    write_model("album", **{"children.model": "gallery", "attachments.model": "page"})
+    write_model("shelf", **{"children.model": "gallery", "attachments.model": "photo"})
+    write_model("loose", **{"attachments.model": "photo"})
+    scanner = make_scanner()
+    assert scanner.redirect_free_models == {"gallery", "folder", "shelf"}
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_walk_raw_scans_redirect_free_subtrees(
+    make_scanner: MakeScannerFixture,
+    write_model: Callable[..., None],
+    open_contents_lr: OpenContentsLrFixture,
+    tmp_site_dir: Path,
+    raw: bool,
+) -> None:
+    write_model("photo")
+    write_model("gallery", **{"children.enabled": "no", "attachments.model": "photo"})
+    with open_contents_lr("/images") as data:
+        data["_model"] = "gallery"
+    for n in range(10):
+        (tmp_site_dir / f"content/images/photo{n}.jpg").write_bytes(b"")
+
+    scanner = make_scanner(raw=raw)
+    with mock.patch.object(
+        scanner, "_scan_record", wraps=scanner._scan_record
+    ) as scan_record:
+        scanned = {scanned.path: scanned for scanned in scanner.walk()}
+    loaded = {call.args[0] for call in scan_record.call_args_list}
+    assert scanned["/images"].model == "gallery"
+    assert scanned["/images/apple-pie.jpg"].model == "photo"
+    assert not loaded & {"/images/apple-pie.jpg", "/images/photo0.jpg"}
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_walk_finds_model_override_in_redirect_free_subtree(
+    make_scanner: MakeScannerFixture,
+    write_model: Callable[..., None],
+    open_contents_lr: OpenContentsLrFixture,
+    tmp_site_dir: Path,
+    raw: bool,
+) -> None:
+    disabled = {"children.enabled": "no", "attachments.enabled": "no"}
+    write_model("photo", **disabled)
+    write_model("gallery", **{"children.model": "photo", "attachments.enabled": "no"})
+    with open_contents_lr("/images") as data:
+        data["_model"] = "gallery"
+    (tmp_site_dir / "content/images/special").mkdir()
+    (tmp_site_dir / "content/images/special/contents.lr").write_text("")
+    with open_contents_lr("/images/special") as data:
+        data["_model"] = "page"
+        data["redirect_from"] = "/old-special/"
+
+    scanner = make_scanner(raw=raw)
+    assert scanner.redirect_free_models == {"gallery", "photo"}
+    scanned = {scanned.path: scanned for scanned in scanner.walk()}
+    assert scanned["/images/special"].redirect_urls == ("/old-special/",)
+
+
+def test_attachments_without_metadata_are_not_loaded(
+    make_scanner: MakeScannerFixture,
+    write_model: Callable[..., None],
+    set_model_option: Callable[[str, str, str], None],
+    tmp_site_dir: Path,
+) -> None:
+    write_model("photo")
+    set_model_option("page", "attachments.model", "photo")
+    (tmp_site_dir / "content/images/other.jpg").write_bytes(b"")
+    scanner = make_scanner()
+    with mock.patch.object(
+        scanner, "_scan_record", wraps=scanner._scan_record
+    ) as scan_record:
+        scanned = {scanned.path: scanned for scanned in scanner.walk()}
+    assert scanned["/images/other.jpg"] == ScannedRecord(
+        "/images/other.jpg", "/images/other.jpg", "photo", False, ()
+    )
+    loaded = {call.args[0] for call in scan_record.mock_calls}
+    assert "/images/other.jpg" not in loaded
+    assert "/images/apple-pie.jpg" in loaded
+
+
+@pytest.mark.parametrize("raw", [False, True])
+def test_redirects_ignored_for_models_without_field(
+    make_scanner: MakeScannerFixture,
+    write_model: Callable[..., None],
+    open_contents_lr: OpenContentsLrFixture,
+    raw: bool,
+) -> None:
+    write_model("plain")
+    with open_contents_lr("/projects") as data:
+        data["_model"] = "plain"
+    scanner = make_scanner(raw=raw)
+    with mock.patch.object(
+        scanner, "get_redirect_urls", wraps=scanner.get_redirect_urls
+    ) as get_redirect_urls:
+        scanned = {scanned.path: scanned for scanned in scanner.walk()}
+    assert scanned["/projects"].redirect_urls == ()
+    called = {call.args[0].path for call in get_redirect_urls.call_args_list}
+    assert "/projects" not in called
+    assert "/about/more-detail" in called
+
+
+@pytest.mark.parametrize(
+    "contents, model_options",
+    [
+        ({"/about": {"_slug": "about-us"}}, {}),
+        ({"/about": {"_slug": "about.html"}}, {}),
+        ({"/about": {"_slug": "/a/b/"}}, {}),
+        ({"/about": {"_hidden": "yes"}}, {}),
+        ({"/about": {"_hidden": "no"}}, {"page": {"children.hidden": "yes"}}),
+        ({}, {"page": {"children.hidden": "yes"}}),
+        ({"/about": {"_hidden": "yes"}}, {"page": {"children.hidden": "no"}}),
+        ({}, {"page": {"attachments.hidden": "yes"}}),
+        ({}, {"page": {"children.slug_format": "{{ this._id }}-page"}}),
+        ({}, {"page": {"children.model": "attachment"}}),
+        ({"/about": {"_model": "attachment"}}, {}),
+        ({}, {"page": {"pagination.enabled": "yes"}}),
+    ],
+)
+def test_raw_walk_matches_record_walk(
+    make_scanner: MakeScannerFixture,
+    open_contents_lr: OpenContentsLrFixture,
+    set_model_option: Callable[[str, str, str], None],
+    contents: dict[str, dict[str, str]],
+    model_options: dict[str, dict[str, str]],
+) -> None:
+    for path, fields in contents.items():
+        with open_contents_lr(path) as data:
+            data.update(fields)
+    for model, options in model_options.items():
+        for key, value in options.items():
+            set_model_option(model, key, value)
+
+    expected = list(make_scanner(raw=False).walk())
+    assert list(make_scanner(raw=True).walk()) == expected
+
+
+def test_raw_scan_of_missing_metadata(
+    make_scanner: MakeScannerFixture, tmp_site_dir: Path
+) -> None:
+    (tmp_site_dir / "content/images/other.txt").write_text("text")
+    scanner = make_scanner(raw=True)
+    scanned = {scanned.path: scanned for scanned in scanner.walk()}
+    assert scanned["/images/other.txt"] == ScannedRecord(
+        "/images/other.txt", "/images/other.txt", "attachment", False, ()
+    )
+
+
+def test_raw_scan_defers_to_lektor_for_bad_pagination(
+    make_scanner: MakeScannerFixture,
+    open_contents_lr: OpenContentsLrFixture,
+    set_model_option: Callable[[str, str, str], None],
+) -> None:
+    with open_contents_lr("/about") as data:
+        data["_slug"] = "about.html"
+    set_model_option("page", "pagination.enabled", "yes")
+    with pytest.raises(RuntimeError, match="pagination cannot be used"):
+        list(make_scanner(raw=True).walk())
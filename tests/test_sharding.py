@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import pytest
+
+from lektor_redirect.sharding import (
+    fingerprint_shards,
+    get_shard_key,
+    hash_shard_keys,
+    parse_shard_url,
+    PATTERNS_SHARD,
+    ROOT_SHARD,
+    shard_url,
+    sorted_shard_keys,
+)
+
+
+def test_shard_url() -> None:
+    assert shard_url("/.redirect.map", "07") == "/.redirect.map.d/07.map"
+
+
+@pytest.mark.parametrize(
+    "url_path, key",
+    [
+        ("/.redirect.map.d/07.map", "07"),
+        ("/.redirect.map.d/@root.map", "@root"),
+        ("/.redirect.map.d/.map", None),
+        ("/.redirect.map.d/a/b.map", None),
+        ("/.redirect.map.d/07.txt", None),
+        ("/other.map.d/07.map", None),
+    ],
+)
+def test_parse_shard_url(url_path: str, key: str | None) -> None:
+    assert parse_shard_url("/.redirect.map", url_path) == key
+
+
+def test_hash_shard_keys() -> None:
+    assert hash_shard_keys(3) == ["0", "1", "2"]
+    assert hash_shard_keys(11)[:2] == ["00", "01"]
+
+
+@pytest.mark.parametrize(
+    "url_path, key",
+    [
+        ("about/info/", "about"),
+        ("about/", "about"),
+        ("details.html", ROOT_SHARD),
+        ("a b/c/", "a%20b"),
+    ],
+)
+def test_get_shard_key_by_segment(url_path: str, key: str) -> None:
+    assert get_shard_key("segment", 0, url_path) == key
+
+
+def test_get_shard_key_by_hash() -> None:
+    keys = {get_shard_key("hash", 16, f"page{n}/") for n in range(200)}
+    assert keys == set(hash_shard_keys(16))
+    # Stable
+    assert get_shard_key("hash", 16, "about/") == get_shard_key("hash", 16, "about/")
+
+
+@pytest.mark.parametrize("shard_by", ["segment", "hash"])
+@pytest.mark.parametrize("url_path", ["about/*", "*", "~^/about/"])
+def test_get_shard_key_for_patterns(shard_by: str, url_path: str) -> None:
+    assert get_shard_key(shard_by, 16, url_path) == PATTERNS_SHARD
+
+
+def test_sorted_shard_keys() -> None:
+    keys = ["about", ROOT_SHARD, PATTERNS_SHARD, "00"]
+    assert sorted_shard_keys(keys) == [PATTERNS_SHARD, "00", ROOT_SHARD, "about"]
+
+
+def test_fingerprint_shards_by_segment() -> None:
+    entries = [("about/info/", "about/more/"), ("details/", "about/more/")]
+    fingerprints = fingerprint_shards("segment", 0, entries)
+    assert set(fingerprints) == {"about", "details"}
+    assert fingerprint_shards("segment", 0, reversed(entries)) == fingerprints
+    changed = fingerprint_shards("segment", 0, [*entries, ("about/x/", "y/")])
+    assert changed["details"] == fingerprints["details"]
+    assert changed["about"] != fingerprints["about"]
+
+
+def test_fingerprint_shards_by_hash_includes_empty_shards() -> None:
+    fingerprints = fingerprint_shards("hash", 4, [("about/", "other/")])
+    assert set(fingerprints) == {"0", "1", "2", "3"}
+    assert sorted(fingerprints.values()).count(0) == 3
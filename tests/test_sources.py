@@ -10,19 +10,36 @@ from unittest import mock
 
 import pytest
 from lektor.builder import BuildState
-from lektor.context import Context
+from lektor.context import Context, get_ctx
 from lektor.db import Pad, Record
 from lektor.environment import Environment
 
-from lektor_redirect.sources import Redirect, RedirectMap
+from lektor_redirect import RedirectPlugin
+from lektor_redirect.sources import (
+    Redirect,
+    RedirectMap,
+    RedirectMapShard,
+    RedirectUrls,
+)
+from lektor_redirect.writers import NginxMapWriter
 
 from .conftest import (
     OpenConfigFileFixture,
+    OpenContentsLrFixture,
     ReporterCaptureFixture,
     SetRedirectFromFixture,
 )
 
 
+def virtual_dependency_paths(ctx: Context) -> set[str]:
+    """The paths of the virtual sources recorded as dependencies of ``ctx``.
+
+    (In Lektor 3.3, ``referenced_virtual_dependencies`` is a dict keyed by
+    path, rather than a set of sources.)
+    """
+    return {getattr(dep, "path", dep) for dep in ctx.referenced_virtual_dependencies}
+
+
 @pytest.fixture
 def source(source_path: str, pad: Pad) -> Record:
     record = pad.get(source_path)
@@ -59,9 +76,41 @@ class TestRedirect:
     def test_path(self, redirect: Redirect, redirect_path: str) -> None:
         assert redirect.path == redirect_path
 
+    @pytest.mark.usefixtures("plugin")
     def test_target(self, redirect: Redirect, record: Record) -> None:
         assert redirect.target is record
 
+    @pytest.mark.usefixtures("plugin")
+    def test_get_checksum_changes(
+        self,
+        env: Environment,
+        open_contents_lr: OpenContentsLrFixture,
+        set_redirect_from: SetRedirectFromFixture,
+    ) -> None:
+        def get_checksum() -> str:
+            pad = env.new_pad()
+            redirect = Redirect(pad.get("/about/more-detail"), "/details/")
+            return redirect.get_checksum(mock.Mock(name="path_cache"))
+
+        checksum = get_checksum()
+        with open_contents_lr("/about/more-detail") as data:
+            data["body"] = "Edited"
+        assert get_checksum() == checksum
+        with open_contents_lr("/about/more-detail") as data:
+            data["_slug"] = "moved"
+        assert get_checksum() != checksum
+        checksum = get_checksum()
+        set_redirect_from("/projects", ["/details"])
+        set_redirect_from("/about/more-detail", [])
+        assert get_checksum() != checksum
+
+    @pytest.mark.usefixtures("plugin")
+    def test_render_builtin_page(self, redirect: Redirect) -> None:
+        page = redirect.render_builtin_page().decode()
+        assert 'href="https://test.example.org/about/"' in page
+        assert 'content="0; url=/about/"' in page
+        assert 'window.location.href = "/about/";' in page
+
     def test_eq_self(self, redirect: Record) -> None:
         assert redirect == redirect
         assert not (redirect != redirect)
@@ -224,8 +273,8 @@ class TestRedirectMap:
     def source(self, pad: Pad) -> RedirectMap:
         return RedirectMap(pad.root, "/.redirect.map")
 
-    def test_redirect_map(self, source: RedirectMap) -> None:
-        assert source.redirect_map == {
+    def test_iter_redirect_map(self, source: RedirectMap) -> None:
+        assert dict(source.iter_redirect_map()) == {
             "/about/info/": "/about/more-detail/",
             "/about/projects.html": "/projects/",
             "/details/": "/about/more-detail/",
@@ -235,7 +284,49 @@ class TestRedirectMap:
     def test_get_checksum(self, source: RedirectMap) -> None:
         path_cache = mock.Mock(name="path_cache")
         checksum = source.get_checksum(path_cache)
-        assert checksum == "baddf4094f10738328ab2c09c4a44d27"
+        assert checksum == "00be7fd9e6877604da9e4ace5eb9177e"
+
+    def test_get_checksum_does_not_compute_map(
+        self, source: RedirectMap, plugin: RedirectPlugin
+    ) -> None:
+        path_cache = mock.Mock(name="path_cache")
+        with mock.patch.object(plugin, "iter_redirect_map") as iter_redirect_map:
+            source.get_checksum(path_cache)
+        assert iter_redirect_map.call_count == 0
+
+    def test_get_checksum_changes(
+        self,
+        env: Environment,
+        set_redirect_from: SetRedirectFromFixture,
+        open_config_file: OpenConfigFileFixture,
+    ) -> None:
+        def get_checksum() -> str:
+            pad = env.new_pad()
+            source = RedirectMap(pad.root, "/.redirect.map")
+            return source.get_checksum(mock.Mock(name="path_cache"))
+
+        checksums = [get_checksum()]
+        assert get_checksum() == checksums[0]
+        set_redirect_from("/about", ["/old-about"])
+        checksums.append(get_checksum())
+        with open_config_file() as inifile:
+            inifile["redirect.map_file"] = "other.map"
+        checksums.append(get_checksum())
+        with open_config_file() as inifile:
+            inifile["redirect.map_format"] = "txt"
+        checksums.append(get_checksum())
+        assert len(set(checksums)) == 4
+
+    def test_get_checksum_includes_writer_checksum_key(
+        self, source: RedirectMap, plugin: RedirectPlugin
+    ) -> None:
+        path_cache = mock.Mock(name="path_cache")
+        checksum = source.get_checksum(path_cache)
+        with mock.patch.object(
+            NginxMapWriter, "checksum_key", new_callable=mock.PropertyMock
+        ) as checksum_key:
+            checksum_key.return_value = "nginx:v2"
+            assert source.get_checksum(path_cache) != checksum
 
     def test_generator(self, pad: Pad, open_config_file: OpenConfigFileFixture) -> None:
         with open_config_file() as inifile:
@@ -245,6 +336,26 @@ class TestRedirectMap:
         ]
         assert list(RedirectMap._generator(pad.get("/about"))) == []
 
+    def test_generator_multiple_maps(
+        self, env: Environment, open_config_file: OpenConfigFileFixture
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map_file"] = ".redirect.map"
+            inifile["redirect.map.edge.file"] = "edge.map"
+            inifile["redirect.map.edge.format"] = "haproxy"
+        pad = env.new_pad()
+        redirect_maps = list(RedirectMap._generator(pad.root))
+        assert redirect_maps == [
+            RedirectMap(pad.root, "/.redirect.map"),
+            RedirectMap(pad.root, "/edge.map"),
+        ]
+        assert [source.map_format for source in redirect_maps] == ["nginx", "haproxy"]
+        checksums = {
+            source.get_checksum(mock.Mock(name="path_cache"))
+            for source in redirect_maps
+        }
+        assert len(checksums) == 2
+
     @pytest.mark.usefixtures("redirect_map_disabled")
     def test_generator_disabled(self, pad: Pad) -> None:
         assert list(RedirectMap._generator(pad.root)) == []
@@ -270,6 +381,96 @@ class TestRedirectMap:
         assert redirect_map is None
 
 
+@pytest.mark.usefixtures("plugin")
+class TestRedirectMapShard:
+    @pytest.fixture(autouse=True)
+    def sharded(self, open_config_file: OpenConfigFileFixture) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.map_shard_by"] = "segment"
+
+    def test_generator(self, pad: Pad) -> None:
+        assert [shard.url_path for shard in RedirectMapShard._generator(pad.root)] == [
+            "/.redirect.map.d/about.map",
+            "/.redirect.map.d/details.map",
+            "/.redirect.map.d/images.map",
+        ]
+        assert list(RedirectMapShard._generator(pad.get("/about"))) == []
+
+    def test_shard(self, pad: Pad) -> None:
+        shard = RedirectMapShard(pad.root, "/.redirect.map.d/details.map")
+        map_config, key = shard.shard
+        assert map_config.url_path == "/.redirect.map"
+        assert key == "details"
+        assert list(shard.iter_redirect_map()) == [("/details/", "/about/more-detail/")]
+
+    def test_shard_fails(self, pad: Pad) -> None:
+        shard = RedirectMapShard(pad.root, "/other.map.d/details.map")
+        with pytest.raises(LookupError):
+            _ = shard.shard
+
+    @pytest.mark.parametrize(
+        "url_path, resolved",
+        [
+            ([".redirect.map.d", "about.map"], True),
+            ([".redirect.map.d", "missing.map"], False),
+            ([".redirect.map.d", "about.txt"], False),
+        ],
+    )
+    def test_resolve_url_path(
+        self, pad: Pad, url_path: list[str], resolved: bool
+    ) -> None:
+        shard = RedirectMapShard._resolve_url_path(pad.root, url_path)
+        assert (shard is not None) == resolved
+
+    def test_redirect_map_is_index(self, pad: Pad) -> None:
+        source = RedirectMap(pad.root, "/.redirect.map")
+        assert list(source.iter_shard_paths()) == [
+            ".redirect.map.d/about.map",
+            ".redirect.map.d/details.map",
+            ".redirect.map.d/images.map",
+        ]
+
+
+@pytest.mark.usefixtures("plugin")
+class TestRedirectUrls:
+    @pytest.fixture
+    def source(self, pad: Pad) -> RedirectUrls:
+        return RedirectUrls(pad.get("/about/more-detail"))
+
+    def test_path(self, source: RedirectUrls) -> None:
+        assert source.path == "/about/more-detail@redirect-urls"
+
+    def test_redirect_urls(self, source: RedirectUrls) -> None:
+        assert source.redirect_urls == ("/about/info/", "/details/")
+
+    def test_vpath_resolver(self, pad: Pad, source: RedirectUrls) -> None:
+        assert pad.get("/about/more-detail@redirect-urls") == source
+
+    def test_get_checksum_changes(
+        self, env: Environment, set_redirect_from: SetRedirectFromFixture
+    ) -> None:
+        def get_checksum() -> str:
+            pad = env.new_pad()  # keep a reference, as records only hold weak ones
+            source = RedirectUrls(pad.get("/about/more-detail"))
+            return source.get_checksum(mock.Mock(name="path_cache"))
+
+        checksum = get_checksum()
+        set_redirect_from("/projects", ["/new-projects"])
+        assert get_checksum() == checksum
+        set_redirect_from("/about/more-detail", ["/details"])
+        assert get_checksum() != checksum
+
+    def test_filter(self, env: Environment, pad: Pad, context: Context) -> None:
+        template = env.jinja_env.from_string("{{ this|redirect_urls|join(' ') }}")
+        record = pad.get("/about/more-detail")
+        assert template.render(this=record) == "/about/info/ /details/"
+        assert RedirectUrls(record).path in virtual_dependency_paths(context)
+
+    def test_filter_ignores_non_records(self, env: Environment) -> None:
+        template = env.jinja_env.from_string("{{ 'x'|redirect_urls|length }}")
+        assert template.render() == "0"
+
+
 @pytest.mark.usefixtures("context", "plugin")
 class TestRedirectBuildProgram:
     @pytest.fixture
@@ -300,7 +501,7 @@ class TestRedirectBuildProgram:
         declare_artifact: mock.Mock,
     ) -> None:
         build_program.produce_artifacts()
-        sources = list(source.parent.iter_source_filenames())
+        sources = [os.path.dirname(source.record.source_filename)]
         assert declare_artifact.mock_calls == [
             mock.call("/details/index.html", sources=sources)
         ]
@@ -311,7 +512,7 @@ class TestRedirectBuildProgram:
         build_program = Redirect.BuildProgram(img_source, build_state)
         with mock.patch.object(build_program, "declare_artifact") as declare_artifact:
             build_program.produce_artifacts()
-            sources = list(img_source.parent.iter_source_filenames())
+            sources = [img_source.record.attachment_filename]
         assert declare_artifact.mock_calls == [
             mock.call("/images/apple-cake.jpg/index.html", sources=sources),
         ]
@@ -325,6 +526,15 @@ class TestRedirectBuildProgram:
             mock.call.render_template_into("redirect.html", this=source)
         ]
 
+    def test_build_artifact_records_virtual_dependency(
+        self,
+        source: Redirect,
+        build_program: Redirect.BuildProgram,
+        context: Context,
+    ) -> None:
+        build_program.build_artifact(mock.Mock(name="artifact"))
+        assert source.path in virtual_dependency_paths(context)
+
     def test_build_artifact_records_dependency(
         self,
         source: Record,
@@ -337,6 +547,74 @@ class TestRedirectBuildProgram:
         build_program.build_artifact(artifact)
         assert config_filename in context.referenced_dependencies
 
+    def test_build_artifact_builtin(
+        self,
+        source: Redirect,
+        build_program: Redirect.BuildProgram,
+        env: Environment,
+        open_config_file: OpenConfigFileFixture,
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.template"] = ":builtin:"
+        buf = io.BytesIO()
+
+        @contextmanager
+        def artifact_open(mode: str) -> Iterator[io.BytesIO]:
+            yield buf
+
+        artifact = mock.Mock(name="artifact", open=artifact_open)
+        with mock.patch.object(env, "render_template") as render_template:
+            build_program.build_artifact(artifact)
+        assert render_template.call_count == 0
+        assert buf.getvalue() == source.render_builtin_page()
+
+    def test_build_artifact_render_once_per_target(
+        self,
+        pad: Pad,
+        env: Environment,
+        build_state: BuildState,
+        open_config_file: OpenConfigFileFixture,
+    ) -> None:
+        with open_config_file() as inifile:
+            inifile["redirect.render_once_per_target"] = "true"
+
+        template_filename = os.path.join(env.root_path, "templates", "redirect.html")
+
+        def render_template(name: str, pad: Pad, this: Redirect) -> str:
+            ctx = get_ctx()
+            assert ctx is not None
+            ctx.record_dependency(template_filename)
+            ctx.record_dependency(this.target.source_filename)
+            return f"moved to {this.target.path}"
+
+        target = pad.get("/about/more-detail")
+        contents = []
+        with mock.patch.object(
+            env, "render_template", side_effect=render_template
+        ) as render:
+            for url_path in ["/details/", "/about/info/"]:
+                buf = io.BytesIO()
+
+                @contextmanager
+                def artifact_open(
+                    mode: str, buf: io.BytesIO = buf
+                ) -> Iterator[io.BytesIO]:
+                    yield buf
+
+                artifact = mock.Mock(name="artifact", open=artifact_open)
+                build_program = Redirect.BuildProgram(
+                    Redirect(target, url_path), build_state
+                )
+                with Context(pad=pad) as ctx:
+                    build_program.build_artifact(artifact)
+                # Template dependencies are recorded for every artifact
+                assert ctx.referenced_dependencies >= {template_filename}
+                assert target.source_filename not in ctx.referenced_dependencies
+                contents.append(buf.getvalue())
+
+        assert render.call_count == 1
+        assert contents == [b"moved to /about/more-detail\n"] * 2
+
 
 @pytest.mark.usefixtures("plugin")
 class TestRedirectMapBuildProgram:
@@ -380,3 +658,14 @@ class TestRedirectMapBuildProgram:
             "/details/ /about/more-detail/;\n"
             "/images/apple-cake.jpg /images/apple-pie.jpg;\n"
         )
+
+    @pytest.mark.usefixtures("context")
+    def test_build_artifact_records_virtual_dependency(
+        self,
+        source: RedirectMap,
+        build_program: RedirectMap.BuildProgram,
+        context: Context,
+    ) -> None:
+        artifact = mock.MagicMock(name="artifact")
+        build_program.build_artifact(artifact)
+        assert source.path in virtual_dependency_paths(context)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterator
+from unittest import mock
+
+import pytest
+from lektor.db import Pad
+from lektor.environment import Environment
+
+from lektor_redirect import RedirectPlugin
+from lektor_redirect.scanner import RecordScanner
+from lektor_redirect.store import (
+    compute_fingerprint,
+    get_store_filename,
+    IndexStore,
+    MISSING,
+)
+
+from .conftest import OpenContentsLrFixture, SetRedirectFromFixture
+
+pytestmark = pytest.mark.usefixtures("plugin")
+
+
+@pytest.fixture
+def store_filename(tmp_path: Path) -> Path:
+    return tmp_path / "cache" / "index.sqlite"
+
+
+@pytest.fixture
+def store(store_filename: Path, pad: Pad) -> IndexStore:
+    return IndexStore(store_filename, compute_fingerprint(pad))
+
+
+@pytest.fixture
+def refresh(
+    store: IndexStore, plugin: RedirectPlugin, env: Environment
+) -> Iterator[mock.Mock]:
+    """Refresh the store using a fresh pad, spying on record loads."""
+
+    def refresh() -> dict[str, tuple[str, ...]]:
+        pad = env.new_pad()
+        with mock.patch.object(pad, "get", wraps=pad.get) as pad_get:
+            scanner = RecordScanner(pad, "redirect_from", plugin._get_redirect_urls)
+            scanned_records = store.refresh(scanner)
+        spy.loaded = {call.args[0] for call in pad_get.mock_calls}
+        return {scanned.path: scanned.redirect_urls for scanned in scanned_records}
+
+    spy = mock.Mock(side_effect=refresh)
+    yield spy
+
+
+def test_get_store_filename(
+    pad: Pad, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", os.fspath(tmp_path))
+    filename = get_store_filename(pad)
+    assert filename.parent == tmp_path / "lektor/plugins/redirect"
+    assert filename.name == f"{pad.env.project.id}.sqlite"
+
+
+def test_compute_fingerprint_depends_on_extra_files(pad: Pad, tmp_path: Path) -> None:
+    extra = tmp_path / "extra.ini"
+    fingerprint = compute_fingerprint(pad, [extra])
+    assert compute_fingerprint(pad, [extra]) == fingerprint
+    extra.write_text("[redirect]\n")
+    assert compute_fingerprint(pad, [extra]) != fingerprint
+
+
+def test_refresh_cold(refresh: mock.Mock) -> None:
+    assert refresh() == {
+        "/": (),
+        "/about": (),
+        "/about/more-detail": ("/about/info/", "/details/"),
+        "/images": (),
+        "/images/apple-pie.jpg": ("/images/apple-cake.jpg",),
+        "/projects": ("/about/projects.html",),
+    }
+    assert len(refresh.loaded) == 6
+
+
+def test_refresh_warm_loads_no_records(refresh: mock.Mock) -> None:
+    infos = refresh()
+    assert refresh() == infos
+    assert refresh.loaded == set()
+
+
+def test_refresh_parallel(store: IndexStore, plugin: RedirectPlugin, pad: Pad) -> None:
+    scanner = RecordScanner(pad, "redirect_from", plugin._get_redirect_urls)
+    scanned_records = store.refresh(scanner, workers=4)
+    assert scanned_records == list(scanner.walk())
+    assert len(store.load()) == 6
+
+
+@pytest.mark.usefixtures("tmp_site_dir")
+def test_refresh_reloads_changed_records(
+    refresh: mock.Mock, set_redirect_from: SetRedirectFromFixture
+) -> None:
+    refresh()
+    set_redirect_from("/about", ["/old-about"])
+    infos = refresh()
+    assert infos["/about"] == ("/old-about/",)
+    assert "/about" in refresh.loaded
+    assert refresh.loaded <= {"/", "/about"}
+
+
+@pytest.mark.usefixtures("tmp_site_dir")
+def test_refresh_reloads_children_of_moved_records(
+    refresh: mock.Mock, open_contents_lr: OpenContentsLrFixture
+) -> None:
+    refresh()
+    with open_contents_lr("/about") as data:
+        data["_slug"] = "about-us"
+    infos = refresh()
+    assert infos["/about/more-detail"] == ("/about-us/info/", "/details/")
+    assert refresh.loaded >= {"/about", "/about/more-detail"}
+    assert "/images" not in refresh.loaded
+
+
+@pytest.mark.usefixtures("tmp_site_dir")
+def test_refresh_skips_hidden_records(
+    refresh: mock.Mock, open_contents_lr: OpenContentsLrFixture
+) -> None:
+    with open_contents_lr("/about") as data:
+        data["_hidden"] = "yes"
+    infos = refresh()
+    assert "/about" not in infos
+    assert "/about/more-detail" not in infos
+    assert refresh() == infos
+
+
+def test_refresh_discards_stale_fingerprint(
+    refresh: mock.Mock, store: IndexStore
+) -> None:
+    infos = refresh()
+    store.fingerprint = "changed"
+    assert store.load() == {}
+    assert refresh() == infos
+    assert len(refresh.loaded) == 6
+    refresh()
+    assert refresh.loaded == set()
+
+
+def test_store_signature_of_attachment_without_metadata(
+    refresh: mock.Mock, store: IndexStore, tmp_site_dir: Path
+) -> None:
+    (tmp_site_dir / "content/images/other.txt").write_text("text")
+    refresh()
+    entries = store.load()
+    assert entries["/images/other.txt"].signature == MISSING
+    assert entries["/images/apple-pie.jpg"].signature != MISSING
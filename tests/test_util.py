@@ -1,9 +1,32 @@
 from __future__ import annotations
 
+import gzip
+import os
+import random
+import tempfile
+from pathlib import Path
+from unittest import mock
+
 import pytest
 from lektor.db import Pad
 
-from lektor_redirect.util import nginx_quote_for_map, normalize_url_path, walk_records
+from lektor_redirect import util
+from lektor_redirect.sources import Redirect
+from lektor_redirect.util import (
+    apache_quote_for_rewrite_map,
+    builtin_redirect_page,
+    collapse_chains,
+    collect_artifact_url_paths,
+    external_sort,
+    gzip_compress,
+    gzip_copy_file,
+    nginx_quote_for_map,
+    nginx_regex_for_prefix,
+    normalize_url_path,
+    sorted_items,
+    source_key,
+    walk_records,
+)
 
 
 @pytest.mark.parametrize(
@@ -38,6 +61,75 @@ def test_nginx_quote_for_map(s: str, expected: str) -> None:
     assert nginx_quote_for_map(s) == expected
 
 
+@pytest.mark.parametrize(
+    "prefix, expected",
+    [
+        ("/docs/v1/", "~^/docs/v1/(.*)$"),
+        ("/a-b.c/", r"~^/a\\-b\\.c/(.*)$"),
+        ("/test run/", r'"~^/test\\ run/(.*)$"'),
+    ],
+)
+def test_nginx_regex_for_prefix(prefix: str, expected: str) -> None:
+    assert nginx_regex_for_prefix(prefix) == expected
+
+
+@pytest.mark.parametrize(
+    "s, expected",
+    [
+        ("", ""),
+        ("/foo/bar.html", "/foo/bar.html"),
+        ("/test run/\t", "/test%20run/%09"),
+        ("#foo#", "%23foo#"),
+    ],
+)
+def test_apache_quote_for_rewrite_map(s: str, expected: str) -> None:
+    assert apache_quote_for_rewrite_map(s) == expected
+
+
+def test_builtin_redirect_page() -> None:
+    page = builtin_redirect_page("/a/</script>", "https://example.org/a/").decode()
+    assert '<link rel="canonical" href="https://example.org/a/">' in page
+    assert 'content="0; url=/a/&lt;/script&gt;"' in page
+    assert 'window.location.href = "/a/\\u003c/script\\u003e";' in page
+    assert '</script>"' not in page
+
+
+def test_gzip_compress() -> None:
+    compressed = gzip_compress(b"content")
+    assert gzip.decompress(compressed) == b"content"
+    assert gzip_compress(b"content") == compressed  # no timestamp
+
+
+def test_gzip_copy_file(tmp_path: Path) -> None:
+    content = bytes(random.randrange(256) for _ in range(300_000))
+    filename = tmp_path / "content"
+    filename.write_bytes(content)
+    compressed = []
+    for _ in range(2):
+        with open(tmp_path / "content.gz", "wb") as fp:
+            gzip_copy_file(os.fspath(filename), fp)
+        compressed.append((tmp_path / "content.gz").read_bytes())
+    assert gzip.decompress(compressed[0]) == content
+    assert compressed[1] == compressed[0]  # no timestamp
+
+
+def test_collapse_chains() -> None:
+    redirects = {
+        "/a/": "/b/",
+        "/b/": "/c/",
+        "/d/": "/b/",
+        "/x/": "/y/",
+        "/y/": "/z/",
+        "/z/": "/x/",
+        "/w/": "/x/",
+    }
+    final, cycles = collapse_chains(redirects)
+    assert final == {"/a/": "/c/", "/b/": "/c/", "/d/": "/c/"}
+    cycle = cycles["/x/"]
+    assert sorted(cycle) == ["/x/", "/y/", "/z/"]
+    assert cycles == dict.fromkeys(["/w/", "/x/", "/y/", "/z/"], cycle)
+
+
 def test_walk_records(pad: Pad) -> None:
     paths = {record.path for record in walk_records(pad)}
     assert paths == {
@@ -48,3 +140,62 @@ def test_walk_records(pad: Pad) -> None:
         "/about/more-detail",
         "/images/apple-pie.jpg",
     }
+
+
+def test_source_key(pad: Pad) -> None:
+    assert source_key(pad.get("/about")) == "/about"
+    assert source_key(pad.get_asset("/static/style.css")) == "/static/style.css"
+
+
+@pytest.mark.usefixtures("plugin")
+def test_collect_artifact_url_paths(pad: Pad) -> None:
+    url_paths = collect_artifact_url_paths(pad, [Redirect._generator])
+    assert url_paths == {
+        "/": "/",
+        "/.redirect.map": "/@redirect-map/.redirect.map",
+        "/about/": "/about",
+        "/about/more-detail/": "/about/more-detail",
+        "/images/": "/images",
+        "/images/apple-pie.jpg": "/images/apple-pie.jpg",
+        "/projects/": "/projects",
+        "/static/style.css": "/static/style.css",
+    }
+
+
+@pytest.mark.usefixtures("plugin")
+def test_collect_artifact_url_paths_includes_generated_sources(pad: Pad) -> None:
+    url_paths = collect_artifact_url_paths(pad)
+    assert url_paths["/details/"] == "/about/more-detail@redirect/details"
+
+
+@pytest.mark.parametrize("memory_budget", [0, 1000, 10**9])
+@pytest.mark.parametrize("count", [0, 1, 500])
+def test_external_sort(memory_budget: int, count: int) -> None:
+    rng = random.Random(42)
+    items = [(f"/{rng.random()}/", f'"{n}\u00e9') for n in range(count)]
+    with mock.patch.object(
+        tempfile, "TemporaryFile", wraps=tempfile.TemporaryFile
+    ) as temporary_file:
+        assert list(external_sort(iter(items), memory_budget)) == sorted(items)
+    if memory_budget == 0 and count > 0:
+        # Every item is spilled (and, past _MAX_RUNS runs, merged again)
+        assert temporary_file.call_count >= count
+    elif memory_budget == 10**9:
+        assert temporary_file.call_count == 0
+
+
+def test_sorted_items_in_memory() -> None:
+    items = [("b", "1"), ("a", "2")]
+    assert sorted_items(iter(items), 10**9) == [("a", "2"), ("b", "1")]
+
+
+def test_sorted_items_spilled() -> None:
+    items = [(f"/{n:04d}/\u00e9", f"/{n}") for n in reversed(range(2000))]
+    with mock.patch.object(util._SpilledRun, "_CHUNK_SIZE", 100):
+        spilled = sorted_items(iter(items), 1000)
+        assert not isinstance(spilled, list)
+        first = iter(spilled)
+        assert next(first) == items[-1]
+        # Can be iterated over repeatedly, and concurrently
+        assert list(spilled) == sorted(items)
+        assert list(first) == sorted(items)[1:]
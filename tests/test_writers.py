@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import io
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+from unittest import mock
+
+import pytest
+
+from lektor_redirect.writers import (
+    ApacheDbmMapWriter,
+    ApacheTxtMapWriter,
+    get_map_writer,
+    HAProxyMapWriter,
+    MapWriter,
+    NginxHashSizes,
+    NginxMapWriter,
+    register_map_writer,
+)
+
+from .conftest import ReporterCaptureFixture
+
+ENTRIES = [
+    ("/about/info/", "/about/more-detail/"),
+    ("/test run/", "/projects/"),
+]
+
+
+class StringArtifact:
+    def __init__(self) -> None:
+        self.buf = io.StringIO()
+
+    @contextmanager
+    def open(self, mode: str) -> Iterator[io.StringIO]:
+        assert mode == "w"
+        yield self.buf
+
+
+@pytest.mark.parametrize(
+    "format_name, writer_class",
+    [
+        ("nginx", NginxMapWriter),
+        ("txt", ApacheTxtMapWriter),
+        ("dbm", ApacheDbmMapWriter),
+        ("haproxy", HAProxyMapWriter),
+    ],
+)
+def test_get_map_writer(format_name: str, writer_class: type[MapWriter]) -> None:
+    assert type(get_map_writer(format_name)) is writer_class
+
+
+def test_get_map_writer_unknown() -> None:
+    with pytest.raises(RuntimeError, match=r"Unknown .*'bogus'.*\bnginx\b"):
+        get_map_writer("bogus")
+
+
+def test_register_map_writer() -> None:
+    with mock.patch.dict("lektor_redirect.writers._MAP_WRITERS"):
+
+        @register_map_writer
+        class CustomMapWriter(MapWriter):
+            format_name = "custom"
+
+        assert type(get_map_writer("custom")) is CustomMapWriter
+    with pytest.raises(RuntimeError):
+        get_map_writer("custom")
+
+
+def test_nginx_map_writer() -> None:
+    artifact = StringArtifact()
+    NginxMapWriter().write(artifact, ENTRIES)
+    assert artifact.buf.getvalue() == (
+        '/about/info/ /about/more-detail/;\n"/test run/" /projects/;\n'
+    )
+
+
+def test_nginx_map_writer_prefixes() -> None:
+    artifact = StringArtifact()
+    entries = [
+        ("/docs/*", "/manual/"),
+        ("/docs/v1/*", "/docs/v2/"),
+        ("/docs/v1/intro/", "/about/"),
+    ]
+    NginxMapWriter().write(artifact, entries)
+    assert artifact.buf.getvalue() == (
+        "/docs/v1/intro/ /about/;\n"
+        "~^/docs/v1/(.*)$ /docs/v2/$1;\n"
+        "~^/docs/(.*)$ /manual/$1;\n"
+    )
+
+
+def test_nginx_map_writer_regexes() -> None:
+    artifact = StringArtifact()
+    entries = [
+        ("/docs/v1/*", "/docs/v2/"),
+        (r"~^/node/\d{3}/$", "/about/"),
+        ("/x/", "/y/"),
+    ]
+    NginxMapWriter().write(artifact, entries)
+    assert artifact.buf.getvalue() == (
+        "/x/ /y/;\n" "~^/docs/v1/(.*)$ /docs/v2/$1;\n" '"~^/node/\\\\d{3}/$" /about/;\n'
+    )
+
+
+def test_apache_txt_map_writer_omits_prefixes(
+    captured_reports: ReporterCaptureFixture,
+) -> None:
+    artifact = StringArtifact()
+    ApacheTxtMapWriter().write(artifact, [*ENTRIES, ("/docs/v1/*", "/docs/v2/")])
+    assert artifact.buf.getvalue() == (
+        "/about/info/ /about/more-detail/\n/test%20run/ /projects/\n"
+    )
+    assert any("'/docs/v1/*'" in m for m in captured_reports.get_generic_messages())
+
+
+def test_apache_txt_map_writer() -> None:
+    artifact = StringArtifact()
+    ApacheTxtMapWriter().write(artifact, ENTRIES)
+    assert artifact.buf.getvalue() == (
+        "/about/info/ /about/more-detail/\n/test%20run/ /projects/\n"
+    )
+
+
+@pytest.mark.parametrize(
+    "writer, expected",
+    [
+        (NginxMapWriter(), "include a.map.d/0.map;\ninclude a.map.d/1.map;\n"),
+        (ApacheTxtMapWriter(), "a.map.d/0.map\na.map.d/1.map\n"),
+    ],
+)
+def test_write_index(writer: MapWriter, expected: str) -> None:
+    artifact = StringArtifact()
+    writer.write_index(artifact, ["a.map.d/0.map", "a.map.d/1.map"])
+    assert artifact.buf.getvalue() == expected
+
+
+class TestApacheDbmMapWriter:
+    def test_write(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        dbm_gnu = pytest.importorskip("dbm.gnu")
+        writer = ApacheDbmMapWriter()
+        monkeypatch.setattr(ApacheDbmMapWriter, "DBM_MODULES", ("dbm.gnu",))
+        output = tmp_path / "redirect.map"
+        artifact = mock.Mock(name="artifact")
+
+        def replace_with_file(filename: str, copy: bool = False) -> None:
+            assert copy
+            output.write_bytes(Path(filename).read_bytes())
+
+        artifact.replace_with_file.side_effect = replace_with_file
+        writer.write(artifact, ENTRIES)
+        with dbm_gnu.open(str(output), "r") as db:
+            assert {key: db[key] for key in db.keys()} == {
+                b"/about/info/": b"/about/more-detail/",
+                b"/test run/": b"/projects/",
+            }
+
+    def test_checksum_key(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        writer = ApacheDbmMapWriter()
+        monkeypatch.setattr(ApacheDbmMapWriter, "DBM_MODULES", ("dbm.dumb",))
+        assert writer.checksum_key == "dbm:dbm.dumb"
+
+    def test_no_dbm_module(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        writer = ApacheDbmMapWriter()
+        monkeypatch.setattr(ApacheDbmMapWriter, "DBM_MODULES", ("no_such_dbm",))
+        with pytest.raises(RuntimeError, match=r"requires one of .*\bno_such_dbm"):
+            writer.write(mock.Mock(name="artifact"), ENTRIES)
+
+    def test_multi_file_dbm_fails(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        writer = ApacheDbmMapWriter()
+        monkeypatch.setattr(ApacheDbmMapWriter, "DBM_MODULES", ("dbm.dumb",))
+        artifact = mock.Mock(name="artifact")
+        with pytest.raises(RuntimeError, match=r"not write a single file"):
+            writer.write(artifact, ENTRIES)
+        assert artifact.mock_calls == []
+
+
+class TestNginxHashSizes:
+    def test_from_keys_empty(self) -> None:
+        assert NginxHashSizes.from_keys([]) == NginxHashSizes(0, 0, 128, 2048)
+
+    def test_from_keys(self) -> None:
+        keys = [f"/blog/post-{n}/" for n in range(3000)]
+        # The longest key, "/blog/post-2999/", takes 8 + 24 = 32 bytes
+        assert NginxHashSizes.from_keys(keys) == NginxHashSizes(3000, 16, 256, 8192)
+
+    def test_long_keys(self) -> None:
+        sizes = NginxHashSizes.from_keys(["/" + "x" * 1000])
+        assert sizes.bucket_size >= 4 * 1010
+        assert sizes.bucket_size & (sizes.bucket_size - 1) == 0
+
+    def test_memory(self) -> None:
+        sizes = NginxHashSizes(3000, 16, 256, 8192)
+        assert sizes.memory == 8192 * 8 + 3000 * 32 + 3000 * 72
+
+    def test_get_hash_sizes_uses_quoted_keys(self) -> None:
+        sizes = NginxMapWriter().get_hash_sizes([("/a b/", "/c/"), ("/d/", "/e/")])
+        assert sizes.keys == 2
+        assert sizes.max_key_length == len('"/a b/"')
+
+    def test_write_hash_sizes(self) -> None:
+        artifact = StringArtifact()
+        NginxMapWriter().write_hash_sizes(artifact, NginxHashSizes(3000, 16, 256, 8192))
+        assert artifact.buf.getvalue() == (
+            "# 3000 keys, the longest of length 16\n"
+            "map_hash_bucket_size 256;\n"
+            "map_hash_max_size 8192;\n"
+        )